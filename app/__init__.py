@@ -1,4 +1,6 @@
 import os, secrets
+import click
+from datetime import timedelta
 from flask import Flask, redirect, url_for
 from flask_sqlalchemy import SQLAlchemy
 
@@ -13,6 +15,20 @@ def _normalize_db_url(url: str) -> str:
         url = f"{url}{sep}sslmode=require"
     return url
 
+def _engine_options(url: str) -> dict:
+    # Pool por worker (gunicorn: workers x (DB_POOL_SIZE + DB_MAX_OVERFLOW) conexiones)
+    opts = {"pool_pre_ping": os.getenv("DB_PRE_PING", "1") == "1",
+            "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800"))}
+    if url.startswith("sqlite"):
+        return opts              # SQLite: el pool por defecto del dialecto
+    opts.update(pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+                max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+                pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")))
+    timeout_ms = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+    if timeout_ms and url.startswith("postgresql"):
+        opts["connect_args"] = {"options": f"-c statement_timeout={timeout_ms}"}
+    return opts
+
 def create_app():
     app = Flask(__name__)
     app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", secrets.token_hex(16))
@@ -21,20 +37,214 @@ def create_app():
     db_url = _normalize_db_url(db_url)
     app.config["SQLALCHEMY_DATABASE_URI"] = db_url
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = _engine_options(db_url)
+
+    # Réplica de lectura para los listados que se refrescan seguido (replica.py); si falla,
+    # se lee de la primaria y se reintenta la réplica tras REPLICA_RETRY_S
+    replica_url = os.getenv("DATABASE_REPLICA_URL", "")
+    if replica_url:
+        replica_url = _normalize_db_url(replica_url)
+        app.config["SQLALCHEMY_BINDS"] = {"replica": {"url": replica_url, **_engine_options(replica_url)}}
+    app.config["REPLICA_RETRY_S"] = float(os.getenv("REPLICA_RETRY_S", "30"))
+
+    # Feed de cambios (/api/feed)
+    app.config["FEED_POLL_S"] = float(os.getenv("FEED_POLL_S", "1"))
+    app.config["FEED_STREAM_S"] = float(os.getenv("FEED_STREAM_S", "55"))
+    app.config["FEED_RETRY_MS"] = int(os.getenv("FEED_RETRY_MS", "1000"))
+    app.config["FEED_RETENTION_S"] = float(os.getenv("FEED_RETENTION_S", "3600"))
+
+    # Despacho: manual (el repartidor toma) o auto (al crear el pedido, el más cercano)
+    app.config["DISPATCH_MODE"] = os.getenv("DISPATCH_MODE", "manual")
+    app.config["DISPATCH_MAX_KM"] = float(os.getenv("DISPATCH_MAX_KM", "8"))
+    app.config["DISPATCH_MAX_ACTIVE"] = int(os.getenv("DISPATCH_MAX_ACTIVE", "1"))
+    app.config["DISPATCH_STALE_S"] = float(os.getenv("DISPATCH_STALE_S", "900"))
+    app.config["DISPATCH_BATCH"] = int(os.getenv("DISPATCH_BATCH", "200"))
+
+    # POST /api/orders/batch y PUT /api/drivers/batch quedan deshabilitados si no hay clave
+    app.config["ORDERS_API_KEY"] = os.getenv("ORDERS_API_KEY", "")
+    app.config["FLEET_API_KEY"] = os.getenv("FLEET_API_KEY", "")
+    app.config["MENU_API_KEY"] = os.getenv("MENU_API_KEY", "")           # PUT /api/menu
+    app.config["DISPATCH_API_KEY"] = os.getenv("DISPATCH_API_KEY", "")   # POST /api/dispatch/run
+
+    # Catálogo (menu_items) con el que se cobran los pedidos
+    app.config["RESTAURANT_ID"] = os.getenv("RESTAURANT_ID", "main")
+
+    # Pings GPS: "buffer" (última posición en memoria + upsert en lote) o "direct"
+    app.config["DRIVER_LOC_MODE"] = os.getenv("DRIVER_LOC_MODE", "buffer")
+    app.config["LOC_FLUSH_S"] = float(os.getenv("LOC_FLUSH_S", "2"))
+
+    # Historial de ubicaciones (GET /api/drivers/<phone>/track)
+    app.config["TRACK_CHUNK_PINGS"] = int(os.getenv("TRACK_CHUNK_PINGS", "256"))
+    app.config["TRACK_FLUSH_S"] = float(os.getenv("TRACK_FLUSH_S", "30"))
+    app.config["TRACK_RETENTION_DAYS"] = int(os.getenv("TRACK_RETENTION_DAYS", "30"))
+
+    # Hora local (Lima) para ETA por hora del día y estadísticas "de hoy"
+    app.config["UTC_OFFSET_H"] = int(os.getenv("UTC_OFFSET_H", "-5"))
+
+    # ETA aprendido (velocidad por zona y hora, ver eta.py)
+    app.config["ETA_DEFAULT_KMH"] = float(os.getenv("ETA_DEFAULT_KMH", "25"))
+    app.config["ETA_REFRESH_S"] = float(os.getenv("ETA_REFRESH_S", "300"))
+
+    # Estadísticas del panel (GET /api/stats): cada cuánto se recalculan desde las tablas
+    app.config["STATS_RECONCILE_S"] = float(os.getenv("STATS_RECONCILE_S", "600"))
+    app.config["STATS_CLIENTS_RECONCILE_S"] = float(os.getenv("STATS_CLIENTS_RECONCILE_S", "3600"))
+
+    # PIN (auth.py): token buckets por IP y por teléfono, compartidos entre workers
+    app.config["PIN_BURST_PHONE"] = int(os.getenv("PIN_BURST_PHONE", "5"))
+    app.config["PIN_REFILL_PHONE_S"] = float(os.getenv("PIN_REFILL_PHONE_S", "60"))
+    app.config["PIN_BURST_IP"] = int(os.getenv("PIN_BURST_IP", "30"))
+    app.config["PIN_REFILL_IP_S"] = float(os.getenv("PIN_REFILL_IP_S", "2"))
+    app.config["RATE_LIMIT_PATH"] = os.getenv("RATE_LIMIT_PATH", "")
+    # Proxies delante (Railway/Render/Heroku: 1) para que remote_addr sea la IP del cliente
+    app.config["PROXY_HOPS"] = int(os.getenv("PROXY_HOPS", "1"))
+    if app.config["PROXY_HOPS"]:
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["PROXY_HOPS"], x_proto=app.config["PROXY_HOPS"])
+
+    # Archivo (archive.py): pedidos terminados con más de ARCHIVE_AFTER_DAYS pasan a tablas
+    # por mes; cada ARCHIVE_EVERY_S hasta ARCHIVE_MAX_BATCHES lotes de ARCHIVE_BATCH
+    app.config["ARCHIVE_AFTER_DAYS"] = float(os.getenv("ARCHIVE_AFTER_DAYS", "14"))
+    app.config["ARCHIVE_EVERY_S"] = float(os.getenv("ARCHIVE_EVERY_S", "300"))
+    app.config["ARCHIVE_BATCH"] = int(os.getenv("ARCHIVE_BATCH", "500"))
+    app.config["ARCHIVE_MAX_BATCHES"] = int(os.getenv("ARCHIVE_MAX_BATCHES", "20"))
+
+    # Idempotency-Key en altas y asignaciones (idempotency.py): cuánto se guarda la respuesta,
+    # tras cuánto se retoma una reserva abandonada y tope del LRU por worker (0 = sin soporte)
+    app.config["IDEMPOTENCY_TTL_S"] = float(os.getenv("IDEMPOTENCY_TTL_S", "86400"))
+    app.config["IDEMPOTENCY_LOCK_S"] = float(os.getenv("IDEMPOTENCY_LOCK_S", "60"))
+    app.config["IDEMPOTENCY_CACHE_MB"] = float(os.getenv("IDEMPOTENCY_CACHE_MB", "8"))
+
+    # Sesiones (sessions.py): vida en el servidor y limpieza de vencidas
+    app.config["SESSION_DAYS"] = int(os.getenv("SESSION_DAYS", "30"))
+    app.config["SESSION_EVICT_S"] = float(os.getenv("SESSION_EVICT_S", "3600"))
+
+    # Métricas por endpoint (metrics.py): GET /metrics (Prometheus). METRICS_SAMPLE es la
+    # fracción de peticiones con captura completa de sentencias (GET /metrics/requests)
+    app.config["METRICS_ENABLED"] = os.getenv("METRICS_ENABLED", "1") == "1"
+    app.config["METRICS_SAMPLE"] = float(os.getenv("METRICS_SAMPLE", "0"))
+    app.config["METRICS_NPLUS1"] = int(os.getenv("METRICS_NPLUS1", "5"))
+    app.config["METRICS_FLUSH_S"] = float(os.getenv("METRICS_FLUSH_S", "15"))
+    app.config["METRICS_DIR"] = os.getenv("METRICS_DIR", "")
+    app.config["METRICS_API_KEY"] = os.getenv("METRICS_API_KEY", "")
+    app.config["METRICS_PUBLIC"] = os.getenv("METRICS_PUBLIC", "0") == "1"     # /metrics sin clave
+
+    # Respuestas de /api (serial.py): orjson (JSON_FAST=0 para la stdlib) y brotli/gzip
+    # desde COMPRESS_MIN_BYTES (0 = sin compresión)
+    app.config["JSON_FAST"] = os.getenv("JSON_FAST", "1") == "1"
+    app.config["COMPRESS_MIN_BYTES"] = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+    app.config["COMPRESS_GZIP_LEVEL"] = int(os.getenv("COMPRESS_GZIP_LEVEL", "5"))
+    app.config["COMPRESS_BR_QUALITY"] = int(os.getenv("COMPRESS_BR_QUALITY", "4"))
+
+    # Modo ASGI (asgi.py, uvicorn): hilos por worker para las rutas de Flask; el feed SSE
+    # no ocupa ninguno. Conviene <= DB_POOL_SIZE + DB_MAX_OVERFLOW
+    app.config["ASGI_THREADS"] = int(os.getenv("ASGI_THREADS", "16"))
+
+    # SQLite en producción (varios workers sobre un archivo): pragmas por conexión y cola
+    # de escritura con group commit (writer.py). SQLITE_MODE=plain deja el comportamiento anterior.
+    app.config["SQLITE_MODE"] = os.getenv("SQLITE_MODE", "tuned")
+    app.config["SQLITE_BUSY_MS"] = int(os.getenv("SQLITE_BUSY_MS", "5000"))
+    app.config["SQLITE_MMAP_MB"] = int(os.getenv("SQLITE_MMAP_MB", "256"))
+    app.config["SQLITE_WRITE_QUEUE"] = app.config["SQLITE_MODE"] == "tuned" and os.getenv("SQLITE_WRITE_QUEUE", "1") == "1"
+    app.config["SQLITE_WRITE_BATCH"] = int(os.getenv("SQLITE_WRITE_BATCH", "64"))
 
     db.init_app(app)
+    if db_url.startswith("sqlite") and app.config["SQLITE_MODE"] == "tuned":
+        from .dbutil import tune_sqlite
+        with app.app_context():
+            tune_sqlite(db.engine, app.config["SQLITE_BUSY_MS"], app.config["SQLITE_MMAP_MB"])
+    from . import serial, writer
+    writer.init(app)
+    serial.init(app)
+
+    from .jobs import Scheduler
+    from .locbuf import buffer as loc_buffer
+    jobs = Scheduler(app)
+    from . import metrics
+    metrics.init(app, jobs)
+    jobs.every("loc_flush", app.config["LOC_FLUSH_S"], loc_buffer.flush, at_exit=True)
+    from . import track
+    track.store.chunk_pings = app.config["TRACK_CHUNK_PINGS"]
+    jobs.every("track_flush", app.config["TRACK_FLUSH_S"], track.store.flush, at_exit=True)
+    jobs.every("track_prune", 3600, lambda: track.prune(app.config["TRACK_RETENTION_DAYS"]))
+    from . import eta
+    eta.model.default = app.config["ETA_DEFAULT_KMH"]
+    eta.model.offset = timedelta(hours=app.config["UTC_OFFSET_H"])
+    jobs.every("eta_refresh", app.config["ETA_REFRESH_S"], eta.refresh, at_start=True)
+    from . import stats
+    jobs.every("stats_reconcile", app.config["STATS_RECONCILE_S"], stats.reconcile, at_start=True)
+    jobs.every("stats_clients", app.config["STATS_CLIENTS_RECONCILE_S"], stats.reconcile_clients)
+    from . import archive
+    jobs.every("archive", app.config["ARCHIVE_EVERY_S"], lambda: archive.run(
+        app.config["ARCHIVE_AFTER_DAYS"], app.config["ARCHIVE_BATCH"], app.config["ARCHIVE_MAX_BATCHES"]))
 
     # Importa modelos para que SQLAlchemy conozca las tablas
     from . import models  # noqa
 
-    # En producción con Postgres, evita crear tablas “a ciegas”.
-    # Déjalo activado solo si usas SQLite local o sabes que es seguro:
+    # En producción con Postgres, evita migrar “a ciegas”: corre `flask --app wsgi migrate`
+    # en el release. Con SQLite se aplica solo (tablas + índices), un worker a la vez; si una
+    # migración falla el worker no arranca: no se sirve con el esquema a medias.
+    from . import migrations
     if db_url.startswith("sqlite:///"):
         with app.app_context():
             try:
-                db.create_all()
+                migrations.upgrade(log=app.logger.info)
             except Exception as e:
-                app.logger.warning(f"No se pudieron crear tablas automáticamente: {e}")
+                app.logger.error(f"Migración fallida, no se arranca: {e}")
+                raise
+
+    # Sesiones del lado servidor. Sin SECRET_KEY en el entorno, la clave sale de la DB y es
+    # la misma en todos los workers (antes cada uno generaba la suya y las cookies fallaban).
+    from . import sessions
+    if not os.getenv("SECRET_KEY"):
+        with app.app_context():
+            try:
+                app.config["SECRET_KEY"] = sessions.shared_secret()
+            except Exception as e:
+                app.logger.warning(f"SECRET_KEY compartida no disponible (¿falta migrar?): {e}")
+    app.session_interface = sessions.DbSessionInterface(timedelta(days=app.config["SESSION_DAYS"]))
+    jobs.every("session_evict", app.config["SESSION_EVICT_S"], sessions.evict)
+    from . import idempotency
+    idempotency.init(app)
+    jobs.every("idempotency_evict", 3600, idempotency.evict)
+    from . import auth
+    auth.init(app)
+
+    @app.cli.command("migrate")
+    def migrate_cmd():
+        applied = migrations.upgrade()
+        print(f"Aplicadas: {applied}" if applied else "Esquema al día")
+
+    @app.cli.command("eta-rebuild")
+    def eta_rebuild_cmd():
+        from . import eta
+        print(f"eta_speeds: {eta.rebuild()} celdas")
+
+    @app.cli.command("stats-reconcile")
+    def stats_reconcile_cmd():
+        from . import stats
+        fix = stats.reconcile()
+        if fix is None: print("Otro worker está reconciliando; reintenta")
+        else: print(f"Contadores corregidos: {fix}" if fix else "Contadores al día")
+        n = stats.reconcile_clients()
+        print("Clientes: otro worker está reconciliando" if n is None else f"Clientes corregidos: {n}")
+
+    @app.cli.command("events-rebuild")
+    @click.option("--dry-run", is_flag=True, help="Solo cuenta lo que corregiría")
+    def events_rebuild_cmd(dry_run):
+        from . import events
+        fix = events.rebuild(dry_run=dry_run)
+        print(f"{'A corregir' if dry_run else 'Corregidos'}: pedidos {fix['orders']}, "
+              f"repartidores {fix['drivers']}, clientes {fix['clients']}")
+
+    @app.cli.command("archive")
+    def archive_cmd():
+        from . import archive
+        total = 0
+        while True:
+            n = archive.run(app.config["ARCHIVE_AFTER_DAYS"], app.config["ARCHIVE_BATCH"], 100)
+            total += n
+            if n < app.config["ARCHIVE_BATCH"] * 100: break
+        print(f"Pedidos archivados: {total}")
 
     # Blueprints (no deben lanzar excepción en import)
     def try_bp(import_path, attr, url_prefix=None):
@@ -50,6 +260,9 @@ def create_app():
     try_bp("app.web.repartidor", "repartidor_bp")
     try_bp("app.web.restaurante", "restaurante_bp")
 
+    from .base import init_templates
+    init_templates(app)
+
     @app.route("/ping")
     def ping():
         return "pong", 200
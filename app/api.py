@@ -1,16 +1,29 @@
-from flask import Blueprint, request, jsonify, session
-from . import db
-from .models import Client, AuthPin, Address, Order, OrderItem, Driver
-from .utils import sanitize_phone, looks_valid_phone, hash_pin, haversine_km
-from datetime import datetime
+import base64, hmac, itertools, json, time
+from flask import Blueprint, Response, current_app, request, jsonify, session, stream_with_context
+from sqlalchemy import and_, bindparam, case, func, insert, or_, update
+from sqlalchemy.orm import joinedload, selectinload
+from . import archive, auth, db, dispatch, events, feed, geo, locbuf, replica, serial, stats, track, writer
+from .catalog import catalog, parse_items as parse_menu, upsert as upsert_menu
+from .eta import model as eta_model, record as learn_eta
+from .idempotency import idempotent
+from .dbutil import insert_for
+from .models import Client, Address, Order, OrderItem, Driver
+from .utils import sanitize_phone, looks_valid_phone, haversine_km
+from datetime import datetime, timedelta
 
 api_bp = Blueprint("api", __name__)
+api_bp.after_request(serial.compress)      # brotli/gzip de las respuestas grandes
 
 def require_session_json():
     cid = session.get("cid")
     return (cid, None) if cid else (None, (jsonify(error="No autorizado"), 401))
 
 # Auth PIN
+def _too_many(wait):
+    r = jsonify(ok=False, error="Demasiados intentos, espera un momento")
+    r.headers["Retry-After"] = str(int(wait) + 1)
+    return r, 429
+
 @api_bp.post("/auth/pin")
 def api_create_pin():
     d = request.get_json(force=True)
@@ -18,14 +31,9 @@ def api_create_pin():
     pin = str(d.get("pin","")).strip()
     if not looks_valid_phone(phone) or not (pin.isdigit() and len(pin)==4):
         return jsonify(error="Datos inválidos"), 400
-    c = Client.query.filter_by(phone=phone).first()
-    if not c:
-        c = Client(phone=phone); db.session.add(c); db.session.commit()
-    h = hash_pin(phone, pin)
-    ap = AuthPin.query.filter_by(client_id=c.id).first()
-    if ap: ap.pin_hash = h
-    else: db.session.add(AuthPin(client_id=c.id, pin_hash=h))
-    db.session.commit()
+    wait = auth.throttle(request.remote_addr)
+    if wait: return _too_many(wait)
+    auth.set_pin(phone, pin)
     return jsonify(ok=True)
 
 @api_bp.post("/auth/verify")
@@ -33,15 +41,42 @@ def api_verify_pin():
     d = request.get_json(force=True)
     phone = sanitize_phone(d.get("phone",""))
     pin = str(d.get("pin","")).strip()
-    c = Client.query.filter_by(phone=phone).first()
-    if not c: return jsonify(ok=False), 401
-    ap = AuthPin.query.filter_by(client_id=c.id).first()
-    if not ap or ap.pin_hash != hash_pin(phone, pin):
+    if not looks_valid_phone(phone) or not (pin.isdigit() and len(pin)==4):
         return jsonify(ok=False), 401
-    session["cid"] = c.id
+    wait = auth.throttle(request.remote_addr, phone)
+    if wait: return _too_many(wait)
+    cid = auth.verify(phone, pin)
+    if not cid: return jsonify(ok=False), 401
+    session["cid"] = cid
     session["phone"] = phone
     return jsonify(ok=True)
 
+# Menú: versión = hash del contenido, sirve como ETag (304 si no cambió)
+@api_bp.get("/menu")
+def api_menu():
+    snap = catalog.get(request.args.get("restaurant") or current_app.config["RESTAURANT_ID"])
+    if not snap.items: return jsonify(error="Restaurante no existe"), 404
+    r = Response(snap.body, mimetype="application/json")
+    r.set_etag(snap.version)
+    r.headers["Cache-Control"] = "no-cache"
+    return r.make_conditional(request)
+
+@api_bp.put("/menu")
+def api_menu_put():
+    key = current_app.config["MENU_API_KEY"]
+    if not key or not hmac.compare_digest(request.headers.get("X-Api-Key", ""), key):
+        return jsonify(error="No autorizado"), 401
+    d = request.get_json(force=True)
+    restaurant = (d.get("restaurant") if isinstance(d, dict) else None) or current_app.config["RESTAURANT_ID"]
+    try:
+        rows = parse_menu(d.get("items") if isinstance(d, dict) else None)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    upsert_menu(restaurant, rows)
+    db.session.commit()
+    catalog.invalidate(restaurant)
+    return jsonify(ok=True, version=catalog.get(restaurant).version)
+
 # Direcciones
 @api_bp.get("/addresses")
 def api_addresses_get():
@@ -93,103 +128,603 @@ def api_addresses_delete():
     return jsonify(ok=True)
 
 # Pedidos
+# ?include=items,client en los listados: una consulta más por relación para toda la
+# página (IN sobre los ids), nunca una por pedido
+INCLUDES = ("items", "client")
+
+def _includes():
+    inc = {x for x in request.args.get("include", "").split(",") if x}
+    if inc - set(INCLUDES): raise ValueError(f"include admite {','.join(INCLUDES)}")
+    return inc
+
+def _item_json(it):
+    return {"id":it.item_id, "name":it.name, "qty":it.qty, "price":it.price}
+
+def _client_json(c):
+    return {"id":c.id, "phone":c.phone, "name":c.display_name}
+
+def _extras(s, rows, inc, parts=None):
+    # Para listados por columnas: {order_id: [ítems]} y {client_id: cliente}. parts: las
+    # tablas (caliente + meses archivados) de donde salió la página
+    items, clients = {}, {}
+    ids = [r.id for r in rows]
+    if "items" in inc and ids:
+        for it in archive.items(s, ids, parts or archive.parts(cold=False)):
+            items.setdefault(it.order_id, []).append(_item_json(it))
+    if "client" in inc and ids:
+        clients = {c.id: _client_json(c) for c in s.query(Client.id, Client.phone, Client.display_name)
+                   .filter(Client.id.in_({r.client_id for r in rows}))}
+    return items, clients
+
 @api_bp.get("/orders")
 def api_orders_new():
-    rows = Order.query.filter_by(status="new").order_by(Order.created_at.desc()).all()
-    return jsonify(ok=True, orders=[{
-        "id":o.id, "address":o.address, "total":o.total,
-        "lat":o.lat, "lon":o.lon, "created_at":o.created_at.isoformat()
-    } for o in rows])
+    try:
+        inc = _includes()
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    if request.args.get("near"):
+        return _orders_near(inc)
+
+    def page(s, seq):
+        rows = (s.query(*NEW_COLS).filter(Order.status == "new").order_by(Order.created_at.desc()).all())
+        return jsonify(ok=True, orders=_new_orders(s, rows, inc), feed=seq)
+    return replica.read(page)
+
+# Pedidos nuevos (/api/orders y ?near=): solo las columnas que se devuelven, como tuplas
+NEW_COLS = (Order.id, Order.client_id, Order.address, Order.total, Order.lat, Order.lon, Order.created_at)
+
+def _new_orders(s, rows, inc, dist=None):
+    items, clients = _extras(s, rows, inc)
+    out = []
+    for k, o in enumerate(rows):
+        x = {"id":o.id, "address":o.address, "total":o.total, "lat":o.lat, "lon":o.lon, "created_at":o.created_at}
+        if dist is not None: x["dist_km"] = round(float(dist[k]), 3)
+        if "items" in inc: x["items"] = items.get(o.id, [])
+        if "client" in inc: x["client"] = clients.get(o.client_id)
+        out.append(x)
+    return out
+
+@api_bp.get("/orders/<int:order_id>")
+def api_order_detail(order_id: int):
+    # Pedido con ítems y cliente: 2 consultas (join al cliente + selectin de ítems); si ya
+    # no está en la tabla caliente se busca en los meses archivados
+    o = (Order.query.options(joinedload(Order.client), selectinload(Order.items))
+         .filter_by(id=order_id).first())
+    if o:
+        its, client = o.items, o.client
+    else:
+        cold = archive.find(db.session, order_id)
+        if not cold: return jsonify(error="Pedido no existe"), 404
+        o, its = cold
+        client = db.session.get(Client, o.client_id)
+    return jsonify(ok=True, order={
+        "id":o.id, "status":o.status, "address":o.address, "lat":o.lat, "lon":o.lon, "total":o.total,
+        "assigned_driver":o.assigned_driver, "eta_min":o.eta_min, "dist_km":o.dist_km,
+        "created_at":o.created_at, "assigned_at":o.assigned_at, "delivered_at":o.delivered_at,
+        "items":[_item_json(it) for it in its], "client":_client_json(client) if client else None})
+
+def _orders_near(inc):
+    # ?near=lat,lon&radius_km=: pedidos nuevos dentro del radio, del más cercano al más lejano
+    try:
+        lat, lon = (float(x) for x in request.args["near"].split(","))
+        radius = float(request.args.get("radius_km", 5))
+    except ValueError:
+        return jsonify(error="near debe ser lat,lon"), 400
+    lat0, lat1, lon0, lon1 = geo.bbox(lat, lon, radius)
+
+    def page(s, seq):
+        rows = (s.query(*NEW_COLS)
+                .filter(Order.status == "new", Order.lat.between(lat0, lat1), Order.lon.between(lon0, lon1)).all())
+        idx, dist = geo.knn(lat, lon, [o.lat for o in rows], [o.lon for o in rows], radius_km=radius)
+        return jsonify(ok=True, orders=_new_orders(s, [rows[i] for i in idx], inc, dist), feed=seq)
+    return replica.read(page)
+
+# Paginación keyset sobre (created_at, id): el cursor es opaco para el cliente
+def _encode_cursor(ts, oid):
+    return base64.urlsafe_b64encode(f"{ts.isoformat()}|{oid}".encode()).decode().rstrip("=")
+
+def _decode_cursor(s):
+    raw = base64.urlsafe_b64decode(s + "=" * (-len(s) % 4)).decode()
+    ts, oid = raw.split("|")
+    return datetime.fromisoformat(ts), int(oid)
+
+ORDER_COLS = ("id", "status", "address", "total", "assigned_driver", "eta_min", "created_at")
 
 @api_bp.get("/orders/all")
 def api_orders_all():
-    rows = Order.query.order_by(Order.created_at.desc()).all()
-    return jsonify(ok=True, orders=[{
-        "id":o.id, "status":o.status, "address":o.address, "total":o.total,
-        "assigned_driver":o.assigned_driver, "eta_min":o.eta_min,
-        "created_at":o.created_at.isoformat()
-    } for o in rows])
+    a = request.args
+    try:
+        limit = min(max(int(a.get("limit", 50)), 1), 500)
+        after = _decode_cursor(a["cursor"]) if a.get("cursor") else None
+        since = datetime.fromisoformat(a["from"]) if a.get("from") else None
+        until = datetime.fromisoformat(a["to"]) if a.get("to") else None
+        inc = _includes()
+    except (ValueError, UnicodeDecodeError):
+        return jsonify(error="Parámetros inválidos"), 400
+
+    statuses = a["status"].split(",") if a.get("status") else None
+    driver = sanitize_phone(a["assigned_driver"]) if a.get("assigned_driver") else None
+
+    def where(t):
+        w = []
+        if statuses: w.append(t.c.status.in_(statuses))
+        if driver: w.append(t.c.assigned_driver == driver)
+        return w
+    # Solo estados vivos (el panel): basta la tabla caliente
+    cold = not statuses or any(st in archive.TERMINAL for st in statuses)
+    return replica.read(lambda s, seq: _order_page(s, seq, where, limit, after, since, until, inc, cold))
+
+def _order_page(s, seq, where, limit, after, since, until, inc, cold=True):
+    # Página keyset por (created_at, id) sobre la tabla caliente y los meses archivados
+    def conds(t):
+        w = where(t)
+        if since: w.append(t.c.created_at >= since)
+        if until: w.append(t.c.created_at < until)
+        if after:
+            ts, oid = after
+            w.append(or_(t.c.created_at < ts, and_(t.c.created_at == ts, t.c.id < oid)))
+        return w
+    upto = min(filter(None, (until, after and after[0] + timedelta(microseconds=1))), default=None)
+    rows, parts = archive.page(s, ORDER_COLS + ("client_id",), conds, limit + 1, since, upto, cold)
+    nxt = _encode_cursor(rows[limit - 1].created_at, rows[limit - 1].id) if len(rows) > limit else None
+    rows = rows[:limit]
+    items, clients = _extras(s, rows, inc, parts)
+    extra = [c for c in INCLUDES if c in inc]       # columnas extra al final, en orden fijo
+    n = len(ORDER_COLS)
+    return jsonify(ok=True, cols=ORDER_COLS + tuple(extra), rows=[
+        [*o[:n], *(items.get(o.id, []) if c == "items" else clients.get(o.client_id) for c in extra)]
+        for o in rows], next=nxt, feed=seq)
+
+# Historial del cliente (incluye lo archivado); mismos parámetros que /orders/all
+@api_bp.get("/orders/mine")
+def api_orders_mine():
+    cid, err = require_session_json()
+    if err: return err
+    a = request.args
+    try:
+        limit = min(max(int(a.get("limit", 20)), 1), 100)
+        after = _decode_cursor(a["cursor"]) if a.get("cursor") else None
+        inc = _includes()
+    except (ValueError, UnicodeDecodeError):
+        return jsonify(error="Parámetros inválidos"), 400
+    return _order_page(db.session, feed.head(), lambda t: [t.c.client_id == cid], limit, after, None, None, inc)
+
+def _price_items(items):
+    # Precios del catálogo en cache (lo que manda el navegador no se usa). Ítems por id;
+    # por nombre para integraciones que aún mandan {"name": ...}.
+    if not isinstance(items, list) or not items: raise ValueError("Datos inválidos")
+    snap = catalog.get(current_app.config["RESTAURANT_ID"])
+    out, total = [], 0.0
+    for it in items:
+        try:
+            qty = int(it.get("qty", 0))
+            item_id = int(it["id"]) if it.get("id") is not None else None
+        except (AttributeError, TypeError, ValueError): raise ValueError("Datos inválidos")
+        if qty <= 0: continue
+        m = snap.find(item_id, it.get("name"))
+        if not m: raise ValueError(f"Producto no disponible: {it.get('name') or item_id}")
+        out.append((m["id"], m["name"], qty, m["price"])); total += m["price"] * qty
+    if not out: raise ValueError("Datos inválidos")
+    return out, round(total, 2)
+
+def _parse_order(d):
+    # ValueError con un mensaje apto para el cliente si algo no cuadra
+    try:
+        addr = (d.get("address") or "").strip()
+        lat, lon = float(d["lat"]), float(d["lon"])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        raise ValueError("Datos inválidos")
+    if not addr: raise ValueError("Datos inválidos")
+    items, total = _price_items(d.get("items"))
+    return {"address":addr, "lat":lat, "lon":lon, "items":items, "total":total}
+
+def _insert_orders(specs):
+    # Escritura en lote: un INSERT ... RETURNING para los pedidos, un executemany para los
+    # ítems y otro para el feed. specs: dicts de _parse_order con client_id. Sin commit.
+    now = datetime.utcnow()
+    rows = [{"client_id":sp["client_id"], "address":sp["address"], "lat":sp["lat"], "lon":sp["lon"],
+             "total":sp["total"], "status":"new", "created_at":now} for sp in specs]
+    ids = db.session.execute(insert(Order).returning(Order.id, sort_by_parameter_order=True), rows).scalars().all()
+    db.session.execute(insert(OrderItem), [
+        {"order_id":oid, "item_id":item_id, "name":name, "qty":qty, "price":price}
+        for oid, sp in zip(ids, specs) for item_id, name, qty, price in sp["items"]])
+    for oid, r in zip(ids, rows):
+        r.update(id=oid, assigned_driver=None, eta_min=None)
+    feed.log_orders(rows)
+    events.record_created(rows)
+    stats.on_created(rows)
+    return ids
+
+def _bump_clients(specs):
+    # Contadores del cliente con UPDATE atómico (order_count = order_count + n), uno por cliente
+    per = {}
+    for sp in specs:
+        p = per.setdefault(sp["client_id"], {"cid":sp["client_id"], "n":0, "amount":0.0})
+        p["n"] += 1; p["amount"] += sp["total"]
+        p.update(addr=sp["address"], la=sp["lat"], lo=sp["lon"])
+    c = Client.__table__.c
+    stmt = (update(Client.__table__).where(c.id == bindparam("cid")).values(
+        order_count=func.coalesce(c.order_count, 0) + bindparam("n"),
+        lifetime_value=func.round(func.coalesce(c.lifetime_value, 0) + bindparam("amount"), 2),
+        last_order_at=datetime.utcnow(), default_address=bindparam("addr"),
+        last_lat=bindparam("la"), last_lon=bindparam("lo")))
+    params = list(per.values())
+    return db.session.execute(stmt, params[0] if len(params) == 1 else params).rowcount
 
 @api_bp.post("/orders")
+@idempotent
 def api_orders_create():
     cid, err = require_session_json()
     if err: return err
+    try:
+        sp = _parse_order(request.get_json(force=True))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    sp["client_id"] = cid
+
+    def write():
+        if not _bump_clients([sp]): return None
+        return _insert_orders([sp])[0]
+    oid = writer.run(write)
+    if oid is None: return jsonify(error="No autorizado"), 401
+    if current_app.config["DISPATCH_MODE"] == "auto":
+        best = dispatch.index().nearest(sp["lat"], sp["lon"], k=1, max_km=current_app.config["DISPATCH_MAX_KM"])
+        if best:
+            got = writer.run(lambda: _claim(oid, sp["lat"], sp["lon"], best[0][1]))
+            if got:
+                dispatch.touch(got[0])
+                return jsonify(ok=True, order={"id":oid, "total":sp["total"], "driver":got[0].phone, "eta_min":got[1]})
+    return jsonify(ok=True, order={"id":oid, "total":sp["total"]})
+
+# Alta masiva para call center / agregadores: {"orders":[{phone, address, lat, lon, items}]}
+@api_bp.post("/orders/batch")
+def api_orders_batch():
+    key = current_app.config["ORDERS_API_KEY"]
+    if not key or not hmac.compare_digest(request.headers.get("X-Api-Key", ""), key):
+        return jsonify(error="No autorizado"), 401
     d = request.get_json(force=True)
-    addr = (d.get("address") or "").strip()
-    lat, lon = d.get("lat"), d.get("lon")
-    items = d.get("items") or []
-    if not addr or lat is None or lon is None or not isinstance(items, list) or not items:
-        return jsonify(error="Datos inválidos"), 400
-    total = 0.0
-    for it in items:
-        total += float(it.get("price",0)) * int(it.get("qty",0))
-    o = Order(client_id=cid, address=addr, lat=float(lat), lon=float(lon), total=round(total,2))
-    db.session.add(o); db.session.flush()
-    for it in items:
-        if int(it.get("qty",0))>0:
-            db.session.add(OrderItem(order_id=o.id, name=it.get("name"), qty=int(it["qty"]), price=float(it.get("price",0))))
-    c = Client.query.get(cid)
-    c.last_order_at = datetime.utcnow()
-    c.order_count = (c.order_count or 0) + 1
-    c.lifetime_value = round((c.lifetime_value or 0) + total, 2)
-    c.default_address = addr; c.last_lat=float(lat); c.last_lon=float(lon)
-    db.session.commit()
-    return jsonify(ok=True, order={"id":o.id, "total":o.total})
+    raw = d.get("orders") if isinstance(d, dict) else None
+    if not isinstance(raw, list) or not raw or len(raw) > 500:
+        return jsonify(error="Envía entre 1 y 500 pedidos"), 400
+    specs = []
+    for i, o in enumerate(raw):
+        try:
+            sp = _parse_order(o)
+            sp["phone"] = sanitize_phone(str(o.get("phone") or ""))
+            if not looks_valid_phone(sp["phone"]): raise ValueError("Teléfono inválido")
+        except ValueError as e:
+            return jsonify(error=f"Pedido {i}: {e}"), 400
+        specs.append(sp)
+    phones = {sp["phone"] for sp in specs}
+
+    def write():
+        ids = dict(db.session.query(Client.phone, Client.id).filter(Client.phone.in_(phones)).all())
+        missing = sorted(phones - ids.keys())
+        if missing:
+            new = db.session.execute(insert(Client).returning(Client.phone, Client.id, sort_by_parameter_order=True),
+                                     [{"phone":ph, "order_count":0, "lifetime_value":0.0} for ph in missing]).all()
+            ids.update(dict(new))
+        for sp in specs: sp["client_id"] = ids[sp["phone"]]
+        _bump_clients(specs)
+        return _insert_orders(specs)
+    oids = writer.run(write)
+    return jsonify(ok=True, orders=[{"id":oid, "total":sp["total"]} for oid, sp in zip(oids, specs)])
+
+# Columnas que necesita feed.order_delta, para armar el delta desde un RETURNING
+ORDER_FEED_COLS = (Order.id, Order.status, Order.address, Order.total, Order.lat, Order.lon,
+                   Order.assigned_driver, Order.eta_min, Order.created_at)
+DRIVER_FEED_COLS = (Driver.phone, Driver.lat, Driver.lon, Driver.status, Driver.active_orders)
+
+def _driver_pos(phone):
+    lat = lon = None
+    p = locbuf.buffer.get(phone)              # posición aún sin volcar a la DB
+    if p: lat, lon = p[0], p[1]
+    if lat is None or lon is None:
+        r = db.session.query(Driver.lat, Driver.lon).filter_by(phone=phone).first()
+        if r:
+            lat = r.lat if lat is None else lat; lon = r.lon if lon is None else lon
+    return lat, lon
+
+def _take_driver(phone, now):
+    # Suma un pedido a la carga del repartidor solo si le queda cupo (DISPATCH_MAX_ACTIVE):
+    # UPDATE condicional, o alta si no existe. None si está lleno. Sin commit.
+    t = Driver.__table__
+    drv = db.session.execute(
+        update(t).where(t.c.phone == phone,
+                        func.coalesce(t.c.active_orders, 0) < current_app.config["DISPATCH_MAX_ACTIVE"])
+        .values(active_orders=func.coalesce(t.c.active_orders, 0) + 1, status="busy", updated_at=now)
+        .returning(*DRIVER_FEED_COLS)).first()
+    if drv: return drv
+    drv = db.session.execute(
+        insert_for(t).values(phone=phone, status="busy", active_orders=1, updated_at=now)
+        .on_conflict_do_nothing(index_elements=[t.c.phone]).returning(*DRIVER_FEED_COLS)).first()
+    if drv: stats.bump({"drivers:total": 1})
+    return drv
+
+def _claim(oid, lat, lon, driver_phone):
+    # Toma el pedido solo si sigue "new" (UPDATE condicional: gana exactamente uno) y suma
+    # carga al repartidor si tiene cupo. None si otro lo tomó antes o el repartidor está
+    # lleno (el pedido vuelve a "new"). Sin commit.
+    now = datetime.utcnow()
+    eta = dist = None
+    dlat, dlon = _driver_pos(driver_phone)
+    if dlat is not None and dlon is not None:
+        dist = haversine_km(dlat, dlon, lat, lon)
+        eta = eta_model.estimate(dist, lat, lon, now)
+    o = db.session.execute(
+        update(Order).where(Order.id == oid, Order.status == "new")
+        .values(status="assigned", assigned_driver=driver_phone, eta_min=eta, dist_km=dist, assigned_at=now)
+        .returning(*ORDER_FEED_COLS)).first()
+    if o is None: return None
+    drv = _take_driver(driver_phone, now)
+    if drv is None:                       # el lock de la fila es nuestro hasta el commit
+        db.session.execute(update(Order).where(Order.id == oid).values(
+            status="new", assigned_driver=None, eta_min=None, dist_km=None, assigned_at=None))
+        return None
+    events.record(oid, "assigned", driver_phone, {"eta_min":eta, "dist_km":dist}, now)
+    feed.log_order(o); feed.log_driver(drv)
+    stats.on_assigned(o, drv)
+    return drv, eta
 
 @api_bp.post("/orders/<int:order_id>/assign")
+@idempotent
 def api_orders_assign(order_id: int):
     d = request.get_json(force=True)
     driver_phone = sanitize_phone(d.get("driver_phone",""))
     if not driver_phone: return jsonify(error="driver_phone requerido"), 400
-    o = Order.query.get(order_id)
+    o = db.session.query(Order.lat, Order.lon).filter_by(id=order_id).first()
     if not o: return jsonify(error="Pedido no existe"), 404
-    if o.status != "new": return jsonify(error="Pedido ya tomado"), 400
-    drv = Driver.query.filter_by(phone=driver_phone).first()
-    if not drv:
-        drv = Driver(phone=driver_phone)
-        db.session.add(drv); db.session.commit()
-    eta = None
-    if drv.lat is not None and drv.lon is not None:
-        dist = haversine_km(drv.lat, drv.lon, o.lat, o.lon)
-        eta = int(round((dist/25.0)*60))
-    o.status = "assigned"; o.assigned_driver = driver_phone; o.eta_min = eta
-    drv.active_orders = (drv.active_orders or 0) + 1
-    drv.status = "busy"
-    db.session.commit()
-    return jsonify(ok=True, order_id=o.id, eta_min=eta)
+    got = writer.run(lambda: _claim(order_id, o.lat, o.lon, driver_phone))
+    if not got: return jsonify(error="Pedido ya tomado o repartidor sin cupo"), 400
+    dispatch.touch(got[0])
+    return jsonify(ok=True, order_id=order_id, eta_min=got[1])
+
+# Despacho por lotes: asigna toda la cola de nuevos minimizando la distancia total
+@api_bp.post("/dispatch/run")
+def api_dispatch_run():
+    cfg = current_app.config
+    # Solo con DISPATCH_MODE=auto y DISPATCH_API_KEY: sin eso la ruta no existe
+    key = cfg["DISPATCH_API_KEY"]
+    if cfg["DISPATCH_MODE"] != "auto" or not key:
+        return jsonify(error="No encontrado"), 404
+    if not hmac.compare_digest(request.headers.get("X-Api-Key", ""), key):
+        return jsonify(error="No autorizado"), 401
+    rows = (db.session.query(Order.id, Order.lat, Order.lon).filter_by(status="new")
+            .order_by(Order.created_at).limit(cfg["DISPATCH_BATCH"]).all())
+    db.session.rollback()                 # cierra la lectura; el claim condicional decide
+    by_id = {o.id: o for o in rows}
+    pairs = dispatch.match_batch([tuple(o) for o in rows], dispatch.index(),
+                                 max_km=cfg["DISPATCH_MAX_KM"])
+
+    def write():
+        out, touched = [], []
+        for oid, phone, km in pairs:
+            got = _claim(oid, by_id[oid].lat, by_id[oid].lon, phone)
+            if not got: continue              # tomado a mano mientras tanto
+            touched.append(got[0])
+            out.append({"order_id":oid, "driver":phone, "km":round(km, 3), "eta_min":got[1]})
+        return out, touched
+    out, touched = writer.run(write)
+    for drv in touched: dispatch.touch(drv)
+    return jsonify(ok=True, assigned=out, pending=len(rows)-len(out))
+
+def _advance(order_id, to, now, **values):
+    # Transición validada contra events.NEXT. Igual que el claim: lee el estado y actualiza
+    # solo si sigue igual, así el estado anterior es exacto para las estadísticas y solo la
+    # primera entrega/cancelación cuenta. -> (anterior, fila); (None, None) si no existe,
+    # (to, None) si ya estaba ahí, ("busy", None) si no se pudo. Sin commit.
+    for _ in range(3):
+        cur = db.session.query(Order.status).filter_by(id=order_id).first()
+        if not cur: return None, None
+        if cur.status == to: return to, None
+        events.check(cur.status, to)
+        o = db.session.execute(
+            update(Order).where(Order.id == order_id, Order.status == cur.status)
+            .values(status=to, **values)
+            .returning(*ORDER_FEED_COLS, Order.dist_km, Order.assigned_at, Order.delivered_at)).first()
+        if o:
+            events.record(order_id, to, o.assigned_driver, at=now)
+            return cur.status, o
+    return "busy", None
+
+def _release_driver(phone, now):
+    # Descuenta el pedido cerrado de la carga del repartidor; fila para el feed o None
+    t = Driver.__table__
+    drv = db.session.execute(
+        update(t).where(t.c.phone == phone, t.c.active_orders > 0)
+        .values(active_orders=t.c.active_orders - 1,
+                status=case((t.c.active_orders > 1, "busy"), else_="available"), updated_at=now)
+        .returning(*DRIVER_FEED_COLS)).first()
+    if drv: feed.log_driver(drv)
+    return drv
+
+def _transition(order_id, to):
+    # Recogida, entrega o cancelación: estado, evento, carga del repartidor, feed y
+    # estadísticas en una sola escritura
+    now = datetime.utcnow()
+
+    def write():
+        old, o = _advance(order_id, to, now, **({"delivered_at":now} if to == "delivered" else {}))
+        if o is None: return old, None, None
+        learned = learn_eta(o) if to == "delivered" else None
+        drv = None
+        if not events.NEXT[to] and old in events.ACTIVE and o.assigned_driver:
+            drv = _release_driver(o.assigned_driver, now)
+        feed.log_order(o)
+        stats.on_status(old, to, drv_freed=bool(drv) and drv.active_orders == 0)
+        return to, drv, learned
+    try:
+        status, drv, learned = writer.run(write)
+    except events.InvalidTransition as e:
+        return jsonify(error=str(e)), 409
+    if status is None: return jsonify(error="Pedido no existe"), 404
+    if status == "busy": return jsonify(error="Pedido en uso, reintenta"), 409
+    if learned: eta_model.observe(*learned)    # ya confirmada: memoria y eta_speeds a la par
+    if drv: dispatch.touch(drv)
+    return jsonify(ok=True, status=status)
+
+@api_bp.post("/orders/<int:order_id>/pickup")
+def api_orders_pickup(order_id: int):
+    return _transition(order_id, "delivering")
 
 @api_bp.post("/orders/<int:order_id>/deliver")
 def api_orders_deliver(order_id: int):
-    o = Order.query.get(order_id)
-    if not o: return jsonify(error="Pedido no existe"), 404
-    o.status = "delivered"
-    if o.assigned_driver:
-        drv = Driver.query.filter_by(phone=o.assigned_driver).first()
-        if drv:
-            drv.active_orders = max((drv.active_orders or 1)-1, 0)
-            drv.status = "available" if drv.active_orders == 0 else "busy"
-    db.session.commit()
-    return jsonify(ok=True)
+    return _transition(order_id, "delivered")
+
+@api_bp.post("/orders/<int:order_id>/cancel")
+def api_orders_cancel(order_id: int):
+    return _transition(order_id, "canceled")
+
+# Log de transiciones (events.py): ?after=<id>&limit= para seguirlo, ?order_id= para la
+# historia de un pedido. `next` es el after de la siguiente llamada.
+@api_bp.get("/events")
+def api_events():
+    a = request.args
+    try:
+        after = int(a.get("after", 0))
+        limit = min(max(int(a.get("limit", 500)), 1), 5000)
+        order_id = int(a["order_id"]) if a.get("order_id") else None
+    except ValueError:
+        return jsonify(error="Parámetros inválidos"), 400
+
+    def page(s, seq):
+        rows = events.page(s, after, limit, order_id)
+        return jsonify(ok=True, cols=events.COLS, rows=[
+            [*r[:5], json.loads(r.data) if r.data else None, r.created_at] for r in rows],
+            next=rows[-1].id if rows else after)
+    return replica.read(page)
+
+# Resumen del panel: O(1), sale de stats_counters (ver stats.py)
+@api_bp.get("/stats")
+def api_stats():
+    return jsonify(ok=True, **stats.read())
 
 # Drivers
 @api_bp.get("/drivers")
 def api_drivers_get():
-    rows = Driver.query.order_by(Driver.updated_at.desc()).all()
-    return jsonify(ok=True, list=[{
-        "phone":r.phone, "lat":r.lat, "lon":r.lon, "status":r.status,
-        "active_orders":r.active_orders, "updated_at": (r.updated_at or datetime.now()).isoformat()
-    } for r in rows])
+    def page(s, seq):
+        rows = (s.query(Driver.phone, Driver.lat, Driver.lon, Driver.status, Driver.active_orders, Driver.updated_at)
+                .order_by(Driver.updated_at.desc()).all())
+        now = datetime.now()
+        out = [locbuf.buffer.overlay({
+            "phone":r.phone, "lat":r.lat, "lon":r.lon, "status":r.status,
+            "active_orders":r.active_orders, "updated_at": r.updated_at or now
+        }) for r in rows]
+        out += locbuf.buffer.missing({r.phone for r in rows})
+        return jsonify(ok=True, list=out, feed=seq)
+    return replica.read(page)
+
+def _parse_ping(d):
+    phone = sanitize_phone(str(d.get("phone") or ""))
+    if not phone: raise ValueError("phone requerido")
+    try:
+        lat = float(d["lat"]) if d.get("lat") is not None else None
+        lon = float(d["lon"]) if d.get("lon") is not None else None
+    except (TypeError, ValueError):
+        raise ValueError("lat/lon inválidos")
+    return phone, lat, lon
+
+def _store_pings(pings):
+    # Modo "buffer": solo memoria, el job de flush hace el upsert en lote.
+    # Modo "direct": un upsert en lote ya mismo.
+    if current_app.config["DRIVER_LOC_MODE"] == "buffer":
+        for phone, lat, lon in pings:
+            track.store.record(phone, *locbuf.buffer.put(phone, lat, lon))
+        return
+    now = datetime.utcnow()
+    latest = {phone: {"phone":phone, "lat":lat, "lon":lon, "updated_at":now} for phone, lat, lon in pings}
+    for r in writer.run(lambda: locbuf.upsert(list(latest.values()))):
+        dispatch.move(r.phone, r.lat, r.lon)
+        track.store.record(r.phone, r.lat, r.lon, now)
 
 @api_bp.put("/drivers")
 def api_driver_loc():
     d = request.get_json(force=True)
-    phone = sanitize_phone(d.get("phone",""))
-    if not phone: return jsonify(error="phone requerido"), 400
-    drv = Driver.query.filter_by(phone=phone).first()
-    if not drv:
-        drv = Driver(phone=phone)
-        db.session.add(drv)
-    if d.get("lat") is not None: drv.lat = float(d.get("lat"))
-    if d.get("lon") is not None: drv.lon = float(d.get("lon"))
-    db.session.commit()
+    try:
+        ping = _parse_ping(d)
+    except (ValueError, AttributeError) as e:
+        return jsonify(error=str(e) if isinstance(e, ValueError) else "Datos inválidos"), 400
+    _store_pings([ping])
     return jsonify(ok=True)
+
+# Pings en lote desde gateways de flota: {"pings":[{phone, lat, lon}]}
+@api_bp.put("/drivers/batch")
+def api_drivers_batch():
+    key = current_app.config["FLEET_API_KEY"]
+    if not key or not hmac.compare_digest(request.headers.get("X-Api-Key", ""), key):
+        return jsonify(error="No autorizado"), 401
+    d = request.get_json(force=True)
+    raw = d.get("pings") if isinstance(d, dict) else None
+    if not isinstance(raw, list) or not raw or len(raw) > 5000:
+        return jsonify(error="Envía entre 1 y 5000 pings"), 400
+    pings = []
+    for i, p in enumerate(raw):
+        try: pings.append(_parse_ping(p))
+        except (ValueError, AttributeError) as e:
+            return jsonify(error=f"Ping {i}: {e if isinstance(e, ValueError) else 'Datos inválidos'}"), 400
+    _store_pings(pings)
+    return jsonify(ok=True, count=len(pings))
+
+# Recorrido: ?from=&to= (ISO, UTC; por defecto desde las 00:00 de hoy), puntos [t_ms, lat, lon]
+@api_bp.get("/drivers/<phone>/track")
+def api_driver_track(phone):
+    # Historial GPS de un repartidor: solo con la clave de flota
+    key = current_app.config["FLEET_API_KEY"]
+    if not key or not hmac.compare_digest(request.headers.get("X-Api-Key", ""), key):
+        return jsonify(error="No autorizado"), 401
+    phone = sanitize_phone(phone)
+    now = datetime.utcnow()
+    try:
+        t_from = datetime.fromisoformat(request.args["from"]) if request.args.get("from") else now.replace(hour=0, minute=0, second=0, microsecond=0)
+        t_to = datetime.fromisoformat(request.args["to"]) if request.args.get("to") else now
+    except ValueError:
+        return jsonify(error="Parámetros inválidos"), 400
+    if t_to < t_from or t_to - t_from > timedelta(days=31):
+        return jsonify(error="Rango inválido (máx. 31 días)"), 400
+
+    # La consulta y el primer bloque corren antes del 200: si fallan, la respuesta es un 500
+    # y no un JSON cortado con status de éxito
+    pts = track.points(phone, t_from, t_to)
+    first = next(pts, None)
+
+    def stream():
+        yield '{"ok":true,"phone":"%s","points":[' % phone
+        sep = ""
+        for t, la, lo in itertools.chain((first,) if first else (), pts):
+            yield f"{sep}[{t},{la},{lo}]"; sep = ","
+        yield "]}"
+
+    return Response(stream_with_context(stream()), mimetype="application/json")
+
+# Feed (SSE): deltas de pedidos y repartidores desde un cursor
+@api_bp.get("/feed")
+def api_feed():
+    raw = request.headers.get("Last-Event-ID") or request.args.get("cursor") or ""
+    h = feed.hub()
+    cursor = int(raw) if raw.isdigit() else h.head
+    backlog, floor = [], h.floor()
+    if cursor < floor:
+        backlog = h.backfill(cursor, floor)
+    db.session.remove()        # no retener conexión mientras dura el stream
+    cfg = current_app.config
+
+    def stream():
+        yield f"retry: {int(cfg['FEED_RETRY_MS'])}\n\n"
+        if backlog is None:
+            yield feed.sse(h.head, "reset", "{}"); return
+        for seq, kind, data in backlog:
+            if kind not in feed.PRIVATE: yield feed.sse(seq, kind, data)
+        cur = max(cursor, floor)
+        deadline = time.time() + cfg["FEED_STREAM_S"]
+        while time.time() < deadline:
+            batch = h.read(cur, timeout=15)
+            if batch is None:
+                yield feed.sse(h.head, "reset", "{}"); return
+            for seq, kind, data in batch:
+                if kind not in feed.PRIVATE: yield feed.sse(seq, kind, data)
+                cur = seq
+            if not batch:
+                yield ": ping\n\n"
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control":"no-cache", "X-Accel-Buffering":"no"})
@@ -0,0 +1,161 @@
+import threading, time
+from datetime import datetime, timedelta
+from sqlalchemy import Column, Index, MetaData, Table, delete, inspect, literal, select, union_all
+from . import db, writer
+from .dbutil import insert_for
+from .models import Order, OrderArchive, OrderItem
+
+# Pedidos fríos: los terminados (entregados/cancelados) con más de ARCHIVE_AFTER_DAYS se
+# mueven por lotes a tablas por mes de creación (orders_AAAAMM, order_items_AAAAMM, mismas
+# columnas), así `orders` solo guarda lo vivo y lo reciente y su tamaño no depende de la
+# historia. Las lecturas de historial (mis pedidos, /orders/all, detalle, reconciliaciones)
+# unen la tabla caliente con las particiones del rango pedido; order_archives lleva los
+# totales de cada mes para las estadísticas.
+
+TERMINAL = ("delivered", "canceled")
+_meta = MetaData()                   # fuera de db.metadata: create_all no las crea
+_lock = threading.Lock()
+
+
+def _copy(table, name, *indexes):
+    cols = [Column(c.name, c.type, primary_key=c.primary_key, autoincrement=False) for c in table.c]
+    return Table(name, _meta, *cols, *indexes)
+
+def tables(month):
+    # (orders_AAAAMM, order_items_AAAAMM) como objetos Table
+    name = f"orders_{month}"
+    with _lock:
+        if name not in _meta.tables:
+            _copy(Order.__table__, name, Index(f"ix_{name}_created_id", "created_at", "id"),
+                  Index(f"ix_{name}_client", "client_id"))
+            _copy(OrderItem.__table__, f"order_items_{month}", Index(f"ix_order_items_{month}_order", "order_id"))
+        return _meta.tables[name], _meta.tables[f"order_items_{month}"]
+
+
+class Months:
+    # Meses archivados (de order_archives), con cache corta por proceso
+    def __init__(self, ttl_s=60):
+        self.ttl_s = ttl_s
+        self.cached = None
+        self.at = 0.0
+
+    def get(self, s=None):
+        if self.cached is None or time.monotonic() - self.at > self.ttl_s:
+            self.cached = sorted((s or db.session).execute(select(OrderArchive.month)).scalars(), reverse=True)
+            self.at = time.monotonic()
+        return self.cached
+
+    def invalidate(self):
+        self.cached = None
+
+months = Months()
+
+def month_of(t):
+    return t.strftime("%Y%m")
+
+def parts(s=None, since=None, until=None, cold=True):
+    # [(orders, order_items)]: la caliente primero y luego los meses archivados en el rango
+    # [since, until), del más nuevo al más viejo
+    out = [(Order.__table__, OrderItem.__table__)]
+    if not cold: return out
+    lo = month_of(since) if since else None
+    hi = month_of(until - timedelta(microseconds=1)) if until else None
+    for m in months.get(s):
+        if (lo is None or m >= lo) and (hi is None or m <= hi):
+            out.append(tables(m))
+    return out
+
+def page(s, cols, where, limit, since=None, until=None, cold=True):
+    # Las `limit` filas más nuevas por (created_at, id) entre todas las partes: cada parte
+    # aporta sus `limit` mejores por índice y una sola consulta las une y recorta.
+    # where(t) -> condiciones para la tabla t (orders o una partición)
+    ps = parts(s, since, until, cold)
+    sels = [select(*(t.c[c] for c in cols)).where(*where(t))
+            .order_by(t.c.created_at.desc(), t.c.id.desc()).limit(limit) for t, _ in ps]
+    if len(sels) == 1:
+        return s.execute(sels[0]).all(), ps
+    u = union_all(*(select(*sq.c) for sq in (q.subquery() for q in sels))).subquery()
+    return s.execute(select(*u.c).order_by(u.c.created_at.desc(), u.c.id.desc()).limit(limit)).all(), ps
+
+def items(s, ids, ps):
+    # Ítems de los pedidos `ids` en las partes ps (las mismas de la página)
+    if not ids: return []
+    cols = ("order_id", "item_id", "name", "qty", "price", "id")
+    sels = [select(*(i.c[c] for c in cols)).where(i.c.order_id.in_(ids)) for _, i in ps]
+    q = sels[0] if len(sels) == 1 else union_all(*sels)
+    return sorted(s.execute(q).all(), key=lambda r: (r.order_id, r.id))
+
+def find(s, order_id):
+    # Pedido archivado por id: (fila, [ítems]) o None. Un lookup por PK en cada mes.
+    ms = months.get(s)
+    if not ms: return None
+    sels = []
+    for m in ms:
+        o, _ = tables(m)
+        sels.append(select(o, literal(m).label("month")).where(o.c.id == order_id))
+    row = s.execute(sels[0] if len(sels) == 1 else union_all(*sels)).first()
+    if row is None: return None
+    _, it = tables(row.month)
+    return row, s.execute(select(it).where(it.c.order_id == order_id).order_by(it.c.id)).all()
+
+def history(s, cols, where):
+    # Todas las filas de historial (caliente + meses archivados), para recorrer en lotes
+    for t, _ in parts(s):
+        yield from s.execute(select(*(t.c[c] for c in cols)).where(*where(t))).yield_per(1000)
+
+
+def _ensure(month):
+    o, i = tables(month)
+    conn = db.session.connection()
+    if not inspect(conn).has_table(o.name):
+        o.create(conn, checkfirst=True); i.create(conn, checkfirst=True)
+    return o, i
+
+def _batch(cutoff, size):
+    # Un lote: borra de las tablas calientes con RETURNING y copia a las particiones del
+    # mes. Dos workers pueden tomar los mismos ids: solo al que borra le devuelven filas.
+    q = (select(Order.id).where(Order.status.in_(TERMINAL), Order.created_at < cutoff)
+         .order_by(Order.created_at, Order.id).limit(size))
+    if db.session.get_bind().dialect.name == "postgresql":
+        q = q.with_for_update(skip_locked=True)
+    ids = db.session.execute(q).scalars().all()
+    if not ids: return 0
+    it_rows = db.session.execute(delete(OrderItem).where(OrderItem.order_id.in_(ids))
+                                 .returning(*OrderItem.__table__.c)).all()
+    o_rows = db.session.execute(delete(Order).where(Order.id.in_(ids), Order.status.in_(TERMINAL))
+                                .returning(*Order.__table__.c)).all()
+    gone = {r.id: month_of(r.created_at) for r in o_rows}
+    back = [r._asdict() for r in it_rows if r.order_id not in gone]
+    if back: db.session.execute(OrderItem.__table__.insert(), back)  # pedido que cambió de estado
+    by_month = {}
+    for r in o_rows:
+        by_month.setdefault(gone[r.id], ([], []))[0].append(r._asdict())
+    for r in it_rows:
+        if r.order_id in gone: by_month[gone[r.order_id]][1].append(r._asdict())
+    t = OrderArchive.__table__
+    for month, (orows, irows) in by_month.items():
+        o, i = _ensure(month)
+        db.session.execute(o.insert(), orows)
+        if irows: db.session.execute(i.insert(), irows)
+        stmt = insert_for(t).values(
+            month=month, orders=len(orows), updated_at=datetime.utcnow(),
+            delivered=sum(1 for r in orows if r["status"] == "delivered"),
+            canceled=sum(1 for r in orows if r["status"] == "canceled"),
+            revenue=sum(r["total"] or 0 for r in orows if r["status"] == "delivered"))
+        db.session.execute(stmt.on_conflict_do_update(index_elements=[t.c.month], set_={
+            "orders": t.c.orders + stmt.excluded.orders, "delivered": t.c.delivered + stmt.excluded.delivered,
+            "canceled": t.c.canceled + stmt.excluded.canceled, "revenue": t.c.revenue + stmt.excluded.revenue,
+            "updated_at": stmt.excluded.updated_at}))
+    return len(o_rows)
+
+def run(after_days, batch=500, max_batches=20):
+    # Job: hasta max_batches lotes (acotado por corrida); el resto en la siguiente
+    cutoff = datetime.utcnow() - timedelta(days=after_days)
+    moved = 0
+    for _ in range(max_batches):
+        db.session.rollback()
+        n = writer.run(lambda: _batch(cutoff, batch))
+        moved += n
+        if n < batch: break
+    if moved: months.invalidate()
+    return moved
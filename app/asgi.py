@@ -0,0 +1,132 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgiInstance
+from . import db, feed
+
+# Modo ASGI (asgi.py en la raíz, con uvicorn): las rutas de Flask corren igual, en un pool
+# de ASGI_THREADS hilos por worker en vez de un hilo por conexión; el cuerpo de la petición
+# se lee antes de ocupar un hilo. El feed SSE (/api/feed), que es lo que queda abierto en
+# cada teléfono, se sirve en el event loop: cada conexión es una corrutina con una cola que
+# llena el Hub del proceso, sin hilo ni conexión a la DB mientras espera.
+
+_run_wsgi = WsgiToAsgiInstance.__dict__["run_wsgi_app"].func   # cuerpo síncrono de asgiref
+FEED_QUEUE = 256        # lotes pendientes por stream; más = cliente que no lee, se le resetea
+
+
+class _Wsgi(WsgiToAsgiInstance):
+    # asgiref corre todas las peticiones en un único hilo compartido: aquí van al pool
+    def __init__(self, wsgi_application, pool):
+        super().__init__(wsgi_application)
+        self.pool = pool
+
+    async def run_wsgi_app(self, body):
+        await sync_to_async(_run_wsgi, thread_sensitive=False, executor=self.pool)(self, body)
+
+
+class AsgiApp:
+    def __init__(self, flask_app):
+        self.flask = flask_app
+        self.pool = ThreadPoolExecutor(flask_app.config["ASGI_THREADS"], thread_name_prefix="asgi")
+        self.streams = set()         # colas de los /api/feed abiertos
+        self.loop = None
+        self.hub = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self._lifespan(receive, send)
+        if scope["type"] != "http": return                 # sin websockets
+        if scope["path"] == "/api/feed" and scope["method"] == "GET":
+            return await self._feed(scope, receive, send)
+        await _Wsgi(self.flask, self.pool)(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            msg = await receive()
+            if msg["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif msg["type"] == "lifespan.shutdown":
+                self.pool.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _sync(self, fn, *args):
+        # fn en el pool con app context (y la sesión devuelta al terminar)
+        def run():
+            with self.flask.app_context():
+                try: return fn(*args)
+                finally: db.session.remove()
+        return await asyncio.get_running_loop().run_in_executor(self.pool, run)
+
+    async def _attach(self):
+        # El Hub es por proceso (feed.hub()); se le cuelga un listener que reparte al loop
+        if self.hub is None:
+            h = await self._sync(feed.hub)
+            if self.hub is None:
+                self.loop = asyncio.get_running_loop()
+                h.listeners.append(lambda entries: self.loop.call_soon_threadsafe(self._fanout, entries))
+                self.hub = h
+        return self.hub
+
+    def _fanout(self, entries):
+        for q in list(self.streams):
+            if q.qsize() >= FEED_QUEUE:
+                self.streams.discard(q); q.put_nowait(None)
+            else:
+                q.put_nowait(entries)
+
+    async def _feed(self, scope, receive, send):
+        # Lo mismo que api_feed (api.py): backlog desde la DB si hace falta, luego en vivo
+        cfg = self.flask.config
+        h = await self._attach()
+        headers = dict(scope["headers"])
+        raw = (headers.get(b"last-event-id", b"").decode()
+               or parse_qs(scope["query_string"].decode()).get("cursor", [""])[0])
+        cursor = int(raw) if raw.isdigit() else h.head
+        q = asyncio.Queue()
+        self.streams.add(q)          # antes de leer el ring: lo que llegue entre medio queda en la cola
+
+        async def watch():
+            while (await receive())["type"] != "http.disconnect": pass
+            q.put_nowait(False)
+        watcher = asyncio.ensure_future(watch())
+
+        async def emit(*chunks):
+            if chunks: await send({"type": "http.response.body", "body": "".join(chunks).encode(), "more_body": True})
+        started = False
+        try:
+            backlog, floor = [], h.floor()
+            if cursor < floor:
+                backlog = await self._sync(h.backfill, cursor, floor)
+            await send({"type": "http.response.start", "status": 200, "headers": [
+                (b"content-type", b"text/event-stream; charset=utf-8"), (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no")]})
+            started = True
+            await emit(f"retry: {int(cfg['FEED_RETRY_MS'])}\n\n")
+            live = None if backlog is None else h.read(max(cursor, floor), timeout=0)
+            if live is None:
+                await emit(feed.sse(h.head, "reset", "{}")); return
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + cfg["FEED_STREAM_S"]
+            batch, last = backlog + live, cursor
+            while True:
+                out = []
+                for seq, kind, data in batch:
+                    if seq <= last: continue             # la cola repite lo que ya salió del ring
+                    last = seq
+                    if kind not in feed.PRIVATE: out.append(feed.sse(seq, kind, data))
+                await emit(*out)
+                left = deadline - loop.time()
+                if left <= 0: return
+                try:
+                    batch = await asyncio.wait_for(q.get(), min(15, left))
+                except asyncio.TimeoutError:
+                    await emit(": ping\n\n"); batch = []; continue
+                if batch is False: return
+                if batch is None:
+                    await emit(feed.sse(h.head, "reset", "{}")); return
+        finally:
+            self.streams.discard(q)
+            watcher.cancel()
+            if started: await send({"type": "http.response.body", "body": b"", "more_body": False})
@@ -0,0 +1,103 @@
+import hmac, json, threading, time
+from collections import OrderedDict
+from flask import current_app
+from sqlalchemy import update
+from . import db, feed
+from .models import AuthPin, Client
+from .ratelimit import ShmBuckets, default_path
+from .utils import hash_pin
+
+# Verificación de PIN: token buckets por IP y por teléfono compartidos entre workers,
+# credenciales (hash del PIN) en un LRU por proceso y una sola consulta con join cuando
+# no está. Un ataque de fuerza bruta se corta antes de llegar a la DB.
+
+DUMMY_HASH = "0" * 64        # se compara igual aunque el teléfono no exista
+
+
+class CredentialCache:
+    MISS = object()
+
+    def __init__(self, size=20_000, ttl_s=300, negative_s=30):
+        self.size = size
+        self.ttl_s = ttl_s
+        self.negative_s = negative_s     # "no existe / sin PIN" dura poco: puede registrarse
+        self.items = OrderedDict()       # phone -> ((cid, pin_hash) | None, vence_ts)
+        self.lock = threading.Lock()
+        self._listening = False
+
+    def get(self, phone):
+        with self.lock:
+            hit = self.items.get(phone)
+            if hit is None or hit[1] < time.time(): return self.MISS
+            self.items.move_to_end(phone)
+            return hit[0]
+
+    def put(self, phone, cred):
+        with self.lock:
+            self.items[phone] = (cred, time.time() + (self.ttl_s if cred else self.negative_s))
+            self.items.move_to_end(phone)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+    def drop(self, phone):
+        with self.lock: self.items.pop(phone, None)
+
+    def on_feed(self, entries):
+        # PIN creado o cambiado en otro worker
+        for _, kind, data in entries:
+            if kind == "pin": self.drop(json.loads(data)["phone"])
+
+    def listen(self):
+        if self._listening: return
+        with self.lock:
+            if self._listening: return
+            feed.hub().listeners.append(self.on_feed)
+            self._listening = True
+
+cache = CredentialCache()
+limiter = None
+
+def init(app):
+    global limiter
+    path = app.config["RATE_LIMIT_PATH"] or default_path(app.config["SQLALCHEMY_DATABASE_URI"])
+    limiter = ShmBuckets(path, app.secret_key)
+
+def throttle(ip, phone=None):
+    # Segundos a esperar (0 = adelante). La IP va primero: si está bloqueada no gasta
+    # tokens del teléfono, que es el que protege a la víctima.
+    cfg = current_app.config
+    wait = limiter.take(f"ip:{ip}", cfg["PIN_BURST_IP"], cfg["PIN_REFILL_IP_S"])
+    if wait or phone is None: return wait
+    return limiter.take(f"phone:{phone}", cfg["PIN_BURST_PHONE"], cfg["PIN_REFILL_PHONE_S"])
+
+def credentials(phone):
+    cache.listen()
+    cred = cache.get(phone)
+    if cred is not CredentialCache.MISS: return cred
+    row = (db.session.query(Client.id, AuthPin.pin_hash)
+           .join(AuthPin, AuthPin.client_id == Client.id).filter(Client.phone == phone).first())
+    cred = tuple(row) if row else None
+    cache.put(phone, cred)
+    return cred
+
+def verify(phone, pin):
+    # client_id si el PIN es correcto; comparación en tiempo constante
+    cred = credentials(phone)
+    ok = hmac.compare_digest(cred[1] if cred else DUMMY_HASH, hash_pin(phone, pin))
+    return cred[0] if cred and ok else None
+
+def set_pin(phone, pin):
+    # Alta/cambio de PIN en una transacción: lookup con join, inserts/update y un commit
+    row = (db.session.query(Client.id, AuthPin.id)
+           .outerjoin(AuthPin, AuthPin.client_id == Client.id).filter(Client.phone == phone).first())
+    h = hash_pin(phone, pin)
+    if row is None:
+        c = Client(phone=phone); db.session.add(c); db.session.flush()
+        db.session.add(AuthPin(client_id=c.id, pin_hash=h))
+    elif row[1] is None:
+        db.session.add(AuthPin(client_id=row[0], pin_hash=h))
+    else:
+        db.session.execute(update(AuthPin).where(AuthPin.id == row[1]).values(pin_hash=h))
+    feed.log("pin", phone, {"phone": phone})
+    db.session.commit()
+    cache.drop(phone)
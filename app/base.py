@@ -1,4 +1,5 @@
-from flask import render_template_string
+from flask import make_response, render_template, request
+from jinja2 import ChoiceLoader, DictLoader
 
 BASE_SHELL = """<!doctype html>
 <html lang="es"><head>
@@ -32,12 +33,28 @@ BASE_SHELL = """<!doctype html>
     <a href="{{ url_for('restaurante.restaurante') }}" class="{{ 'active' if tab=='a' else '' }}">Restaurante</a>
     {% if session.get('cid') %} <a href="{{ url_for('cliente.logout') }}">Cerrar sesión</a> {% endif %}
   </nav>
-  {{ content|safe }}
+  {% block content %}{% endblock %}
 </div>
 <script src="https://cdn.jsdelivr.net/npm/leaflet@1.9.4/dist/leaflet.js" defer></script>
 </body></html>
 """
 
-def render_page(content_html: str, **ctx):
-    inner = render_template_string(content_html, **ctx)
-    return render_template_string(BASE_SHELL, content=inner, **ctx)
+# Plantillas en memoria: cada página extiende "base.html" y Jinja las compila una sola vez
+TEMPLATES = {"base.html": BASE_SHELL}
+
+def register_page(name: str, content_html: str) -> str:
+    TEMPLATES[name] = '{% extends "base.html" %}{% block content %}' + content_html + '{% endblock %}'
+    return name
+
+def init_templates(app):
+    app.jinja_env.loader = ChoiceLoader([DictLoader(TEMPLATES), app.jinja_env.loader])
+    for name in TEMPLATES:
+        app.jinja_env.get_template(name)      # precompila al arrancar
+
+def render_page(name: str, **ctx):
+    # ETag sobre el HTML final: una visita repetida sin cambios responde 304 sin cuerpo.
+    # Es "private" porque la barra depende de la sesión.
+    resp = make_response(render_template(name, **ctx))
+    resp.headers["Cache-Control"] = "private, no-cache"
+    resp.add_etag()
+    return resp.make_conditional(request)
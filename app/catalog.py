@@ -0,0 +1,108 @@
+import hashlib, json, threading
+from datetime import datetime
+from sqlalchemy import case
+from . import db, feed, serial
+from .dbutil import insert_for
+from .models import MenuItem
+
+# Catálogo del menú con cache por proceso. Cada restaurante tiene una foto inmutable
+# (índices por id y nombre, versión = hash del contenido, JSON ya serializado); pedir y
+# servir /api/menu no consulta la DB. Un cambio se publica en el feed ("menu") y cada
+# worker tira su foto; la siguiente lectura la recarga. Los nombres de restaurante también
+# están en memoria: uno desconocido (GET /api/menu?restaurant=<cualquiera>, sin sesión)
+# recibe una foto vacía sin ir a la DB ni ocupar la cache.
+
+SORT_KEEP = 10_000           # sin "sort": conserva el orden actual (o va al final si es nuevo)
+
+
+class Snapshot:
+    __slots__ = ("restaurant", "items", "by_id", "by_name", "version", "body")
+
+    def __init__(self, restaurant, rows):
+        self.restaurant = restaurant
+        self.items = [{"id":r.id, "name":r.name, "price":r.price, "available":bool(r.available)} for r in rows]
+        self.by_id = {it["id"]: it for it in self.items}
+        self.by_name = {it["name"]: it for it in self.items}
+        self.version = hashlib.sha256(serial.dumps(self.items)).hexdigest()[:16]
+        self.body = serial.dumps({"ok":True, "restaurant":restaurant, "version":self.version, "items":self.items})
+
+    def find(self, item_id=None, name=None):
+        it = self.by_id.get(item_id) if item_id is not None else self.by_name.get(name)
+        return it if it and it["available"] else None
+
+
+class Catalog:
+    def __init__(self):
+        self.snaps = {}
+        self.names = None            # restaurantes con menú; None = recargar
+        self.gen = 0                 # sube con cada invalidate: una carga que se cruzó no se guarda
+        self.lock = threading.Lock()
+        self._listening = False
+
+    def known(self):
+        names = self.names
+        if names is None:
+            self.listen()
+            gen = self.gen
+            names = {r for (r,) in db.session.query(MenuItem.restaurant).distinct()}
+            with self.lock:
+                if self.gen == gen: self.names = names
+        return names
+
+    def get(self, restaurant):
+        snap = self.snaps.get(restaurant)
+        if snap is None:
+            if restaurant not in self.known(): return Snapshot(restaurant, [])
+            gen = self.gen
+            rows = (MenuItem.query.filter_by(restaurant=restaurant)
+                    .order_by(MenuItem.sort, MenuItem.id).all())
+            snap = Snapshot(restaurant, rows)
+            with self.lock:
+                if self.gen == gen: self.snaps[restaurant] = snap
+        return snap
+
+    def invalidate(self, restaurant):
+        with self.lock:
+            self.gen += 1
+            self.snaps.pop(restaurant, None)
+            if self.names is not None and restaurant not in self.names: self.names = None   # alta
+
+    def on_feed(self, entries):
+        for _, kind, data in entries:
+            if kind == "menu": self.invalidate(json.loads(data)["restaurant"])
+
+    def listen(self):
+        if self._listening: return
+        with self.lock:
+            if self._listening: return
+            feed.hub().listeners.append(self.on_feed)
+            self._listening = True
+
+catalog = Catalog()
+
+def parse_items(raw):
+    # [{id?, name, price, available?, sort?}] -> filas validadas; ValueError si algo no cuadra
+    if not isinstance(raw, list) or not raw or len(raw) > 500: raise ValueError("Envía entre 1 y 500 ítems")
+    out = []
+    for i, it in enumerate(raw):
+        try:
+            name = str(it["name"]).strip(); price = round(float(it["price"]), 2)
+            row = {"name":name, "price":price, "available":bool(it.get("available", True)),
+                   "sort":int(it.get("sort", SORT_KEEP))}
+        except (KeyError, TypeError, ValueError, AttributeError):
+            raise ValueError(f"Ítem {i}: datos inválidos")
+        if not name or len(name) > 120 or price < 0: raise ValueError(f"Ítem {i}: datos inválidos")
+        out.append(row)
+    return out
+
+def upsert(restaurant, rows):
+    # Alta/cambio por (restaurante, nombre) en un solo INSERT ... ON CONFLICT; sin commit
+    t = MenuItem.__table__
+    stmt = insert_for(t)
+    stmt = stmt.on_conflict_do_update(index_elements=[t.c.restaurant, t.c.name], set_={
+        "price": stmt.excluded.price, "available": stmt.excluded.available,
+        "sort": case((stmt.excluded.sort == SORT_KEEP, t.c.sort), else_=stmt.excluded.sort),
+        "updated_at": stmt.excluded.updated_at})
+    now = datetime.utcnow()
+    db.session.execute(stmt, [dict(r, restaurant=restaurant, updated_at=now) for r in rows])
+    feed.log("menu", restaurant, {"restaurant": restaurant})
@@ -0,0 +1,37 @@
+from sqlalchemy import event, text
+from sqlalchemy.dialects import postgresql, sqlite
+from . import db
+
+# INSERT ... ON CONFLICT del dialecto en uso (SQLite y Postgres lo soportan igual)
+
+def insert_for(table):
+    name = db.session.get_bind().dialect.name
+    return (postgresql if name == "postgresql" else sqlite).insert(table)
+
+# Jobs que leen una foto y corrigen con un delta (stats.reconcile*): uno a la vez entre
+# workers, si no cada uno aplica la misma corrección. Postgres: advisory lock de la
+# transacción sin esperar; False = otro worker lo tiene y esta corrida se salta. SQLite:
+# BEGIN IMMEDIATE toma el lock de escritura antes de leer; el segundo espera (busy_timeout)
+# y lee ya corregido. Llamar al empezar la transacción.
+
+def job_lock(key):
+    conn = db.session.connection()
+    if conn.dialect.name == "postgresql":
+        return bool(conn.execute(text("SELECT pg_try_advisory_xact_lock(:k)"), {"k": key}).scalar())
+    if conn.dialect.name == "sqlite":
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+    return True
+
+# SQLite compartido por varios workers: WAL (lectores y un escritor a la vez sin
+# bloquearse), synchronous=NORMAL (fsync por checkpoint, no por commit; seguro con WAL),
+# esperar el lock en vez de fallar y lecturas por mmap. Se aplica a cada conexión nueva.
+
+def tune_sqlite(engine, busy_ms=5000, mmap_mb=256):
+    @event.listens_for(engine, "connect")
+    def _pragmas(dbapi_con, record):
+        cur = dbapi_con.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute(f"PRAGMA busy_timeout={int(busy_ms)}")
+        cur.execute(f"PRAGMA mmap_size={int(mmap_mb) * 1024 * 1024}")
+        cur.close()
@@ -0,0 +1,169 @@
+import json, math, threading, time
+from collections import defaultdict
+from datetime import datetime
+import numpy as np
+from flask import current_app
+from . import feed
+from .geo import haversine_np
+from .models import Driver
+
+# Despacho automático: índice espacial en memoria (celdas de grilla) sobre la posición de
+# los repartidores + asignación óptima por lotes de la cola de pedidos nuevos.
+
+CELL_DEG = 0.01              # ~1.1 km por celda
+KM_PER_DEG = 111.0
+BIG = 1e6                    # costo de un par imposible
+
+
+class GridIndex:
+    def __init__(self, cell_deg=CELL_DEG, max_active=1, stale_s=900):
+        self.cell_deg = cell_deg
+        self.max_active = max_active
+        self.stale_s = stale_s
+        self.pos = {}                    # phone -> (lat, lon, status, active, ts)
+        self.cells = defaultdict(set)    # (i, j) -> phones
+        self.lock = threading.Lock()
+
+    def _cell(self, lat, lon):
+        return (math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg))
+
+    def update(self, phone, lat, lon, status, active, ts):
+        with self.lock:
+            old = self.pos.get(phone)
+            if old and old[0] is not None:
+                self.cells[self._cell(old[0], old[1])].discard(phone)
+            self.pos[phone] = (lat, lon, status, active or 0, ts)
+            if lat is not None and lon is not None:
+                self.cells[self._cell(lat, lon)].add(phone)
+
+    def move(self, phone, lat, lon, ts):
+        old = self.pos.get(phone)
+        status, active = (old[2], old[3]) if old else ("available", 0)
+        self.update(phone, lat, lon, status, active, ts)
+
+    def eligible(self, phone, now):
+        lat, lon, status, active, ts = self.pos[phone]
+        return status != "offline" and active < self.max_active and now - ts <= self.stale_s
+
+    def nearest(self, lat, lon, k=1, max_km=8.0, exclude=()):
+        # Busca por anillos de celdas; se detiene cuando ningún anillo más lejano puede
+        # mejorar el k-ésimo candidato. Devuelve [(km, phone)] ordenado.
+        now = time.time()
+        ci, cj = self._cell(lat, lon)
+        ring_km = self.cell_deg * KM_PER_DEG * max(math.cos(math.radians(lat)), 0.1)
+        max_r = int(max_km / ring_km) + 1
+        found = []
+        with self.lock:
+            for r in range(max_r + 1):
+                phones = []
+                for i in range(ci - r, ci + r + 1):
+                    for j in range(cj - r, cj + r + 1):
+                        if r and abs(i - ci) != r and abs(j - cj) != r: continue   # solo el borde
+                        for ph in self.cells.get((i, j), ()):
+                            if ph not in exclude and self.eligible(ph, now): phones.append(ph)
+                if phones:
+                    pts = np.array([self.pos[ph][:2] for ph in phones])
+                    d = haversine_np(lat, lon, pts[:, 0], pts[:, 1])
+                    found.extend(zip(d.tolist(), phones))
+                    found.sort()
+                    del found[k:]
+                if len(found) >= k and found[-1][0] <= r * ring_km: break
+        return [(km, ph) for km, ph in found if km <= max_km]
+
+    def on_feed(self, entries):
+        # Cambios de otros workers llegan por el feed (change_log)
+        for _, kind, data in entries:
+            if kind != "driver": continue
+            d = json.loads(data)
+            ts = datetime.fromisoformat(d["updated_at"]) if d.get("updated_at") else datetime.utcnow()
+            self.update(d["phone"], d["lat"], d["lon"], d["status"], d["active_orders"], _epoch(ts))
+
+
+def _epoch(dt):
+    return (dt - datetime(1970, 1, 1)).total_seconds()
+
+_index = None
+_index_lock = threading.Lock()
+
+def index():
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                cfg = current_app.config
+                idx = GridIndex(max_active=cfg["DISPATCH_MAX_ACTIVE"], stale_s=cfg["DISPATCH_STALE_S"])
+                for r in Driver.query.with_entities(Driver.phone, Driver.lat, Driver.lon, Driver.status,
+                                                    Driver.active_orders, Driver.updated_at):
+                    idx.update(r.phone, r.lat, r.lon, r.status, r.active_orders, _epoch(r.updated_at or datetime.utcnow()))
+                from . import locbuf         # locbuf importa dispatch
+                for ph, (lat, lon, ts) in locbuf.buffer.items():   # pings aún sin volcar a la DB
+                    old = idx.pos.get(ph)
+                    idx.move(ph, old[0] if lat is None and old else lat, old[1] if lon is None and old else lon,
+                             _epoch(ts))
+                feed.hub().listeners.append(idx.on_feed)
+                _index = idx
+    return _index
+
+def touch(drv):
+    # Refresca el índice local sin esperar al feed (no lo construye si no existe). La fila
+    # trae estado y carga; la posición la manda el ping en buffer si lo hay (es más nueva)
+    if _index is not None:
+        from . import locbuf
+        p = locbuf.buffer.get(drv.phone)
+        lat = drv.lat if not p or p[0] is None else p[0]
+        lon = drv.lon if not p or p[1] is None else p[1]
+        _index.update(drv.phone, lat, lon, drv.status, drv.active_orders, time.time())
+
+def move(phone, lat, lon):
+    if _index is not None:
+        _index.move(phone, lat, lon, time.time())
+
+
+def solve_assignment(cost):
+    # Húngaro (caminos aumentantes más cortos) con el bucle interno vectorizado.
+    # cost: n x m con n <= m. Devuelve la columna asignada a cada fila.
+    n, m = cost.shape
+    u = np.zeros(n + 1); v = np.zeros(m + 1)
+    p = np.zeros(m + 1, dtype=int); way = np.zeros(m + 1, dtype=int)
+    for i in range(1, n + 1):
+        p[0] = i; j0 = 0
+        minv = np.full(m + 1, np.inf); used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used[1:]
+            cur = cost[i0 - 1] - u[i0] - v[1:]
+            better = free & (cur < minv[1:])
+            minv[1:][better] = cur[better]; way[1:][better] = j0
+            cand = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(cand)) + 1; delta = cand[j1 - 1]
+            cols = np.nonzero(used)[0]
+            u[p[cols]] += delta; v[cols] -= delta
+            minv[1:][free] -= delta
+            j0 = j1
+            if p[j0] == 0: break
+        while j0:
+            j1 = way[j0]; p[j0] = p[j1]; j0 = j1
+    out = np.full(n, -1)
+    for j in range(1, m + 1):
+        if p[j]: out[p[j] - 1] = j - 1
+    return out
+
+def match_batch(orders, idx, k=8, max_km=8.0):
+    # orders: [(id, lat, lon)]. Minimiza la distancia total del lote (no greedy).
+    # Devuelve [(order_id, phone, km)] para los pares factibles.
+    if not orders: return []
+    cands = [idx.nearest(lat, lon, k=k, max_km=max_km) for _, lat, lon in orders]
+    phones = sorted({ph for c in cands for _, ph in c})
+    if not phones: return []
+    col = {ph: j for j, ph in enumerate(phones)}
+    cost = np.full((len(orders), len(phones)), BIG)
+    for i, c in enumerate(cands):
+        for km, ph in c: cost[i, col[ph]] = km
+    if len(orders) <= len(phones):
+        rows = solve_assignment(cost)
+        pairs = [(i, j) for i, j in enumerate(rows)]
+    else:
+        cols = solve_assignment(cost.T)
+        pairs = [(i, j) for j, i in enumerate(cols)]
+    return [(orders[i][0], phones[j], float(cost[i, j])) for i, j in pairs if j >= 0 and cost[i, j] < BIG]
@@ -0,0 +1,120 @@
+import math, threading
+from datetime import timedelta
+from . import db
+from .dbutil import insert_for
+from .models import EtaSpeed, Order
+
+# ETA aprendido: velocidad efectiva (distancia en línea recta / minutos de asignación a
+# entrega) por zona de destino y hora local. La tabla de velocidades está precalculada en
+# memoria, así que estimar es un par de lookups en un dict.
+
+ZONE_DEG = 0.02              # ~2.2 km
+PRIOR_TRIPS = 5              # viajes "virtuales" a la velocidad previa (suaviza zonas con pocos datos)
+PRIOR_MIN = 20.0
+
+def zone(lat, lon):
+    return f"{math.floor(lat / ZONE_DEG)}:{math.floor(lon / ZONE_DEG)}"
+
+def plausible(km, minutes):
+    # Descarta entregas marcadas tarde/temprano (el panel se toca a mano)
+    return km > 0.05 and 1 <= minutes <= 180 and 3 <= km / (minutes / 60) <= 80
+
+
+class EtaModel:
+    def __init__(self, default_kmh=25.0, utc_offset_h=-5):
+        self.default = default_kmh
+        self.offset = timedelta(hours=utc_offset_h)
+        self.stats = {}              # (zone, hour) -> [n, km, minutes]
+        self.speeds = {}             # (zone, hour) -> km/h
+        self.lock = threading.Lock()
+
+    def hour(self, when):
+        return (when + self.offset).hour
+
+    def speed(self, lat, lon, when):
+        h = self.hour(when)
+        return self.speeds.get((zone(lat, lon), h)) or self.speeds.get(("*", h)) or self.default
+
+    def estimate(self, km, lat, lon, when):
+        return int(round(km / self.speed(lat, lon, when) * 60))
+
+    def _recompute(self, key):
+        prior = self.default if key[0] == "*" else self.speeds.get(("*", key[1]), self.default)
+        n, km, minutes = self.stats[key]
+        self.speeds[key] = (km + PRIOR_TRIPS * prior * PRIOR_MIN / 60) / ((minutes + PRIOR_TRIPS * PRIOR_MIN) / 60)
+
+    def keys(self, lat, lon, when):
+        h = self.hour(when)
+        return [("*", h), (zone(lat, lon), h)]
+
+    def observe(self, lat, lon, when, km, minutes):
+        # Suma una entrega; devuelve las claves tocadas (None si es un outlier)
+        if not plausible(km, minutes): return None
+        keys = self.keys(lat, lon, when)
+        with self.lock:
+            for key in keys:
+                st = self.stats.setdefault(key, [0, 0.0, 0.0])
+                st[0] += 1; st[1] += km; st[2] += minutes
+                self._recompute(key)
+        return keys
+
+    def load(self, rows):
+        # rows: (zone, hour, n, km, minutes); primero la ciudad, que es la previa de las zonas
+        stats = {(z, h): [n, km, m] for z, h, n, km, m in rows}
+        with self.lock:
+            self.stats, self.speeds = stats, {}
+            for key in sorted(stats, key=lambda k: k[0] != "*"):
+                self._recompute(key)
+
+    def fit(self, trips):
+        # trips: (lat, lon, assigned_at, km, minutes) — para evaluar fuera de línea
+        for lat, lon, when, km, minutes in trips:
+            self.observe(lat, lon, when, km, minutes)
+        self.load([(z, h, *st) for (z, h), st in self.stats.items()])
+        return self
+
+model = EtaModel()
+
+def refresh():
+    model.load(db.session.query(EtaSpeed.zone, EtaSpeed.hour, EtaSpeed.n, EtaSpeed.km, EtaSpeed.minutes).all())
+
+def record(o):
+    # Aprende de un pedido entregado: eta_speeds en la misma transacción que la entrega (sin
+    # commit). La memoria no se toca aquí: devuelve la observación para model.observe() una
+    # vez confirmada la transacción (None si no sirve); un rollback no deja rastro.
+    if o.dist_km is None or o.assigned_at is None or o.delivered_at is None: return None
+    minutes = (o.delivered_at - o.assigned_at).total_seconds() / 60
+    if not plausible(o.dist_km, minutes): return None
+    keys = model.keys(o.lat, o.lon, o.assigned_at)
+    t = EtaSpeed.__table__
+    stmt = insert_for(t)
+    stmt = stmt.on_conflict_do_update(index_elements=[t.c.zone, t.c.hour], set_={
+        "n": t.c.n + stmt.excluded.n, "km": t.c.km + stmt.excluded.km,
+        "minutes": t.c.minutes + stmt.excluded.minutes})
+    db.session.execute(stmt, [{"zone":z, "hour":h, "n":1, "km":o.dist_km, "minutes":minutes} for z, h in keys])
+    return o.lat, o.lon, o.assigned_at, o.dist_km, minutes
+
+def trips(q=None):
+    # Entregas aprovechables para entrenar: (lat, lon, assigned_at, km, minutos)
+    q = q or Order.query
+    rows = (q.filter(Order.status == "delivered", Order.dist_km.isnot(None),
+                     Order.assigned_at.isnot(None), Order.delivered_at.isnot(None))
+            .order_by(Order.assigned_at)
+            .with_entities(Order.lat, Order.lon, Order.assigned_at, Order.dist_km, Order.delivered_at))
+    for lat, lon, at, km, done in rows.yield_per(1000):
+        yield lat, lon, at, km, (done - at).total_seconds() / 60
+
+def rebuild():
+    # Recalcula eta_speeds desde el historial, archivado incluido (p. ej. tras cambiar ZONE_DEG)
+    from . import archive
+    rows = archive.history(db.session, ("lat", "lon", "assigned_at", "dist_km", "delivered_at"), lambda t: [
+        t.c.status == "delivered", t.c.dist_km.isnot(None), t.c.assigned_at.isnot(None), t.c.delivered_at.isnot(None)])
+    m = EtaModel(model.default, model.offset.total_seconds() / 3600).fit(
+        (lat, lon, at, km, (done - at).total_seconds() / 60) for lat, lon, at, km, done in rows)
+    EtaSpeed.query.delete()
+    if m.stats:
+        db.session.execute(EtaSpeed.__table__.insert(), [
+            {"zone":z, "hour":h, "n":n, "km":km, "minutes":mins} for (z, h), (n, km, mins) in m.stats.items()])
+    db.session.commit()
+    model.load([(z, h, *st) for (z, h), st in m.stats.items()])
+    return len(m.stats)
@@ -0,0 +1,194 @@
+import json
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, func, insert, literal, null, select, union_all, update
+from . import db
+from .models import Client, Driver, Order, OrderArchive, OrderEvent
+
+# Ciclo de vida de los pedidos: cada transición se valida contra NEXT y deja una fila en
+# order_events en la misma transacción que el UPDATE de orders (ver _advance/_claim en
+# api.py). El log es la fuente de verdad: rebuild() lo recorre en lotes por id y rehace
+# el estado de los pedidos, la carga de los repartidores y los acumulados de clients.
+# Paneles y analítica lo leen con GET /api/events?after=<id> sin recorrer las tablas.
+
+STATES = ("new", "assigned", "delivering", "delivered", "canceled")
+NEXT = {
+    "new": ("assigned", "canceled"),
+    "assigned": ("delivering", "delivered", "canceled"),
+    "delivering": ("delivered", "canceled"),
+    "delivered": (),
+    "canceled": (),
+}
+KIND = {"new": "created", "assigned": "assigned", "delivering": "picked_up",
+        "delivered": "delivered", "canceled": "canceled"}
+ACTIVE = ("assigned", "delivering")      # cuentan en active_orders del repartidor
+COLS = ("id", "order_id", "kind", "status", "driver", "data", "created_at")
+GAP_S = 2.0                              # como feed.Hub: ids menores aún sin confirmar
+
+
+class InvalidTransition(ValueError):
+    def __init__(self, old, new):
+        super().__init__(f"Transición inválida: {old} -> {new}")
+        self.old, self.new = old, new
+
+def check(old, new):
+    if new not in NEXT.get(old, ()): raise InvalidTransition(old, new)
+
+def _row(order_id, status, driver=None, data=None, at=None):
+    return {"order_id":order_id, "kind":KIND[status], "status":status, "driver":driver,
+            "data":json.dumps(data) if data else None, "created_at":at or datetime.utcnow()}
+
+def record(order_id, status, driver=None, data=None, at=None):
+    # Un evento, en la transacción de la transición. Sin commit.
+    db.session.execute(insert(OrderEvent), _row(order_id, status, driver, data, at))
+
+def record_created(rows):
+    # Altas en lote (rows de _insert_orders, ya con id)
+    db.session.execute(insert(OrderEvent), [
+        _row(r["id"], "new", None, {"client_id":r["client_id"], "total":r["total"]}, r["created_at"]) for r in rows])
+
+
+def page(s, after, limit, order_id=None):
+    # Eventos con id > after, en orden. Se corta en el primer hueco reciente: una
+    # transacción con id menor puede confirmar después y el cliente no debe saltarla.
+    q = select(*(OrderEvent.__table__.c[c] for c in COLS)).where(OrderEvent.id > after)
+    if order_id is not None: q = q.where(OrderEvent.order_id == order_id)
+    rows = s.execute(q.order_by(OrderEvent.id).limit(limit)).all()
+    if order_id is not None: return rows
+    out, prev = [], after
+    settle = datetime.utcnow() - timedelta(seconds=GAP_S)
+    for r in rows:
+        if r.id != prev + 1 and r.created_at > settle: break
+        out.append(r); prev = r.id
+    return out
+
+
+def _implied(r):
+    # Eventos que explican las columnas de un pedido anterior a order_events
+    at = r.assigned_at or r.created_at
+    ev = [_row(r.id, "new", None, {"client_id":r.client_id, "total":r.total}, r.created_at)]
+    if r.assigned_driver and r.status != "new":
+        ev.append(_row(r.id, "assigned", r.assigned_driver, {"eta_min":r.eta_min, "dist_km":r.dist_km}, at))
+    if r.status == "delivering":
+        ev.append(_row(r.id, "delivering", r.assigned_driver, None, at))
+    elif r.status in ("delivered", "canceled"):
+        ev.append(_row(r.id, r.status, r.assigned_driver, None, r.delivered_at or at))
+    return ev
+
+def backfill(conn, batch=5000):
+    # Migración 10: eventos de los pedidos existentes, calientes y archivados
+    from . import archive
+    months = sorted(m for (m,) in conn.execute(select(OrderArchive.month)))
+    for t in [Order.__table__] + [archive.tables(m)[0] for m in months]:
+        last = 0
+        while True:
+            rows = conn.execute(select(t.c.id, t.c.client_id, t.c.total, t.c.status, t.c.assigned_driver,
+                                       t.c.eta_min, t.c.dist_km, t.c.created_at, t.c.assigned_at, t.c.delivered_at)
+                                .where(t.c.id > last).order_by(t.c.id).limit(batch)).all()
+            if not rows: break
+            last = rows[-1].id
+            conn.execute(insert(OrderEvent), [e for r in rows for e in _implied(r)])
+
+
+def _fix_orders(states, skip, dry_run):
+    # states: [(order_id, status, driver)] según el log; corrige la tabla caliente (lo
+    # archivado es terminal y no cambia). skip: pedidos con eventos posteriores al recorrido
+    fixed = 0
+    for i in range(0, len(states), 500):
+        chunk = {oid: (st, drv) for oid, st, drv in states[i:i + 500] if oid not in skip}
+        if not chunk: continue
+        cur = db.session.execute(select(Order.id, Order.status, Order.assigned_driver)
+                                 .where(Order.id.in_(chunk))).all()
+        bad = [{"oid":r.id, "old":r.status, "st":chunk[r.id][0], "drv":chunk[r.id][1]}
+               for r in cur if (r.status, r.assigned_driver) != chunk[r.id]]
+        if bad and not dry_run:
+            t = Order.__table__
+            db.session.execute(update(t).where(t.c.id == bindparam("oid"), t.c.status == bindparam("old"))
+                               .values(status=bindparam("st"), assigned_driver=bindparam("drv")), bad)
+        fixed += len(bad)
+    return fixed
+
+def rebuild(batch=5000, dry_run=False):
+    # Proyecciones desde el log, en lotes de `batch` eventos. En memoria solo quedan los
+    # pedidos abiertos y un acumulado por cliente. Devuelve cuántas filas se corrigieron.
+    head = db.session.query(func.max(OrderEvent.id)).scalar() or 0
+    open_, done, clients = {}, [], {}
+    fixed = {"orders": 0, "drivers": 0, "clients": 0}
+    last = 0
+    while last < head:
+        rows = db.session.execute(select(OrderEvent.id, OrderEvent.order_id, OrderEvent.status, OrderEvent.driver,
+                                         OrderEvent.data)
+                                  .where(OrderEvent.id > last, OrderEvent.id <= head)
+                                  .order_by(OrderEvent.id).limit(batch)).all()
+        if not rows: break
+        last = rows[-1].id
+        for e in rows:
+            if e.status == "new":
+                d = json.loads(e.data or "{}")
+                c = clients.setdefault(d.get("client_id"), [0, 0.0])
+                c[0] += 1; c[1] += d.get("total") or 0
+                open_[e.order_id] = ("new", None)
+            elif e.status in ACTIVE:
+                open_[e.order_id] = (e.status, e.driver or open_.get(e.order_id, (None, None))[1])
+            else:
+                prev = open_.pop(e.order_id, (None, None))
+                done.append((e.order_id, e.status, e.driver or prev[1]))
+        if len(done) >= batch:
+            fixed["orders"] += _fix_orders(done, set(), dry_run); done = []
+
+    # Lo que pasó mientras tanto no se toca: esos pedidos/repartidores ya van más adelante
+    later = db.session.execute(select(OrderEvent.order_id, OrderEvent.driver).where(OrderEvent.id > head)).all()
+    skip, busy_now = {r.order_id for r in later}, {r.driver for r in later if r.driver}
+    fixed["orders"] += _fix_orders(done + [(oid, st, drv) for oid, (st, drv) in open_.items()], skip, dry_run)
+
+    load = Counter(drv for st, drv in open_.values() if st in ACTIVE and drv)
+    bad = []
+    for r in db.session.execute(select(Driver.phone, Driver.status, Driver.active_orders)).all():
+        if r.phone in busy_now: continue
+        n = load.get(r.phone, 0)
+        st = "busy" if n else ("available" if r.status == "busy" else r.status)
+        if (r.active_orders or 0, r.status) != (n, st): bad.append({"ph":r.phone, "n":n, "st":st})
+    if bad and not dry_run:
+        t = Driver.__table__
+        db.session.execute(update(t).where(t.c.phone == bindparam("ph"))
+                           .values(active_orders=bindparam("n"), status=bindparam("st")), bad)
+    fixed["drivers"] = len(bad)
+
+    # Acumulados de clients como delta, igual que reconcile_clients. Las altas posteriores a
+    # `head` ya están en clients pero no en lo recorrido: se suman a lo esperado. Filas y
+    # altas salen de UNA consulta (misma foto); lo que confirme después entra en la fila
+    # antes del UPDATE y el delta no lo toca.
+    last = 0
+    while True:
+        cq = (select(literal("c").label("src"), Client.id, Client.order_count, Client.lifetime_value,
+                     null().label("data")).where(Client.id > last).order_by(Client.id).limit(batch).subquery())
+        eq = select(literal("e"), null(), null(), null(), OrderEvent.data).where(
+            OrderEvent.id > head, OrderEvent.status == "new")
+        got = db.session.execute(union_all(select(*cq.c), eq)).all()
+        rows = sorted((r for r in got if r.src == "c"), key=lambda r: r.id)
+        if not rows: break
+        last = rows[-1].id
+        expect = {r.id: list(clients.get(r.id, (0, 0.0))) for r in rows}
+        for r in got:
+            d = json.loads(r.data or "{}") if r.src == "e" else {}
+            if d.get("client_id") in expect:
+                expect[d["client_id"]][0] += 1; expect[d["client_id"]][1] += d.get("total") or 0
+        bad = []
+        for r in rows:
+            n, v = expect[r.id]
+            dn, dv = n - (r.order_count or 0), v - (r.lifetime_value or 0)
+            if dn or abs(dv) > 0.005: bad.append({"cid":r.id, "dn":dn, "dv":dv})
+        if bad and not dry_run:
+            c = Client.__table__.c
+            db.session.execute(update(Client.__table__).where(c.id == bindparam("cid")).values(
+                order_count=func.coalesce(c.order_count, 0) + bindparam("dn"),
+                lifetime_value=func.coalesce(c.lifetime_value, 0) + bindparam("dv")), bad)
+        fixed["clients"] += len(bad)
+
+    if dry_run:
+        db.session.rollback()
+    else:
+        db.session.commit()
+        from . import stats
+        stats.reconcile()                 # contadores del panel contra el estado ya corregido
+    return fixed
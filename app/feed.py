@@ -0,0 +1,145 @@
+import json, threading, time
+from collections import deque
+from datetime import datetime, timedelta
+from flask import current_app
+from types import SimpleNamespace
+from sqlalchemy import func, insert
+from . import db
+from .models import ChangeLog
+
+# Feed de cambios compartido entre workers: cada escritura agrega una fila a change_log
+# en la misma transacción; un hilo por proceso (Hub) lee la tabla y reparte a los streams.
+
+PRIVATE = {"session", "pin"}         # avisos entre workers que no salen por /api/feed
+
+def order_delta(o):
+    return {
+        "id":o.id, "status":o.status, "address":o.address, "total":o.total,
+        "lat":o.lat, "lon":o.lon, "assigned_driver":o.assigned_driver, "eta_min":o.eta_min,
+        "created_at":(o.created_at or datetime.utcnow()).isoformat()
+    }
+
+def driver_delta(r):
+    # Se registra junto con una escritura: updated_at (onupdate) queda en "ahora"
+    return {
+        "phone":r.phone, "lat":r.lat, "lon":r.lon, "status":r.status or "available",
+        "active_orders":r.active_orders or 0, "updated_at":datetime.utcnow().isoformat()
+    }
+
+def log(kind, ref, data):
+    db.session.add(ChangeLog(kind=kind, ref=str(ref), data=json.dumps(data)))
+
+def log_order(o):
+    log("order", o.id, order_delta(o))
+
+def log_driver(r):
+    log("driver", r.phone, driver_delta(r))
+
+def log_drivers(rows):
+    if not rows: return
+    db.session.execute(insert(ChangeLog), [
+        {"kind":"driver", "ref":r.phone, "data":json.dumps(driver_delta(r))} for r in rows])
+
+def log_orders(rows):
+    # Inserción en lote (un executemany) para pedidos creados sin objetos ORM
+    db.session.execute(insert(ChangeLog), [
+        {"kind":"order", "ref":str(r["id"]), "data":json.dumps(order_delta(SimpleNamespace(**r)))} for r in rows])
+
+
+class Hub:
+    GAP_S = 2.0        # espera por ids aún no confirmados (secuencias de Postgres)
+
+    def __init__(self, app, size=2000):
+        self.app = app
+        self.ring = deque(maxlen=size)       # (seq, kind, data)
+        self.cond = threading.Condition()
+        self.listeners = []
+        self._gap_since = None
+        self.head = db.session.query(func.max(ChangeLog.id)).scalar() or 0
+
+    def start(self):
+        threading.Thread(target=self._run, name="feed-hub", daemon=True).start()
+
+    def _run(self):
+        last_prune = 0.0
+        while True:
+            try:
+                with self.app.app_context():
+                    self._poll()
+                    if time.time() - last_prune > 60:
+                        self._prune(); last_prune = time.time()
+            except Exception as e:
+                self.app.logger.warning(f"feed: {e}")
+            time.sleep(self.app.config["FEED_POLL_S"])
+
+    def _poll(self):
+        rows = (db.session.query(ChangeLog.id, ChangeLog.kind, ChangeLog.data)
+                .filter(ChangeLog.id > self.head).order_by(ChangeLog.id).limit(500).all())
+        fresh = []
+        for seq, kind, data in rows:
+            if seq != self.head + 1:
+                # Hueco: otra transacción con id menor puede no haber confirmado aún
+                if self._gap_since is None: self._gap_since = time.time()
+                if time.time() - self._gap_since < self.GAP_S: break
+            self._gap_since = None
+            self.head = seq
+            fresh.append((seq, kind, data))
+        if not fresh: return
+        with self.cond:
+            self.ring.extend(fresh)
+            self.cond.notify_all()
+        for fn in self.listeners:
+            try: fn(fresh)
+            except Exception as e: self.app.logger.warning(f"feed listener: {e}")
+
+    def _prune(self):
+        keep = datetime.utcnow() - timedelta(seconds=self.app.config["FEED_RETENTION_S"])
+        ChangeLog.query.filter(ChangeLog.created_at < keep).delete(synchronize_session=False)
+        db.session.commit()
+
+    def floor(self):
+        # Último seq que ya no está en memoria; más atrás hay que ir a la DB
+        with self.cond:
+            return self.ring[0][0] - 1 if self.ring else self.head
+
+    def read(self, cursor, timeout):
+        with self.cond:
+            if self.head <= cursor:
+                self.cond.wait(timeout)
+            if self.ring and cursor < self.ring[0][0] - 1:
+                return None                  # el cliente se quedó atrás del buffer
+            out = []
+            for e in reversed(self.ring):
+                if e[0] <= cursor: break
+                out.append(e)
+            return out[::-1]
+
+    def backfill(self, cursor, upto, limit=1000):
+        # Entradas (cursor, upto] desde la DB; None si ya se podaron o son demasiadas
+        oldest = db.session.query(func.min(ChangeLog.id)).scalar()
+        if oldest is None or oldest > cursor + 1:
+            return None
+        rows = (db.session.query(ChangeLog.id, ChangeLog.kind, ChangeLog.data)
+                .filter(ChangeLog.id > cursor, ChangeLog.id <= upto)
+                .order_by(ChangeLog.id).limit(limit + 1).all())
+        return None if len(rows) > limit else [tuple(r) for r in rows]
+
+
+_hub = None
+_hub_lock = threading.Lock()
+
+def hub():
+    global _hub
+    if _hub is None:
+        with _hub_lock:
+            if _hub is None:
+                h = Hub(current_app._get_current_object())
+                h.start()
+                _hub = h
+    return _hub
+
+def head():
+    return hub().head
+
+def sse(seq, kind, data):
+    return f"id: {seq}\nevent: {kind}\ndata: {data}\n\n"
@@ -0,0 +1,43 @@
+import numpy as np
+
+# Versiones vectorizadas de utils.haversine_km (misma fórmula, mismo radio). Coinciden con
+# la escalar salvo el último bit de asin (<1e-12 km); los ETA en minutos son idénticos.
+R_KM = 6371.0
+SPEED_KMH = 25.0
+
+def haversine_np(lat1, lon1, lat2, lon2):
+    # Acepta escalares o arrays; hace broadcasting como NumPy
+    p1 = np.radians(lat1); p2 = np.radians(lat2)
+    dphi = np.radians(np.subtract(lat2, lat1))
+    dl = np.radians(np.subtract(lon2, lon1))
+    a = np.sin(dphi / 2) ** 2 + np.cos(p1) * np.cos(p2) * np.sin(dl / 2) ** 2
+    return 2 * R_KM * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+def distance_matrix(olat, olon, dlat, dlon):
+    # Pedidos x repartidores, en km
+    olat = np.asarray(olat, dtype=float)[:, None]; olon = np.asarray(olon, dtype=float)[:, None]
+    return haversine_np(olat, olon, np.asarray(dlat, dtype=float)[None, :], np.asarray(dlon, dtype=float)[None, :])
+
+def eta_minutes(km, speed_kmh=SPEED_KMH):
+    # Igual que int(round((km/25)*60)): np.rint también redondea al par
+    return np.rint((np.asarray(km) / speed_kmh) * 60).astype(int)
+
+def eta_matrix(olat, olon, dlat, dlon, speed_kmh=SPEED_KMH):
+    return eta_minutes(distance_matrix(olat, olon, dlat, dlon), speed_kmh)
+
+def knn(lat, lon, lats, lons, k=None, radius_km=None):
+    # Índices de los k puntos más cercanos (opcionalmente dentro de radius_km) y sus distancias
+    d = haversine_np(lat, lon, np.asarray(lats, dtype=float), np.asarray(lons, dtype=float))
+    idx = np.arange(d.size)
+    if radius_km is not None:
+        idx = idx[d <= radius_km]
+    if k is not None and k < idx.size:
+        idx = idx[np.argpartition(d[idx], k)[:k]]
+    idx = idx[np.argsort(d[idx], kind="stable")]
+    return idx, d[idx]
+
+def bbox(lat, lon, radius_km):
+    # Caja que contiene el círculo; sirve para filtrar en SQL antes de medir
+    dlat = radius_km / 111.0
+    dlon = radius_km / (111.0 * max(np.cos(np.radians(lat)), 0.01))
+    return lat - dlat, lat + dlat, lon - dlon, lon + dlon
@@ -0,0 +1,140 @@
+import functools, hashlib, threading, time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from flask import Response, current_app, jsonify, request, session
+from sqlalchemy import delete, select, update
+from . import db, writer
+from .dbutil import insert_for
+from .models import IdempotencyKey
+
+# Idempotency-Key en POST /api/orders y /api/orders/<id>/assign: la app móvil reintenta con
+# la misma clave y recibe la respuesta de la primera vez, sin tocar pedidos ni clientes.
+# Las respuestas viven IDEMPOTENCY_TTL_S en idempotency_keys (la ven todos los workers) y
+# en un LRU por proceso acotado a IDEMPOTENCY_CACHE_MB: un reintento al mismo worker no va
+# a la DB, a otro worker le cuesta un SELECT por PK. Mientras la primera petición corre, la
+# fila está reservada (status NULL) y los reintentos reciben 409; si el worker murió a mitad,
+# la reserva se puede retomar pasados IDEMPOTENCY_LOCK_S.
+
+# Respuestas que no se guardan: el reintento debe volver a ejecutarse
+TRANSIENT = (401, 409, 429)
+
+def _key(raw):
+    scope = f"{request.path}|{session.get('cid') or ''}|{raw}"
+    return hashlib.sha256(scope.encode()).hexdigest()
+
+
+class ResponseStore:
+    MISS = object()
+
+    def __init__(self, max_bytes=8 << 20):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self.cache = OrderedDict()       # key -> (fingerprint, status, body, vence_ts, bytes)
+        self.lock = threading.Lock()
+
+    def _cached(self, key):
+        with self.lock:
+            hit = self.cache.get(key)
+            if hit is None: return self.MISS
+            if hit[3] < time.time():
+                self._pop(key); return self.MISS
+            self.cache.move_to_end(key)
+            return hit[:3]
+
+    def _pop(self, key):
+        hit = self.cache.pop(key, None)
+        if hit: self.used -= hit[4]
+
+    def _remember(self, key, fp, status, body, until):
+        size = len(key) + len(fp) + len(body) + 200       # aprox. con la tupla y el nodo
+        if size > self.max_bytes // 8: return              # respuestas enormes solo en la DB
+        with self.lock:
+            self._pop(key)
+            self.cache[key] = (fp, status, body, until, size)
+            self.used += size
+            while self.used > self.max_bytes:
+                self._pop(next(iter(self.cache)))
+
+    def get(self, key):
+        # (fingerprint, status, body) guardado; status None = en curso; None si no existe
+        hit = self._cached(key)
+        if hit is not self.MISS: return hit
+        t = IdempotencyKey.__table__
+        with db.engine.connect() as conn:
+            row = conn.execute(select(t.c.fingerprint, t.c.status, t.c.body, t.c.expires_at)
+                               .where(t.c.key == key, t.c.expires_at > datetime.utcnow())).first()
+        if row is None: return None
+        if row.status is not None:
+            self._remember(key, row.fingerprint, row.status, row.body,
+                           time.time() + (row.expires_at - datetime.utcnow()).total_seconds())
+        return row.fingerprint, row.status, row.body
+
+    def reserve(self, key, fp, ttl_s, lock_s):
+        # True si esta petición ejecuta la operación (reserva nueva, vencida o abandonada)
+        t = IdempotencyKey.__table__
+        now = datetime.utcnow()
+
+        def write():
+            db.session.execute(delete(t).where(t.c.key == key, t.c.expires_at <= now))
+            got = db.session.execute(insert_for(t).values(
+                key=key, fingerprint=fp, created_at=now, expires_at=now + timedelta(seconds=ttl_s))
+                .on_conflict_do_nothing(index_elements=[t.c.key])).rowcount
+            if got: return True
+            return bool(db.session.execute(update(t).where(
+                t.c.key == key, t.c.fingerprint == fp, t.c.status.is_(None),
+                t.c.created_at < now - timedelta(seconds=lock_s)).values(created_at=now)).rowcount)
+        return writer.run(write)
+
+    def save(self, key, fp, status, body, ttl_s):
+        t = IdempotencyKey.__table__
+        expires = datetime.utcnow() + timedelta(seconds=ttl_s)
+        writer.run(lambda: db.session.execute(
+            update(t).where(t.c.key == key).values(status=status, body=body, expires_at=expires)))
+        self._remember(key, fp, status, body, time.time() + ttl_s)
+
+    def release(self, key):
+        t = IdempotencyKey.__table__
+        writer.run(lambda: db.session.execute(delete(t).where(t.c.key == key, t.c.status.is_(None))))
+
+store = ResponseStore()
+
+def evict():
+    n = db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at < datetime.utcnow())).rowcount
+    db.session.commit()
+    return n
+
+def init(app):
+    store.max_bytes = int(app.config["IDEMPOTENCY_CACHE_MB"] * (1 << 20))
+
+
+def idempotent(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        raw = request.headers.get("Idempotency-Key")
+        cfg = current_app.config
+        if not raw or not cfg["IDEMPOTENCY_TTL_S"]: return view(*args, **kwargs)
+        if len(raw) > 255: return jsonify(error="Idempotency-Key demasiado larga"), 400
+        key, fp = _key(raw), hashlib.sha256(request.get_data()).hexdigest()[:32]
+        hit = store.get(key)
+        if hit is None and store.reserve(key, fp, cfg["IDEMPOTENCY_TTL_S"], cfg["IDEMPOTENCY_LOCK_S"]):
+            try:
+                resp = current_app.make_response(view(*args, **kwargs))
+            except Exception:
+                store.release(key)
+                raise
+            if resp.status_code >= 500 or resp.status_code in TRANSIENT:
+                store.release(key)
+            else:
+                store.save(key, fp, resp.status_code, resp.get_data(as_text=True), cfg["IDEMPOTENCY_TTL_S"])
+            return resp
+        if hit is None: hit = store.get(key)              # otro worker la reservó recién
+        if hit is None or hit[1] is None:
+            r = jsonify(error="Petición en curso, reintenta")
+            r.headers["Retry-After"] = "1"
+            return r, 409
+        if hit[0] != fp:
+            return jsonify(error="Idempotency-Key ya usada con otro cuerpo"), 422
+        r = Response(hit[2], status=hit[1], mimetype="application/json")
+        r.headers["Idempotent-Replayed"] = "true"
+        return r
+    return wrapper
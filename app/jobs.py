@@ -0,0 +1,42 @@
+import atexit, threading, time
+
+# Tareas periódicas por proceso (flush de buffers, limpiezas). El hilo arranca con la
+# primera petición, así `flask migrate` y los scripts no lo levantan.
+
+class Scheduler:
+    def __init__(self, app):
+        self.app = app
+        self.jobs = []                   # [name, every_s, fn, next_t]
+        self._started = False
+        self._lock = threading.Lock()
+        app.extensions["jobs"] = self
+        app.before_request(self._ensure)
+
+    def every(self, name, seconds, fn, at_exit=False, at_start=False):
+        # at_start: primera corrida al arrancar el hilo (cargar caches), no tras `seconds`
+        self.jobs.append([name, seconds, fn, time.monotonic() + (0 if at_start else seconds)])
+        if at_exit:
+            atexit.register(self.run, name)
+
+    def run(self, name):
+        for n, _, fn, _ in self.jobs:
+            if n != name: continue
+            with self.app.app_context():
+                try: fn()
+                except Exception as e: self.app.logger.warning(f"job {n}: {e}")
+
+    def _ensure(self):
+        if self._started: return
+        with self._lock:
+            if self._started: return
+            threading.Thread(target=self._loop, name="jobs", daemon=True).start()
+            self._started = True
+
+    def _loop(self):
+        while True:
+            now = time.monotonic()
+            for job in self.jobs:
+                if now >= job[3]:
+                    job[3] = now + job[1]
+                    self.run(job[0])
+            time.sleep(0.25)
@@ -0,0 +1,88 @@
+import threading
+from datetime import datetime
+from sqlalchemy import func
+from . import db, dispatch, feed, stats
+from .dbutil import insert_for
+from .models import Driver
+
+# Buffer de pings GPS: guarda solo la última posición por teléfono y la vuelca a `drivers`
+# con un upsert en lote cada LOC_FLUSH_S. Las lecturas del mismo proceso ven la posición
+# fresca; los demás workers la reciben al hacer flush (feed).
+
+class LocationBuffer:
+    def __init__(self):
+        self.pending = {}                # phone -> (lat, lon, ts)
+        self.lock = threading.Lock()
+
+    def put(self, phone, lat, lon):
+        now = datetime.utcnow()
+        with self.lock:
+            old = self.pending.get(phone)
+            if old:                      # un ping puede traer solo lat o solo lon
+                lat = old[0] if lat is None else lat
+                lon = old[1] if lon is None else lon
+            self.pending[phone] = (lat, lon, now)
+        dispatch.move(phone, lat, lon)
+        return lat, lon, now
+
+    def get(self, phone):
+        with self.lock:
+            return self.pending.get(phone)
+
+    def items(self):
+        with self.lock:
+            return list(self.pending.items())
+
+    def overlay(self, row):
+        # dict de /api/drivers con la posición pendiente encima
+        p = self.get(row["phone"])
+        if p:
+            row["lat"] = row["lat"] if p[0] is None else p[0]
+            row["lon"] = row["lon"] if p[1] is None else p[1]
+            row["updated_at"] = p[2]
+        return row
+
+    def missing(self, seen):
+        # Repartidores nuevos que solo existen en el buffer todavía
+        with self.lock:
+            items = [(ph, v) for ph, v in self.pending.items() if ph not in seen]
+        return [{"phone":ph, "lat":la, "lon":lo, "status":"available", "active_orders":0,
+                 "updated_at":ts} for ph, (la, lo, ts) in items]
+
+    def flush(self):
+        with self.lock:
+            batch, self.pending = self.pending, {}
+        if not batch: return 0
+        try:
+            upsert([{"phone":ph, "lat":la, "lon":lo, "updated_at":ts} for ph, (la, lo, ts) in batch.items()])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            with self.lock:              # no perder pings: vuelven salvo que haya uno más nuevo
+                for ph, v in batch.items(): self.pending.setdefault(ph, v)
+            raise
+        return len(batch)
+
+
+def upsert(rows):
+    # Altas con INSERT ... ON CONFLICT DO NOTHING (las que entran suman a drivers:total) y un
+    # solo INSERT ... ON CONFLICT DO UPDATE para el resto del lote. Sin commit; deltas al feed
+    t = Driver.__table__
+    cols = (t.c.phone, t.c.lat, t.c.lon, t.c.status, t.c.active_orders)
+    out = db.session.execute(insert_for(t).on_conflict_do_nothing(index_elements=[t.c.phone])
+                             .returning(*cols), rows).all()
+    if out: stats.bump({"drivers:total": len(out)})
+    new = {r.phone for r in out}
+    rest = [r for r in rows if r["phone"] not in new]
+    if rest:
+        stmt = insert_for(t)
+        stmt = stmt.on_conflict_do_update(index_elements=[t.c.phone], set_={
+            "lat": func.coalesce(stmt.excluded.lat, t.c.lat),
+            "lon": func.coalesce(stmt.excluded.lon, t.c.lon),
+            "updated_at": stmt.excluded.updated_at,
+        }).returning(*cols, sort_by_parameter_order=True)
+        out += db.session.execute(stmt, rest).all()
+    feed.log_drivers(out)
+    return out
+
+buffer = LocationBuffer()
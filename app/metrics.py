@@ -0,0 +1,255 @@
+import atexit, bisect, hashlib, hmac, json, os, random, tempfile, threading, time
+from collections import deque
+from flask import Response, jsonify, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Métricas por endpoint: latencia del handler, consultas y tiempo en la DB (eventos de
+# SQLAlchemy, contados por hilo solo mientras hay una petición), la sentencia más lenta y
+# N+1 (la misma sentencia repetida en una petición, p. ej. lazy load de Client.orders u
+# Order.items en un bucle). GET /metrics en formato Prometheus con una serie por worker:
+# cada worker vuelca lo suyo a un archivo y cualquiera responde por todos.
+# Costo por consulta: un perf_counter y un par de sumas; la captura completa de sentencias
+# (sin parámetros) solo en la fracción METRICS_SAMPLE de las peticiones.
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+SQL_MAX = 500                # caracteres de sentencia guardados
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)       # el último es +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, v):
+        self.counts[bisect.bisect_left(self.buckets, v)] += 1
+        self.sum += v
+        self.count += 1
+
+    def dump(self):
+        return {"counts": self.counts, "sum": self.sum, "count": self.count}
+
+
+class Series:
+    __slots__ = ("status", "latency", "db", "queries", "nplus1", "slowest")
+
+    def __init__(self):
+        self.status = {}
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.db = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.nplus1 = 0
+        self.slowest = (0.0, "")                     # (segundos, sentencia)
+
+    def dump(self):
+        return {"status": self.status, "latency": self.latency.dump(), "db": self.db.dump(),
+                "queries": self.queries.dump(), "nplus1": self.nplus1, "slowest": list(self.slowest)}
+
+
+class Req:
+    # Estado de la petición en curso en este hilo
+    __slots__ = ("start", "t0", "queries", "db_s", "slowest", "seen", "capture")
+
+    def __init__(self, capture):
+        self.start = time.perf_counter()
+        self.t0 = 0.0
+        self.queries = 0
+        self.db_s = 0.0
+        self.slowest = (0.0, "")
+        self.seen = {}                               # sentencia -> veces
+        self.capture = [] if capture else None
+
+
+class Metrics:
+    def __init__(self):
+        self.local = threading.local()
+        self.series = {}                             # (método, endpoint) -> Series
+        self.lock = threading.Lock()
+        self.sample = 0.0
+        self.nplus1_min = 5
+        self.samples = deque(maxlen=200)             # peticiones capturadas completas
+        self.nplus1 = deque(maxlen=100)              # últimos N+1 detectados
+        self.warned = set()
+        self.logger = None
+        self.dir = None
+        self.worker = str(os.getpid())
+
+    # Eventos de SQLAlchemy (todas las engines; fuera de una petición no hacen nada)
+    def before_cursor(self, conn, cursor, statement, params, context, executemany):
+        r = getattr(self.local, "req", None)
+        if r is not None: r.t0 = time.perf_counter()
+
+    def after_cursor(self, conn, cursor, statement, params, context, executemany):
+        r = getattr(self.local, "req", None)
+        if r is None: return
+        dt = time.perf_counter() - r.t0
+        r.queries += 1
+        r.db_s += dt
+        if dt > r.slowest[0]: r.slowest = (dt, statement)
+        r.seen[statement] = r.seen.get(statement, 0) + 1
+        if r.capture is not None: r.capture.append((round(dt * 1000, 3), statement[:SQL_MAX]))
+
+    # Ciclo de la petición
+    def begin(self):
+        self.local.req = Req(self.sample and random.random() < self.sample)
+
+    def finish(self, status):
+        r = getattr(self.local, "req", None)
+        if r is None: return
+        self.local.req = None            # lo que corra después (streams) ya no cuenta
+        handler_s = time.perf_counter() - r.start
+        rule = request.url_rule.rule if request.url_rule else "<404>"
+        key = (request.method, rule)
+        stmt, times = max(r.seen.items(), key=lambda kv: kv[1]) if r.seen else ("", 0)
+        with self.lock:
+            s = self.series.get(key)
+            if s is None: s = self.series[key] = Series()
+            s.status[str(status)] = s.status.get(str(status), 0) + 1
+            s.latency.observe(handler_s)
+            s.db.observe(r.db_s)
+            s.queries.observe(r.queries)
+            if r.slowest[0] > s.slowest[0]: s.slowest = (r.slowest[0], r.slowest[1][:SQL_MAX])
+            if times >= self.nplus1_min: s.nplus1 += 1
+        if times >= self.nplus1_min:
+            self.nplus1.append({"endpoint": f"{key[0]} {rule}", "times": times, "sql": stmt[:SQL_MAX],
+                                "at": time.time()})
+            if (key, stmt) not in self.warned and self.logger:
+                self.warned.add((key, stmt))
+                self.logger.warning(f"N+1 en {key[0]} {rule}: {times} veces {stmt[:200]!r}")
+        if r.capture is not None:
+            self.samples.append({"endpoint": f"{key[0]} {rule}", "path": request.full_path.rstrip("?"),
+                                 "status": status, "ms": round(handler_s * 1000, 3),
+                                 "db_ms": round(r.db_s * 1000, 3), "statements": r.capture, "at": time.time()})
+
+    # Volcado entre workers
+    def snapshot(self):
+        with self.lock:
+            return {f"{m} {rule}": s.dump() for (m, rule), s in self.series.items()}
+
+    def dump(self):
+        if not self.dir: return
+        path = os.path.join(self.dir, f"{self.worker}.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump({"worker": self.worker, "series": self.snapshot()}, f)
+        os.replace(path + ".tmp", path)
+
+    def drop(self):
+        if self.dir:
+            try: os.remove(os.path.join(self.dir, f"{self.worker}.json"))
+            except OSError: pass
+
+    def collect(self, fresh_s):
+        # (worker, series) de este proceso y de los demás workers con volcado reciente
+        out = [(self.worker, self.snapshot())]
+        if not self.dir: return out
+        now = time.time()
+        for name in os.listdir(self.dir):
+            if not name.endswith(".json") or name == f"{self.worker}.json": continue
+            path = os.path.join(self.dir, name)
+            try:
+                if now - os.path.getmtime(path) > fresh_s:
+                    if now - os.path.getmtime(path) > 24 * 3600: os.remove(path)   # worker muerto
+                    continue
+                with open(path) as f: d = json.load(f)
+            except (OSError, ValueError):
+                continue
+            out.append((d["worker"], d["series"]))
+        return out
+
+metrics = Metrics()
+
+def _label(v):
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _histogram(lines, name, buckets, labels, h):
+    acc = 0
+    for le, n in zip(list(buckets) + ["+Inf"], h["counts"]):
+        acc += n
+        lines.append(f'{name}_bucket{{{labels},le="{le}"}} {acc}')
+    lines.append(f"{name}_sum{{{labels}}} {h['sum']:.6f}")
+    lines.append(f"{name}_count{{{labels}}} {h['count']}")
+
+def render(collected):
+    heads = [("resto_http_requests_total", "counter", "Peticiones por endpoint y status"),
+             ("resto_http_request_seconds", "histogram", "Tiempo del handler"),
+             ("resto_db_request_seconds", "histogram", "Tiempo en la DB por petición"),
+             ("resto_db_request_queries", "histogram", "Consultas por petición"),
+             ("resto_db_nplus1_total", "counter", f"Peticiones con una sentencia repetida >= {metrics.nplus1_min} veces"),
+             ("resto_db_slowest_statement_seconds", "gauge", "Sentencia más lenta vista")]
+    body = {name: [] for name, _, _ in heads}
+    for worker, series in collected:
+        for ep, s in sorted(series.items()):
+            method, rule = ep.split(" ", 1)
+            labels = f'method="{method}",endpoint="{_label(rule)}",worker="{_label(worker)}"'
+            for status, n in sorted(s["status"].items()):
+                body["resto_http_requests_total"].append(f'resto_http_requests_total{{{labels},status="{status}"}} {n}')
+            _histogram(body["resto_http_request_seconds"], "resto_http_request_seconds", LATENCY_BUCKETS, labels, s["latency"])
+            _histogram(body["resto_db_request_seconds"], "resto_db_request_seconds", LATENCY_BUCKETS, labels, s["db"])
+            _histogram(body["resto_db_request_queries"], "resto_db_request_queries", QUERY_BUCKETS, labels, s["queries"])
+            body["resto_db_nplus1_total"].append(f"resto_db_nplus1_total{{{labels}}} {s['nplus1']}")
+            body["resto_db_slowest_statement_seconds"].append(
+                f"resto_db_slowest_statement_seconds{{{labels}}} {s['slowest'][0]:.6f}")
+    lines = []
+    for name, kind, help_ in heads:
+        lines += [f"# HELP {name} {help_}", f"# TYPE {name} {kind}"] + body[name]
+    return "\n".join(lines) + "\n"
+
+def init(app, jobs):
+    cfg = app.config
+    if not cfg["METRICS_ENABLED"]: return
+    metrics.sample = cfg["METRICS_SAMPLE"]
+    metrics.nplus1_min = cfg["METRICS_NPLUS1"]
+    metrics.logger = app.logger
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    tag = hashlib.sha256(cfg["SQLALCHEMY_DATABASE_URI"].encode()).hexdigest()[:12]
+    metrics.dir = cfg["METRICS_DIR"] or os.path.join(base, f"resto-metrics-{tag}")
+    try:
+        os.makedirs(metrics.dir, exist_ok=True)
+    except OSError as e:
+        app.logger.warning(f"Métricas solo de este worker ({metrics.dir}: {e})")
+        metrics.dir = None
+    if not event.contains(Engine, "before_cursor_execute", metrics.before_cursor):
+        event.listen(Engine, "before_cursor_execute", metrics.before_cursor)
+        event.listen(Engine, "after_cursor_execute", metrics.after_cursor)
+    jobs.every("metrics_dump", cfg["METRICS_FLUSH_S"], metrics.dump)
+    atexit.register(metrics.drop)
+
+    @app.before_request
+    def _metrics_begin():
+        metrics.begin()
+
+    @app.after_request
+    def _metrics_after(resp):
+        metrics.finish(resp.status_code)
+        return resp
+
+    @app.teardown_request
+    def _metrics_teardown(exc):
+        metrics.finish(500)              # solo si after_request no corrió (excepción)
+
+    def authorized():
+        # Cerrado por defecto: sin METRICS_API_KEY nadie entra (salvo METRICS_PUBLIC en /metrics)
+        key = cfg["METRICS_API_KEY"]
+        if not key: return False
+        got = request.headers.get("X-Api-Key") or request.headers.get("Authorization", "").removeprefix("Bearer ")
+        return hmac.compare_digest(got, key)
+
+    @app.get("/metrics")
+    def metrics_prometheus():
+        if not (cfg["METRICS_PUBLIC"] or authorized()): return jsonify(error="No autorizado"), 401
+        return Response(render(metrics.collect(cfg["METRICS_FLUSH_S"] * 4)),
+                        mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+    @app.get("/metrics/requests")
+    def metrics_requests():
+        # Detalle de este worker: peticiones muestreadas, N+1 recientes y la más lenta por endpoint
+        if not authorized(): return jsonify(error="No autorizado"), 401
+        slowest = {ep: {"ms": round(s["slowest"][0] * 1000, 3), "sql": s["slowest"][1]}
+                   for ep, s in metrics.snapshot().items() if s["slowest"][1]}
+        return jsonify(ok=True, worker=metrics.worker, sample=metrics.sample,
+                       samples=list(metrics.samples), nplus1=list(metrics.nplus1), slowest=slowest)
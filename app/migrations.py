@@ -0,0 +1,196 @@
+import os
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import MetaData, inspect, text
+from sqlalchemy.schema import CreateIndex, CreateTable
+from . import db
+try:
+    import fcntl
+except ImportError:          # Windows: sin exclusión entre procesos
+    fcntl = None
+
+# Migraciones versionadas. Cada paso es idempotente (una DB nueva ya trae todo lo
+# declarado en models.py) y queda registrado en schema_version.
+# Uso: flask --app wsgi migrate
+
+LOCK_ID = 7_302_025          # pg_advisory_lock: un solo migrador a la vez (SQLite: flock)
+MIGRATIONS = []
+
+def migration(version, name, autocommit=False):
+    # autocommit=True para DDL que no puede ir en transacción (CREATE INDEX CONCURRENTLY)
+    def deco(fn):
+        MIGRATIONS.append((version, name, fn, autocommit))
+        return fn
+    return deco
+
+def create_index(conn, idx):
+    # Crea el índice declarado sin bloquear escrituras en Postgres
+    ddl = str(CreateIndex(idx, if_not_exists=True).compile(dialect=conn.dialect))
+    if conn.dialect.name == "postgresql":
+        invalid = conn.execute(text(
+            "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = :n AND NOT i.indisvalid"), {"n": idx.name}).first()
+        if invalid:     # restos de un CONCURRENTLY que falló a medias
+            conn.exec_driver_sql(f'DROP INDEX CONCURRENTLY IF EXISTS "{idx.name}"')
+        ddl = ddl.replace("INDEX", "INDEX CONCURRENTLY", 1)
+    conn.exec_driver_sql(ddl)
+
+def create_indexes(conn, *tables):
+    for t in tables:
+        for idx in sorted(db.metadata.tables[t].indexes, key=lambda i: i.name):
+            create_index(conn, idx)
+
+def add_column(conn, table, column):
+    # ALTER TABLE ... ADD COLUMN solo si falta (las DB nuevas ya la traen)
+    if column.name in {c["name"] for c in inspect(conn).get_columns(table)}:
+        return
+    ddl = column.type.compile(dialect=conn.dialect)
+    conn.exec_driver_sql(f'ALTER TABLE {table} ADD COLUMN {column.name} {ddl}')
+
+
+@migration(1, "tablas faltantes")
+def _m1(conn):
+    from . import models  # noqa
+    db.metadata.create_all(conn, checkfirst=True)
+
+@migration(2, "índices para las consultas calientes", autocommit=True)
+def _m2(conn):
+    create_indexes(conn, "orders", "order_items", "addresses", "auth_pins", "drivers", "change_log")
+
+@migration(3, "historial de ubicaciones (driver_track_chunks)")
+def _m3(conn):
+    from . import models  # noqa
+    db.metadata.tables["driver_track_chunks"].create(conn, checkfirst=True)
+
+@migration(4, "ETA aprendido: tiempos de asignación/entrega y eta_speeds")
+def _m4(conn):
+    from .models import Order
+    for col in ("dist_km", "assigned_at", "delivered_at"):
+        add_column(conn, "orders", Order.__table__.c[col])
+    db.metadata.tables["eta_speeds"].create(conn, checkfirst=True)
+
+@migration(5, "contadores del panel (stats_counters)")
+def _m5(conn):
+    from . import models  # noqa
+    db.metadata.tables["stats_counters"].create(conn, checkfirst=True)
+
+@migration(6, "sesiones del lado servidor (web_sessions, app_secrets)")
+def _m6(conn):
+    from . import models  # noqa
+    for t in ("web_sessions", "app_secrets"):
+        db.metadata.tables[t].create(conn, checkfirst=True)
+
+@migration(7, "catálogo del menú (menu_items) sembrado desde utils.MENU")
+def _m7(conn):
+    from .models import MenuItem, OrderItem
+    from .utils import MENU
+    MenuItem.__table__.create(conn, checkfirst=True)
+    add_column(conn, "order_items", OrderItem.__table__.c.item_id)
+    if not conn.execute(text("SELECT 1 FROM menu_items LIMIT 1")).first():
+        conn.execute(MenuItem.__table__.insert(), [
+            {"restaurant":"main", "name":name, "price":price, "available":True, "sort":i,
+             "updated_at":datetime.utcnow()} for i, (name, price) in enumerate(MENU.items())])
+
+@migration(8, "archivo de pedidos por mes (order_archives)")
+def _m8(conn):
+    from .models import OrderArchive
+    OrderArchive.__table__.create(conn, checkfirst=True)
+
+@migration(9, "respuestas por Idempotency-Key (idempotency_keys)")
+def _m9(conn):
+    from .models import IdempotencyKey
+    IdempotencyKey.__table__.create(conn, checkfirst=True)
+
+@migration(10, "order_events: historial de transiciones (con los pedidos existentes) y 'done' -> 'delivered'")
+def _m10(conn):
+    from .models import OrderEvent
+    from .events import backfill
+    conn.execute(text("UPDATE orders SET status = 'delivered' WHERE status = 'done'"))
+    OrderEvent.__table__.create(conn, checkfirst=True)
+    if not conn.execute(text("SELECT 1 FROM order_events LIMIT 1")).first():
+        backfill(conn)
+
+def _sqlite_autoincrement(conn, table, floor):
+    # SQLite sin AUTOINCREMENT reusa el id más alto si se borra (el archivo borra justo los
+    # más viejos... y a veces los más altos). Rehace la tabla con AUTOINCREMENT, copia las
+    # filas y deja la secuencia en `floor` como mínimo.
+    t = db.metadata.tables[table]
+    ddl = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :n"),
+                       {"n": table}).scalar() or ""
+    if "AUTOINCREMENT" not in ddl.upper():
+        m = MetaData()
+        for dep in {fk.column.table for fk in t.foreign_keys}: dep.to_metadata(m)
+        new = t.to_metadata(m, name=f"{table}_new")
+        conn.exec_driver_sql(str(CreateTable(new).compile(dialect=conn.dialect)))
+        cols = ", ".join(f'"{c.name}"' for c in t.c)
+        conn.exec_driver_sql(f'INSERT INTO {table}_new ({cols}) SELECT {cols} FROM {table}')
+        conn.exec_driver_sql(f"DROP TABLE {table}")
+        conn.exec_driver_sql(f"ALTER TABLE {table}_new RENAME TO {table}")
+        for idx in t.indexes: create_index(conn, idx)
+    seq = conn.execute(text("SELECT seq FROM sqlite_sequence WHERE name = :n"), {"n": table}).scalar()
+    if seq is None:
+        conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES (:n, :s)"), {"n": table, "s": floor})
+    elif seq < floor:
+        conn.execute(text("UPDATE sqlite_sequence SET seq = :s WHERE name = :n"), {"n": table, "s": floor})
+
+@migration(11, "orders / order_items con AUTOINCREMENT en SQLite (ids archivados no se reutilizan)")
+def _m11(conn):
+    if conn.dialect.name != "sqlite": return       # Postgres: las secuencias nunca retroceden
+    from . import archive
+    months = [m for (m,) in conn.execute(text("SELECT month FROM order_archives"))]
+    top = lambda sql: conn.execute(text(sql)).scalar() or 0
+    o_max = max([top("SELECT max(id) FROM orders"), top("SELECT max(order_id) FROM order_events")]
+                + [top(f"SELECT max(id) FROM {archive.tables(m)[0].name}") for m in months])
+    i_max = max([top("SELECT max(id) FROM order_items")]
+                + [top(f"SELECT max(id) FROM {archive.tables(m)[1].name}") for m in months])
+    _sqlite_autoincrement(conn, "orders", o_max)
+    _sqlite_autoincrement(conn, "order_items", i_max)
+
+
+@contextmanager
+def _file_lock(engine):
+    # Los workers de gunicorn con SQLite migran todos al arrancar: uno a la vez, y los que
+    # esperan encuentran ya todo en schema_version. Archivo junto a la DB.
+    path = engine.url.database
+    if not fcntl or not path or path == ":memory:":
+        yield; return
+    fd = os.open(f"{path}.migrate.lock", os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)                 # suelta el flock
+
+def upgrade(engine=None, log=print):
+    engine = engine or db.engine
+    pg = engine.dialect.name == "postgresql"
+    if engine.dialect.name == "sqlite":
+        with _file_lock(engine):
+            return _upgrade(engine, pg, log)
+    return _upgrade(engine, pg, log)
+
+def _upgrade(engine, pg, log):
+    applied = []
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if pg: conn.execute(text("SELECT pg_advisory_lock(:k)"), {"k": LOCK_ID})
+        try:
+            conn.exec_driver_sql(
+                "CREATE TABLE IF NOT EXISTS schema_version ("
+                "version INTEGER PRIMARY KEY, name VARCHAR(120), applied_at TIMESTAMP)")
+            done = {v for (v,) in conn.exec_driver_sql("SELECT version FROM schema_version")}
+            for version, name, fn, autocommit in sorted(MIGRATIONS, key=lambda m: m[0]):
+                if version in done: continue
+                log(f"migración {version}: {name}")
+                if autocommit:
+                    fn(conn)
+                    conn.execute(text("INSERT INTO schema_version VALUES (:v, :n, :t)"),
+                                 {"v": version, "n": name, "t": datetime.utcnow()})
+                else:
+                    with engine.begin() as tx:
+                        fn(tx)
+                        tx.execute(text("INSERT INTO schema_version VALUES (:v, :n, :t)"),
+                                   {"v": version, "n": name, "t": datetime.utcnow()})
+                applied.append(version)
+        finally:
+            if pg: conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": LOCK_ID})
+    return applied
@@ -1,4 +1,5 @@
 from datetime import datetime
+from sqlalchemy import text
 from . import db
 
 class Client(db.Model):
@@ -17,10 +18,11 @@ class Client(db.Model):
 
     addresses = db.relationship("Address", backref="client", lazy=True, cascade="all, delete-orphan")
     pins = db.relationship("AuthPin", backref="client", lazy=True, cascade="all, delete-orphan")
-    orders = db.relationship("Order", backref="client", lazy=True)
+    orders = db.relationship("Order", backref="client", lazy=True)   # solo los calientes (ver archive.py)
 
 class Address(db.Model):
     __tablename__ = "addresses"
+    __table_args__ = (db.Index("ix_addresses_client_created", "client_id", "created_at"),)
     id = db.Column(db.Integer, primary_key=True)
     client_id = db.Column(db.Integer, db.ForeignKey("clients.id"), nullable=False)
     label = db.Column(db.String(64))             # ej. "Casa", "Trabajo"
@@ -32,6 +34,7 @@ class Address(db.Model):
 
 class AuthPin(db.Model):
     __tablename__ = "auth_pins"
+    __table_args__ = (db.Index("ix_auth_pins_client", "client_id"),)
     id = db.Column(db.Integer, primary_key=True)
     client_id = db.Column(db.Integer, db.ForeignKey("clients.id"), nullable=False)
     pin_hash = db.Column(db.String(64), nullable=False)  # sha256
@@ -39,32 +42,145 @@ class AuthPin(db.Model):
 
 class Order(db.Model):
     __tablename__ = "orders"
+    __table_args__ = (
+        db.Index("ix_orders_created_id", "created_at", "id"),              # /orders/all (keyset)
+        db.Index("ix_orders_status_created", "status", "created_at", "id"),
+        db.Index("ix_orders_new_created", "created_at",                    # /orders (solo nuevos)
+                 postgresql_where=text("status = 'new'"), sqlite_where=text("status = 'new'")),
+        db.Index("ix_orders_driver_created", "assigned_driver", "created_at"),
+        db.Index("ix_orders_client", "client_id"),
+        {"sqlite_autoincrement": True},      # ids archivados (archive.py) no se reutilizan
+    )
     id = db.Column(db.Integer, primary_key=True)
     client_id = db.Column(db.Integer, db.ForeignKey("clients.id"), nullable=False)
     address = db.Column(db.String(255), nullable=False)
     lat = db.Column(db.Float, nullable=False)
     lon = db.Column(db.Float, nullable=False)
     total = db.Column(db.Float, nullable=False)
-    status = db.Column(db.String(24), default="new")      # new, assigned, delivering, done, canceled
+    status = db.Column(db.String(24), default="new")      # new, assigned, delivering, delivered, canceled (events.py)
     assigned_driver = db.Column(db.String(32))
     eta_min = db.Column(db.Integer)
+    dist_km = db.Column(db.Float)                         # repartidor -> destino al asignar
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    assigned_at = db.Column(db.DateTime)
+    delivered_at = db.Column(db.DateTime)
 
     items = db.relationship("OrderItem", backref="order", lazy=True, cascade="all, delete-orphan")
 
 class OrderItem(db.Model):
     __tablename__ = "order_items"
+    __table_args__ = (db.Index("ix_order_items_order", "order_id"), {"sqlite_autoincrement": True})
     id = db.Column(db.Integer, primary_key=True)
     order_id = db.Column(db.Integer, db.ForeignKey("orders.id"), nullable=False)
+    item_id = db.Column(db.Integer)                      # menu_items.id al momento del pedido
     name = db.Column(db.String(120), nullable=False)
     qty = db.Column(db.Integer, nullable=False, default=1)
     price = db.Column(db.Float, nullable=False, default=0.0)
 
+class MenuItem(db.Model):
+    # Catálogo (catalog.py). Nombre y precio se copian a order_items al pedir.
+    __tablename__ = "menu_items"
+    __table_args__ = (db.Index("ux_menu_items_restaurant_name", "restaurant", "name", unique=True),)
+    id = db.Column(db.Integer, primary_key=True)
+    restaurant = db.Column(db.String(32), nullable=False, default="main")
+    name = db.Column(db.String(120), nullable=False)
+    price = db.Column(db.Float, nullable=False)
+    available = db.Column(db.Boolean, nullable=False, default=True)
+    sort = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 class Driver(db.Model):
     __tablename__ = "drivers"
+    __table_args__ = (db.Index("ix_drivers_updated", "updated_at"),)
     phone = db.Column(db.String(32), primary_key=True)
     lat = db.Column(db.Float)
     lon = db.Column(db.Float)
     status = db.Column(db.String(24), default="available")   # available, busy, offline
     active_orders = db.Column(db.Integer, default=0)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class EtaSpeed(db.Model):
+    # Acumulados para el ETA aprendido (eta.py): zona "*" = toda la ciudad en esa hora
+    __tablename__ = "eta_speeds"
+    zone = db.Column(db.String(24), primary_key=True)
+    hour = db.Column(db.Integer, primary_key=True)
+    n = db.Column(db.Integer, nullable=False, default=0)
+    km = db.Column(db.Float, nullable=False, default=0.0)
+    minutes = db.Column(db.Float, nullable=False, default=0.0)
+
+class StatCounter(db.Model):
+    # Contadores del panel (stats.py), repartidos en shards para no serializar escrituras
+    __tablename__ = "stats_counters"
+    key = db.Column(db.String(64), primary_key=True)
+    shard = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.Float, nullable=False, default=0.0)
+
+class WebSession(db.Model):
+    # Sesiones del lado servidor (sessions.py); key = sha256 del id de la cookie
+    __tablename__ = "web_sessions"
+    key = db.Column(db.String(32), primary_key=True)
+    data = db.Column(db.Text, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class AppSecret(db.Model):
+    # Secretos compartidos por todos los workers cuando no vienen por entorno
+    __tablename__ = "app_secrets"
+    name = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.String(128), nullable=False)
+
+class ChangeLog(db.Model):
+    # Deltas de pedidos/repartidores para /api/feed; el id es el cursor (monótono entre workers)
+    __tablename__ = "change_log"
+    __table_args__ = {"sqlite_autoincrement": True}
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(16), nullable=False)      # order, driver, menu, session, pin
+    ref = db.Column(db.String(32), nullable=False)
+    data = db.Column(db.Text, nullable=False)            # JSON del delta
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class OrderArchive(db.Model):
+    # Un registro por mes archivado (archive.py): las tablas orders_AAAAMM / order_items_AAAAMM
+    # existen y estos son sus totales, para sumar lo frío a las estadísticas sin recorrerlo
+    __tablename__ = "order_archives"
+    month = db.Column(db.String(6), primary_key=True)    # AAAAMM de created_at
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    delivered = db.Column(db.Integer, nullable=False, default=0)
+    canceled = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class OrderEvent(db.Model):
+    # Transiciones de pedidos (events.py), solo se agregan; el id es la secuencia para leer
+    # en orden. Sin FK a orders: los pedidos viejos se mudan a las tablas de archivo
+    __tablename__ = "order_events"
+    __table_args__ = (db.Index("ix_order_events_order", "order_id", "id"), {"sqlite_autoincrement": True})
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(16), nullable=False)      # created, assigned, picked_up, delivered, canceled
+    status = db.Column(db.String(24), nullable=False)    # estado del pedido tras el evento
+    driver = db.Column(db.String(32))
+    data = db.Column(db.Text)                            # JSON: client_id/total al crear, eta_min/dist_km al asignar
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class IdempotencyKey(db.Model):
+    # Respuestas de POST con Idempotency-Key (idempotency.py); key = sha256 de ruta, cliente
+    # y clave. status NULL: la primera petición todavía está en curso
+    __tablename__ = "idempotency_keys"
+    key = db.Column(db.String(64), primary_key=True)
+    fingerprint = db.Column(db.String(32), nullable=False)   # sha256 del cuerpo de la petición
+    status = db.Column(db.Integer)
+    body = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class DriverTrackChunk(db.Model):
+    # Historial de pings: bloques comprimidos (deltas en arrays) por repartidor y día, ver track.py
+    __tablename__ = "driver_track_chunks"
+    __table_args__ = (db.Index("ix_track_phone_day_t0", "phone", "day", "t0"),)
+    id = db.Column(db.Integer, primary_key=True)
+    phone = db.Column(db.String(32), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    t0 = db.Column(db.DateTime, nullable=False)
+    t1 = db.Column(db.DateTime, nullable=False)
+    n = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
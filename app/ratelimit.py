@@ -0,0 +1,61 @@
+import hashlib, mmap, os, struct, tempfile, threading, time
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:          # Windows: solo exclusión entre hilos del mismo proceso
+    fcntl = None
+
+# Token buckets en memoria compartida: una tabla de slots en un archivo mapeado (en
+# /dev/shm si existe) que abren todos los workers de la máquina, con flock para exclusión
+# entre procesos. Claves con hash keyed por el secreto de la app: no se pueden fabricar
+# colisiones para desalojar el bucket de otro.
+
+SLOT = struct.Struct("<Qdd")     # hash de la clave, tokens, último uso
+WAYS = 4                         # slots candidatos por clave; se desaloja el menos usado
+
+def default_path(tag):
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, f"resto-{hashlib.sha256(tag.encode()).hexdigest()[:12]}.rl")
+
+
+class ShmBuckets:
+    def __init__(self, path, secret, slots=1 << 16):
+        self.slots = slots
+        self.secret = hashlib.sha256(str(secret).encode()).digest()
+        size = slots * SLOT.size
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self.fd).st_size < size:
+            os.ftruncate(self.fd, size)
+        self.mm = mmap.mmap(self.fd, size)
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self):
+        with self.lock:
+            if fcntl: fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try: yield
+            finally:
+                if fcntl: fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def _hash(self, key):
+        h = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8, key=self.secret).digest(), "little")
+        return h or 1                # 0 = slot vacío
+
+    def take(self, key, burst, refill_s, now=None):
+        # Consume un token. Devuelve 0 si pasó, o los segundos hasta el próximo token.
+        now = time.time() if now is None else now
+        h = self._hash(key); base = h % self.slots
+        with self._locked():
+            off = victim = None
+            for i in range(WAYS):
+                o = ((base + i) % self.slots) * SLOT.size
+                k, tokens, last = SLOT.unpack_from(self.mm, o)
+                if k == h: off = o; break
+                rank = -1.0 if k == 0 else last          # vacío primero, luego el más viejo
+                if victim is None or rank < victim[1]: victim = (o, rank)
+            if off is None:
+                off, tokens, last = victim[0], float(burst), now
+            tokens = min(float(burst), tokens + (now - last) / refill_s)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) * refill_s
+            SLOT.pack_into(self.mm, off, h, tokens - 1 if not wait else tokens, now)
+        return wait
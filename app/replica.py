@@ -0,0 +1,30 @@
+import time
+from flask import current_app
+from sqlalchemy import func
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+from . import db, feed
+from .models import ChangeLog
+
+# Lecturas de polling (listados de pedidos y repartidores) contra la réplica de
+# DATABASE_REPLICA_URL. Si la réplica falla se lee de la primaria y no se reintenta hasta
+# pasados REPLICA_RETRY_S. El cursor del feed sale de la misma réplica: la página refleja
+# al menos ese punto y el feed entrega lo que falte desde la primaria.
+
+_down_until = 0.0
+
+def available():
+    return "replica" in db.engines and time.monotonic() >= _down_until
+
+def read(fn):
+    # fn(session, seq) -> respuesta; seq = cursor del feed consistente con esa sesión
+    global _down_until
+    if available():
+        try:
+            with Session(db.engines["replica"]) as s:
+                seq = s.query(func.max(ChangeLog.id)).scalar() or 0
+                return fn(s, min(seq, feed.head()))
+        except DBAPIError as e:
+            _down_until = time.monotonic() + current_app.config["REPLICA_RETRY_S"]
+            current_app.logger.warning(f"Réplica no disponible, leyendo de la primaria: {e}")
+    return fn(db.session, feed.head())
@@ -0,0 +1,73 @@
+import gzip, json
+from datetime import date, datetime
+from decimal import Decimal
+from flask import current_app, request
+from flask.json.provider import JSONProvider
+try:
+    import orjson
+except ImportError:          # sin orjson: json de la stdlib, mismo formato de salida
+    orjson = None
+try:
+    import brotli
+except ImportError:          # sin brotli: solo gzip
+    brotli = None
+
+# Respuestas JSON de la API: jsonify pasa por orjson (fechas a ISO en C, sin isoformat()
+# por fila) y el after_request del blueprint comprime con brotli/gzip según Accept-Encoding
+# las que pasan de COMPRESS_MIN_BYTES. Los streams (feed SSE, recorridos) no se tocan.
+
+_OPTS = orjson and orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+def _default(o):
+    if isinstance(o, (datetime, date)): return o.isoformat()
+    if isinstance(o, Decimal): return float(o)
+    if hasattr(o, "tolist"): return o.tolist()           # escalares/arrays de NumPy
+    raise TypeError(f"No serializable: {type(o).__name__}")
+
+def dumps(obj, fast=True):
+    # bytes UTF-8 compactos; datetime naive -> "2025-01-31T12:00:00.123456" en ambos caminos
+    if fast and orjson:
+        return orjson.dumps(obj, default=_default, option=_OPTS)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+class FastJSONProvider(JSONProvider):
+    # app.json: lo usan jsonify y request.get_json
+    fast = True
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj, self.fast).decode()
+
+    def loads(self, s, **kwargs):
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj, self.fast), mimetype="application/json")
+
+
+def compress(resp):
+    cfg = current_app.config
+    if (not cfg["COMPRESS_MIN_BYTES"] or resp.direct_passthrough or resp.is_streamed
+            or resp.status_code in (204, 304) or "Content-Encoding" in resp.headers
+            or resp.mimetype != "application/json"):
+        return resp
+    body = resp.get_data()
+    if len(body) < cfg["COMPRESS_MIN_BYTES"]: return resp
+    resp.vary.add("Accept-Encoding")
+    accept = request.accept_encodings
+    if brotli and accept["br"]:
+        data, enc = brotli.compress(body, quality=cfg["COMPRESS_BR_QUALITY"]), "br"
+    elif accept["gzip"]:
+        data, enc = gzip.compress(body, compresslevel=cfg["COMPRESS_GZIP_LEVEL"], mtime=0), "gzip"
+    else:
+        return resp
+    resp.set_data(data)
+    resp.headers["Content-Encoding"] = enc
+    etag, weak = resp.get_etag()
+    if etag and not weak: resp.set_etag(etag, weak=True)   # otra representación, mismo contenido
+    return resp
+
+def init(app):
+    app.json = FastJSONProvider(app)
+    app.json.fast = app.config["JSON_FAST"]
@@ -0,0 +1,155 @@
+import hashlib, json, secrets, threading, time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from sqlalchemy import delete, insert, select
+from werkzeug.datastructures import CallbackDict
+from . import db
+from .dbutil import insert_for
+from .models import AppSecret, ChangeLog, WebSession
+
+# Sesiones en el servidor: la cookie solo lleva un id aleatorio firmado; los datos viven en
+# web_sessions y en un LRU por proceso. Con 4 workers la sesión la ve cualquiera de ellos
+# (el que no la tiene en cache la lee una vez). Al cerrar sesión se avisa por el feed para
+# que los demás workers la saquen de su cache.
+
+def shared_secret(name="SECRET_KEY"):
+    # La primera vez la genera un worker; los demás leen la misma de app_secrets
+    t = AppSecret.__table__
+    with db.engine.begin() as conn:
+        conn.execute(insert_for(t).values(name=name, value=secrets.token_hex(32))
+                     .on_conflict_do_nothing(index_elements=[t.c.name]))
+        return conn.execute(select(t.c.value).where(t.c.name == name)).scalar_one()
+
+def _key(sid):
+    return hashlib.sha256(sid.encode()).hexdigest()[:32]     # en la DB nunca va el id crudo
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None):
+        def on_update(s):
+            s.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = sid is None
+        self.modified = False
+
+
+class SessionStore:
+    MISS = object()
+
+    def __init__(self, size=10_000, negative_s=30):
+        self.size = size
+        self.negative_s = negative_s
+        self.cache = OrderedDict()       # key -> (data | None, vence_ts)
+        self.lock = threading.Lock()
+        self._listening = False
+
+    def _cached(self, key):
+        with self.lock:
+            hit = self.cache.get(key)
+            if hit is None: return self.MISS
+            if hit[1] < time.time():
+                del self.cache[key]; return self.MISS
+            self.cache.move_to_end(key)
+            return hit[0]
+
+    def _remember(self, key, data, until):
+        with self.lock:
+            self.cache[key] = (data, until)
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.size:
+                self.cache.popitem(last=False)
+
+    def get(self, sid):
+        key = _key(sid)
+        data = self._cached(key)
+        if data is not self.MISS: return data
+        t = WebSession.__table__
+        with db.engine.connect() as conn:
+            row = conn.execute(select(t.c.data, t.c.expires_at)
+                               .where(t.c.key == key, t.c.expires_at > datetime.utcnow())).first()
+        if row is None:
+            self._remember(key, None, time.time() + self.negative_s)
+            return None
+        data = json.loads(row.data)
+        self._remember(key, data, time.time() + (row.expires_at - datetime.utcnow()).total_seconds())
+        return data
+
+    def put(self, old_sid, data, lifetime):
+        # Id nuevo en cada escritura (login/logout son raros): evita fijación de sesión
+        sid = secrets.token_urlsafe(32)
+        expires = datetime.utcnow() + lifetime
+        with db.engine.begin() as conn:
+            conn.execute(insert(WebSession), {"key":_key(sid), "data":json.dumps(data), "expires_at":expires})
+            if old_sid: self._drop(conn, old_sid)
+        self._remember(_key(sid), dict(data), time.time() + lifetime.total_seconds())
+        return sid
+
+    def delete(self, sid):
+        with db.engine.begin() as conn:
+            self._drop(conn, sid)
+
+    def _drop(self, conn, sid):
+        key = _key(sid)
+        conn.execute(delete(WebSession).where(WebSession.key == key))
+        conn.execute(insert(ChangeLog), {"kind":"session", "ref":key, "data":json.dumps({"key":key})})
+        with self.lock: self.cache.pop(key, None)
+
+    def on_feed(self, entries):
+        with self.lock:
+            for _, kind, data in entries:
+                if kind == "session": self.cache.pop(json.loads(data)["key"], None)
+
+    def listen(self):
+        # Se engancha al feed en la primera petición del proceso (ya hay app context)
+        if self._listening: return
+        from . import feed
+        with self.lock:
+            if self._listening: return
+            feed.hub().listeners.append(self.on_feed)
+            self._listening = True
+
+store = SessionStore()
+
+def evict():
+    n = db.session.execute(delete(WebSession).where(WebSession.expires_at < datetime.utcnow())).rowcount
+    db.session.commit()
+    return n
+
+
+class DbSessionInterface(SessionInterface):
+    def __init__(self, lifetime=timedelta(days=30)):
+        self.lifetime = lifetime
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt="sid")
+
+    def open_session(self, app, request):
+        store.listen()
+        raw = request.cookies.get(self.get_cookie_name(app))
+        if raw:
+            try:
+                sid = self._signer(app).unsign(raw).decode()     # cookies inventadas: sin ir a la DB
+            except BadSignature:
+                sid = None
+            data = store.get(sid) if sid else None
+            if data is not None:
+                return ServerSession(data, sid)
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        name, domain, path = self.get_cookie_name(app), self.get_cookie_domain(app), self.get_cookie_path(app)
+        if not session.modified: return
+        if not session:
+            if session.sid:
+                store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        sid = store.put(session.sid, dict(session), self.lifetime)
+        response.set_cookie(name, self._signer(app).sign(sid).decode(),
+                            expires=self.get_expiration_time(app, session), httponly=self.get_cookie_httponly(app),
+                            domain=domain, path=path, secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
+        response.vary.add("Cookie")
@@ -0,0 +1,140 @@
+import random
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import bindparam, func, literal, or_, select, union_all, update
+from . import archive, db
+from .dbutil import insert_for, job_lock
+from .models import Client, Driver, Order, OrderArchive, StatCounter
+
+# Estadísticas del panel mantenidas en las mismas transacciones que las escrituras.
+# Cada incremento cae en un shard al azar (filas distintas = sin espera por el mismo lock);
+# leer es sumar un puñado de filas, sin importar cuántos pedidos haya.
+#   orders:<status>                 pedidos por estado
+#   day:<YYYY-MM-DD>:<métrica>      orders, revenue, delivered, eta_sum, eta_n (día local)
+#   drivers:busy                    repartidores con active_orders > 0
+#   drivers:total                   +1 en cada alta (locbuf.upsert, _take_driver en api.py)
+#   drivers:offline                 lo fija reconcile()
+
+SHARDS = 8
+KEEP_DAYS = 35
+LOCK_RECONCILE = 7_302_031           # dbutil.job_lock: un reconcile a la vez entre workers
+LOCK_CLIENTS = 7_302_032
+
+def local_day(dt=None):
+    dt = dt or datetime.utcnow()
+    return (dt + timedelta(hours=current_app.config["UTC_OFFSET_H"])).date().isoformat()
+
+def bump(deltas, shard=None):
+    # deltas: {key: incremento}. Sin commit. Un solo shard por sesión y claves ordenadas:
+    # dos transacciones nunca toman los mismos locks en distinto orden.
+    if shard is None:
+        shard = db.session.info.setdefault("stats_shard", random.randrange(SHARDS))
+    rows = [{"key":k, "shard":shard, "value":v} for k, v in sorted(deltas.items()) if v]
+    if not rows: return
+    t = StatCounter.__table__
+    stmt = insert_for(t)
+    stmt = stmt.on_conflict_do_update(index_elements=[t.c.key, t.c.shard],
+                                      set_={"value": t.c.value + stmt.excluded.value})
+    db.session.execute(stmt, rows)
+
+def on_created(rows):
+    today = local_day()
+    bump({"orders:new": len(rows), f"day:{today}:orders": len(rows),
+          f"day:{today}:revenue": sum(r["total"] or 0 for r in rows)})
+
+def on_assigned(order, drv):
+    today = local_day()
+    d = {"orders:new": -1, "orders:assigned": 1, "drivers:busy": 1 if drv.active_orders == 1 else 0}
+    if order.eta_min is not None:
+        d.update({f"day:{today}:eta_sum": order.eta_min, f"day:{today}:eta_n": 1})
+    bump(d)
+
+def on_status(old, new, drv_freed=False):
+    d = {f"orders:{old}": -1, f"orders:{new}": 1, "drivers:busy": -1 if drv_freed else 0}
+    if new == "delivered": d[f"day:{local_day()}:delivered"] = 1
+    bump(d)
+
+def read():
+    today = local_day()
+    rows = (db.session.query(StatCounter.key, func.sum(StatCounter.value))
+            .filter(_counter_keys(today)).group_by(StatCounter.key).all())
+    v = {k: s or 0 for k, s in rows}
+    day = lambda m: v.get(f"day:{today}:{m}", 0)
+    busy, total, offline = (int(v.get(f"drivers:{k}", 0)) for k in ("busy", "total", "offline"))
+    return {
+        "orders": {k.split(":", 1)[1]: int(n) for k, n in v.items() if k.startswith("orders:") and n},
+        "today": {"day": today, "orders": int(day("orders")), "revenue": round(day("revenue"), 2),
+                  "delivered": int(day("delivered")),
+                  "avg_eta_min": round(day("eta_sum") / day("eta_n"), 1) if day("eta_n") else None},
+        "drivers": {"busy": busy, "offline": offline, "total": total,
+                    "available": max(total - busy - offline, 0)},
+    }
+
+
+def _day_start(day):
+    # Medianoche local de `day` en UTC
+    return datetime.fromisoformat(day) - timedelta(hours=current_app.config["UTC_OFFSET_H"])
+
+def _counter_keys(today):
+    return or_(StatCounter.key.like("orders:%"), StatCounter.key.like("drivers:%"),
+               StatCounter.key.like(f"day:{today}:%"))
+
+def reconcile():
+    # Recalcula desde las tablas y corrige con un delta, que no pisa incrementos concurrentes.
+    # Valores reales y contadores actuales salen de UNA consulta: misma foto de la DB.
+    # None si otro worker está reconciliando.
+    if not job_lock(LOCK_RECONCILE):
+        db.session.rollback(); return None
+    today = local_day(); start = _day_start(today)
+    recent = Order.created_at >= start - timedelta(days=1)      # usa ix_orders_created_id
+    day = lambda m: literal(f"day:{today}:{m}")
+    snap = db.session.execute(union_all(
+        select(literal("orders:") + Order.status, func.count()).group_by(Order.status),
+        select(literal("orders:delivered"), func.coalesce(func.sum(OrderArchive.delivered), 0)),   # archivados
+        select(literal("orders:canceled"), func.coalesce(func.sum(OrderArchive.canceled), 0)),
+        select(literal("drivers:total"), func.count()).select_from(Driver),
+        select(literal("drivers:busy"), func.count()).where(Driver.active_orders > 0),
+        select(literal("drivers:offline"), func.count()).where(Driver.status == "offline"),
+        select(day("orders"), func.count()).where(recent, Order.created_at >= start),
+        select(day("revenue"), func.coalesce(func.sum(Order.total), 0)).where(recent, Order.created_at >= start),
+        select(day("delivered"), func.count()).where(recent, Order.delivered_at >= start, Order.status == "delivered"),
+        select(day("eta_sum"), func.coalesce(func.sum(Order.eta_min), 0)).where(recent, Order.assigned_at >= start),
+        select(day("eta_n"), func.count(Order.eta_min)).where(recent, Order.assigned_at >= start),
+        select(literal("cur:") + StatCounter.key, func.sum(StatCounter.value))
+            .where(_counter_keys(today)).group_by(StatCounter.key),
+    )).all()
+    true = {}
+    for k, v in snap:
+        if not k.startswith("cur:"): true[k] = true.get(k, 0) + (v or 0)
+    cur = {k[4:]: v or 0 for k, v in snap if k.startswith("cur:")}
+    fix = {k: true.get(k, 0) - cur.get(k, 0) for k in true.keys() | cur.keys()}
+    fix = {k: d for k, d in fix.items() if abs(d) > 1e-6}
+    bump(fix, shard=0)
+    keep = (datetime.fromisoformat(today) - timedelta(days=KEEP_DAYS)).date().isoformat()
+    StatCounter.query.filter(StatCounter.key.like("day:%"), StatCounter.key < f"day:{keep}").delete(synchronize_session=False)
+    db.session.commit()
+    return fix
+
+def reconcile_clients():
+    # order_count / lifetime_value de clients contra los pedidos, calientes y archivados
+    # (solo los descuadrados). None si otro worker está reconciliando.
+    if not job_lock(LOCK_CLIENTS):
+        db.session.rollback(); return None
+    hist = union_all(*(select(t.c.client_id, t.c.total) for t, _ in archive.parts())).subquery()
+    agg = (db.session.query(hist.c.client_id.label("cid"), func.count().label("n"),
+                            func.coalesce(func.sum(hist.c.total), 0).label("v"))
+           .group_by(hist.c.client_id).subquery())
+    n, v = func.coalesce(agg.c.n, 0), func.coalesce(agg.c.v, 0)
+    rows = (db.session.query(Client.id, n - func.coalesce(Client.order_count, 0),
+                             v - func.coalesce(Client.lifetime_value, 0))
+            .outerjoin(agg, agg.c.cid == Client.id)
+            .filter(or_(func.coalesce(Client.order_count, 0) != n,
+                        func.abs(func.coalesce(Client.lifetime_value, 0) - v) > 0.005)).all())
+    if rows:
+        c = Client.__table__.c
+        db.session.execute(update(Client.__table__).where(c.id == bindparam("cid")).values(
+            order_count=func.coalesce(c.order_count, 0) + bindparam("dn"),
+            lifetime_value=func.coalesce(c.lifetime_value, 0) + bindparam("dv")),
+            [{"cid":cid, "dn":dn, "dv":dv} for cid, dn, dv in rows])
+    db.session.commit()
+    return len(rows)
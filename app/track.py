@@ -0,0 +1,115 @@
+import heapq, struct, threading, time, zlib
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import insert
+from . import db
+from .models import DriverTrackChunk
+
+# Historial de ubicaciones de solo-agregar. Los pings se juntan en memoria por repartidor y
+# día y se sellan en bloques: cabecera absoluta + arrays int32 de deltas (tiempo en ms,
+# lat/lon en 1e-6 grados) comprimidos con zlib. Unos pocos bytes por ping en disco.
+
+HEADER = struct.Struct("<qiiI")      # t0_ms, lat0_e6, lon0_e6, n
+EPOCH = datetime(1970, 1, 1)
+
+def _ms(dt):
+    return (dt - EPOCH) // timedelta(milliseconds=1)
+
+def encode(pts):
+    # pts: [(t_ms, lat_e6, lon_e6)] ordenados por tiempo
+    a = np.asarray(pts, dtype=np.int64)
+    d = np.diff(a, axis=0).astype("<i4")
+    body = d[:, 0].tobytes() + d[:, 1].tobytes() + d[:, 2].tobytes()
+    return zlib.compress(HEADER.pack(int(a[0, 0]), int(a[0, 1]), int(a[0, 2]), len(a)) + body, 6)
+
+def decode(blob):
+    raw = zlib.decompress(blob)
+    t0, la0, lo0, n = HEADER.unpack_from(raw)
+    d = np.frombuffer(raw, dtype="<i4", offset=HEADER.size).reshape(3, n - 1).astype(np.int64)
+    t = np.concatenate(([t0], t0 + np.cumsum(d[0])))
+    la = np.concatenate(([la0], la0 + np.cumsum(d[1])))
+    lo = np.concatenate(([lo0], lo0 + np.cumsum(d[2])))
+    return t, la, lo
+
+
+class TrackStore:
+    def __init__(self, chunk_pings=256, chunk_s=300, max_sealed=20_000):
+        self.chunk_pings = chunk_pings
+        self.chunk_s = chunk_s
+        self.max_sealed = max_sealed
+        self.open = {}                   # (phone, day) -> [opened_at, [(t, la, lo)]]
+        self.sealed = []                 # filas listas para insertar
+        self.lock = threading.Lock()
+
+    def record(self, phone, lat, lon, ts):
+        if lat is None or lon is None: return
+        key = (phone, ts.date())
+        with self.lock:
+            ch = self.open.get(key)
+            if ch is None:
+                ch = self.open[key] = [time.monotonic(), []]
+            ch[1].append((_ms(ts), int(round(lat * 1e6)), int(round(lon * 1e6))))
+            if len(ch[1]) >= self.chunk_pings:
+                self._seal(key)
+
+    def _seal(self, key):
+        _, pts = self.open.pop(key)
+        self.sealed.append({"phone":key[0], "day":key[1], "n":len(pts), "data":encode(pts),
+                            "t0":EPOCH + timedelta(milliseconds=pts[0][0]),
+                            "t1":EPOCH + timedelta(milliseconds=pts[-1][0])})
+        if len(self.sealed) > self.max_sealed:      # DB caída por mucho rato: acota memoria
+            del self.sealed[:len(self.sealed) - self.max_sealed]
+
+    def flush(self):
+        # Sella bloques viejos (repartidores quietos, cambio de día) e inserta en lote
+        now, today = time.monotonic(), datetime.utcnow().date()
+        with self.lock:
+            for key in [k for k, ch in self.open.items() if now - ch[0] >= self.chunk_s or k[1] < today]:
+                self._seal(key)
+            batch, self.sealed = self.sealed, []
+        if not batch: return 0
+        try:
+            db.session.execute(insert(DriverTrackChunk), batch)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            with self.lock: self.sealed[:0] = batch
+            raise
+        return len(batch)
+
+    def pending(self, phone, t_from, t_to):
+        # Puntos de este proceso aún no guardados, como bloques (t, lat, lon)
+        with self.lock:
+            out = [(np.array([p[0] for p in ch[1]]), np.array([p[1] for p in ch[1]]), np.array([p[2] for p in ch[1]]))
+                   for (ph, _), ch in self.open.items() if ph == phone and ch[1]]
+            out += [decode(r["data"]) for r in self.sealed
+                    if r["phone"] == phone and r["t1"] >= t_from and r["t0"] <= t_to]
+        return out
+
+store = TrackStore()
+
+def prune(days):
+    keep = datetime.utcnow().date() - timedelta(days=days)
+    DriverTrackChunk.query.filter(DriverTrackChunk.day < keep).delete(synchronize_session=False)
+    db.session.commit()
+
+def points(phone, t_from, t_to):
+    # Genera (t_ms, lat, lon) en orden. Los bloques de distintos workers pueden solaparse:
+    # se mezclan con un heap, emitiendo lo anterior al t0 del siguiente bloque.
+    lo_ms, hi_ms = _ms(t_from), _ms(t_to)
+    rows = (db.session.query(DriverTrackChunk.t0, DriverTrackChunk.data)
+            .filter(DriverTrackChunk.phone == phone, DriverTrackChunk.day >= t_from.date(),
+                    DriverTrackChunk.day <= t_to.date(), DriverTrackChunk.t1 >= t_from,
+                    DriverTrackChunk.t0 <= t_to)
+            .order_by(DriverTrackChunk.t0).yield_per(64))
+    mem = sorted(((int(c[0][0]), c) for c in store.pending(phone, t_from, t_to)), key=lambda c: c[0])
+    heap = []
+    for t0, c in heapq.merge(((_ms(t0), data) for t0, data in rows), mem, key=lambda c: c[0]):
+        t, la, lo = c if isinstance(c, tuple) else decode(c)
+        while heap and heap[0][0] < t0:
+            yield heapq.heappop(heap)
+        m = (t >= lo_ms) & (t <= hi_ms)
+        for p in zip(t[m].tolist(), (la[m] / 1e6).tolist(), (lo[m] / 1e6).tolist()):
+            heapq.heappush(heap, p)
+    while heap:
+        yield heapq.heappop(heap)
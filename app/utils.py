@@ -1,5 +1,6 @@
 import math, hashlib
 
+# Menú inicial: la migración 7 lo copia a menu_items; desde ahí manda el catálogo
 MENU = {
     "Chaufa": 18.0,
     "Tallarín saltado": 20.0,
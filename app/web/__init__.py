@@ -1,15 +1,14 @@
 from flask import Blueprint, redirect, url_for, session
-from .cliente import cliente_bp, CLIENTE_HTML
-from .repartidor import repartidor_bp, REPARTIDOR_HTML
-from .restaurante import restaurante_bp, RESTAURANTE_HTML
+from .cliente import cliente_bp
+from .repartidor import repartidor_bp
+from .restaurante import restaurante_bp
 from ..base import render_page
-from ..utils import MENU
 
 # Cliente
 @cliente_bp.route("/cliente")
 def cliente():
     from flask import session
-    return render_page(CLIENTE_HTML, title="Cliente", tab="c", session=session, phone=session.get("phone",""), menu=MENU)
+    return render_page("cliente.html", title="Cliente", tab="c", session=session, phone=session.get("phone",""))
 
 @cliente_bp.route("/logout")
 def logout():
@@ -19,9 +18,9 @@ def logout():
 # Repartidor
 @repartidor_bp.route("/repartidor")
 def repartidor():
-    return render_page(REPARTIDOR_HTML, title="Repartidor", tab="r")
+    return render_page("repartidor.html", title="Repartidor", tab="r")
 
 # Restaurante
 @restaurante_bp.route("/restaurante")
 def restaurante():
-    return render_page(RESTAURANTE_HTML, title="Restaurante", tab="a")
+    return render_page("restaurante.html", title="Restaurante", tab="a")
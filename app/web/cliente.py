@@ -1,6 +1,5 @@
 from flask import Blueprint, session
-from base import render_page
-from ..utils import MENU
+from ..base import register_page
 
 cliente_bp = Blueprint("cliente", __name__)
 
@@ -44,7 +43,7 @@ CLIENTE_HTML = """<div class="card">
 
 <script>
 window.addEventListener('DOMContentLoaded', function(){
-  const MENU = {{ menu | tojson }};
+  let MENU = new Map();   // id -> ítem, de /api/menu (el navegador revalida con ETag)
   let map, marker, cur = {lat:null, lon:null}, selId=null;
 
   function fmt(n){return (Math.round(n*100)/100).toFixed(2)}
@@ -70,23 +69,25 @@ window.addEventListener('DOMContentLoaded', function(){
   }
   ensureMap();
 
-  function menuUI(){
+  async function menuUI(){
+    const r = await fetch('/api/menu'); const j = await r.json();
+    MENU = new Map((j.items||[]).filter(it=> it.available).map(it=> [it.id, it]));
     const c=$id('menu'); c.innerHTML='';
-    for(const [name, price] of Object.entries(MENU)){
+    for(const it of MENU.values()){
       const row=document.createElement('div'); row.className='item';
-      row.innerHTML = `<div>${name} <span class="badge">S/ ${price}</span></div>
-        <input type="number" min="0" value="0" style="width:80px" data-name="${name}" />`;
+      row.innerHTML = `<div>${it.name} <span class="badge">S/ ${it.price}</span></div>
+        <input type="number" min="0" value="0" style="width:80px" data-id="${it.id}" />`;
       c.appendChild(row);
     }
-    c.addEventListener('input', ()=>{
-      let s=0;
-      document.querySelectorAll('#menu input[type=number]').forEach(inp=>{
-        const qty=parseInt(inp.value||'0',10), price=MENU[inp.dataset.name]||0;
-        s += qty * price;
-      });
-      $id('total').innerText = fmt(s);
-    });
   }
+  $id('menu').addEventListener('input', ()=>{
+    let s=0;
+    document.querySelectorAll('#menu input[type=number]').forEach(inp=>{
+      const qty=parseInt(inp.value||'0',10), it=MENU.get(+inp.dataset.id);
+      s += qty * (it ? it.price : 0);
+    });
+    $id('total').innerText = fmt(s);
+  });
   menuUI();
 
   async function api(path, method='GET', body=null){
@@ -153,7 +154,7 @@ window.addEventListener('DOMContentLoaded', function(){
     const address=$id('address').value.trim();
     if(!address || cur.lat==null || cur.lon==null) return alert('Completa dirección y fija coordenadas');
     const items=[]; document.querySelectorAll('#menu input[type=number]').forEach(inp=>{
-      const qty=parseInt(inp.value||'0',10); if(qty>0) items.push({ name: inp.dataset.name, qty, price: MENU[inp.dataset.name]||0 });
+      const qty=parseInt(inp.value||'0',10); if(qty>0) items.push({ id: +inp.dataset.id, qty });
     });
     if(!items.length) return alert('Agrega al menos 1 ítem');
     const r = await api('/api/orders','POST',{ address, lat:cur.lat, lon:cur.lon, items });
@@ -163,3 +164,6 @@ window.addEventListener('DOMContentLoaded', function(){
   }
 });
 </script>
+"""
+
+register_page("cliente.html", CLIENTE_HTML)
@@ -1,5 +1,5 @@
 from flask import Blueprint
-from ..base import render_page
+from ..base import register_page
 
 repartidor_bp = Blueprint("repartidor", __name__)
 
@@ -41,6 +41,7 @@ window.addEventListener('DOMContentLoaded', function(){
       dmarker=L.marker([la,lo]).addTo(dmap);
       dmap.setView([la,lo], 16);
       dcur.lat=la; dcur.lon=lo; document.getElementById('dcoords').innerText=`Coords: ${la}, ${lo}`;
+      loadOrders();
     }, e=>alert('Ubicación: '+e.message), {enableHighAccuracy:true});
   }
 
@@ -59,28 +60,65 @@ window.addEventListener('DOMContentLoaded', function(){
     alert('Ubicación guardada');
   }
 
-  async function loadOrders(){
-    const j = await api('/api/orders','GET');
+  const orders = new Map(); let feed = null;
+
+  const RADIUS_KM = 10;
+  function km(a, b){
+    const r=Math.PI/180, dp=(b.lat-a.lat)*r, dl=(b.lon-a.lon)*r;
+    const h=Math.sin(dp/2)**2 + Math.cos(a.lat*r)*Math.cos(b.lat*r)*Math.sin(dl/2)**2;
+    return 2*6371*Math.asin(Math.min(1, Math.sqrt(h)));
+  }
+  // Con ubicación: los más cercanos primero; sin ella, los más recientes
+  function renderOrders(){
     const box = document.getElementById('olist'); box.innerHTML='';
-    (j.orders||[]).forEach(o=>{
+    const list = [...orders.values()];
+    if(dcur.lat!=null){
+      list.forEach(o=> o.dist_km = km(dcur, o));
+      list.sort((a,b)=> a.dist_km - b.dist_km);
+    } else list.sort((a,b)=> b.created_at.localeCompare(a.created_at));
+    list.forEach(o=>{
+      if(dcur.lat!=null && o.dist_km > RADIUS_KM) return;
       const li=document.createElement('div'); li.className='item';
       li.innerHTML = `
         <div>
           <div><b>${o.address}</b></div>
-          <div class="badge">S/ ${o.total} · ${new Date(o.created_at).toLocaleString()}</div>
+          <div class="badge">S/ ${o.total} · ${new Date(o.created_at).toLocaleString()}${o.dist_km!=null ? ' · '+o.dist_km.toFixed(1)+' km' : ''}</div>
         </div>
         <button onclick="takeOrder(${o.id})">Tomar</button>`;
       box.appendChild(li);
     });
   }
+
+  // Carga inicial + deltas por /api/feed (sin polling)
+  async function loadOrders(){
+    const near = dcur.lat!=null ? `?near=${dcur.lat},${dcur.lon}&radius_km=${RADIUS_KM}` : '';
+    const j = await api('/api/orders'+near,'GET');
+    orders.clear(); (j.orders||[]).forEach(o=> orders.set(o.id, o));
+    renderOrders(); listen(j.feed);
+  }
+  function listen(cursor){
+    if(feed) feed.close();
+    feed = new EventSource('/api/feed?cursor='+cursor);
+    feed.addEventListener('order', e=>{
+      const o = JSON.parse(e.data);
+      if(o.status==='new') orders.set(o.id, o); else orders.delete(o.id);
+      renderOrders();
+    });
+    feed.addEventListener('reset', ()=> loadOrders());
+    feed.onerror = ()=>{ if(feed.readyState===EventSource.CLOSED) setTimeout(loadOrders, 5000); };
+  }
+
   window.takeOrder = async function(id){
     const phone = document.getElementById('dphone').value.trim();
     if(!phone) return alert('Ingresa tu teléfono');
     const j = await api('/api/orders/'+id+'/assign','POST',{ driver_phone: phone });
     alert(j.ok ? ('Pedido tomado · ETA ~'+(j.eta_min ?? '?')+' min') : (j.error || 'Error'));
-    loadOrders();
+    orders.delete(id); renderOrders();
   }
 
-  loadOrders(); setInterval(loadOrders, 5000);
+  loadOrders();
 });
 </script>
+"""
+
+register_page("repartidor.html", REPARTIDOR_HTML)
@@ -1,18 +1,20 @@
 from flask import Blueprint
-from ..base import render_page
+from ..base import register_page
 
 restaurante_bp = Blueprint("restaurante", __name__)
 
 RESTAURANTE_HTML = """<div class="card">
   <h1>🏪 Restaurante – Panel</h1>
   <p class="badge">Vista administrativa: pedidos y repartidores.</p>
+  <p id="stats" class="badge"></p>
 </div>
 
 <div class="card">
   <h2>Pedidos</h2>
   <table id="orders"><thead>
-    <tr><th>ID</th><th>Estado</th><th>Dirección</th><th>Total</th><th>Driver</th><th>ETA</th><th>Creado</th><th>Acciones</th></tr>
+    <tr><th>ID</th><th>Estado</th><th>Dirección</th><th>Pedido</th><th>Total</th><th>Driver</th><th>ETA</th><th>Creado</th><th>Acciones</th></tr>
   </thead><tbody></tbody></table>
+  <div style="margin-top:10px"><button class="secondary" id="older" onclick="loadOlder()">Ver anteriores</button></div>
 </div>
 
 <div class="card">
@@ -31,30 +33,97 @@ window.addEventListener('DOMContentLoaded', function(){
     if(!r.ok){ console.error(j); return { ok:false, error:j.error||'Error' }; }
     return j;
   }
-  async function loadAdmin(){
-    const o = await api('/api/orders/all'); const d = await api('/api/drivers');
+  const orders = new Map(), drivers = new Map(); let feed = null, older = null;
+  const ACTIVE = 'new,assigned,delivering';
+
+  function addRows(j){
+    (j.rows||[]).forEach(r=>{ const x={}; j.cols.forEach((c,i)=> x[c]=r[i]); orders.set(x.id, x); });
+  }
+  const itemsText = x => x.items ? x.items.map(it=> `${it.qty}× ${it.name}`).join(', ') : '…';
+  // Pedido que llega por el feed sin ítems: se piden una vez (GET /api/orders/<id>)
+  async function fetchItems(id){
+    const j = await api('/api/orders/'+id); const x = orders.get(id);
+    if(j.ok && x){ x.items = j.order.items; renderOrders(); }
+  }
+
+  // Botones según el estado (transiciones permitidas, ver app/events.py)
+  const actions = x => [
+    x.status==='assigned' && `<button onclick="move(${x.id},'pickup')">Recogido</button>`,
+    ['assigned','delivering'].includes(x.status) && `<button onclick="move(${x.id},'deliver')">Entregado</button>`,
+    ['new','assigned','delivering'].includes(x.status) && `<button onclick="move(${x.id},'cancel')">Cancelar</button>`,
+  ].filter(Boolean).join(' ') || '—';
+
+  function renderOrders(){
     const ot = document.querySelector('#orders tbody'); ot.innerHTML='';
-    (o.orders||[]).forEach(x=>{
+    [...orders.values()].sort((a,b)=> b.created_at.localeCompare(a.created_at)).forEach(x=>{
       const tr=document.createElement('tr');
       tr.innerHTML = `
-        <td>${x.id}</td><td>${x.status}</td><td>${x.address}</td>
+        <td>${x.id}</td><td>${x.status}</td><td>${x.address}</td><td>${itemsText(x)}</td>
         <td>S/ ${x.total}</td><td>${x.assigned_driver||'—'}</td>
         <td>${x.eta_min ?? '—'}</td><td>${new Date(x.created_at).toLocaleString()}</td>
-        <td>${x.status!=='delivered' ? `<button onclick="deliver(${x.id})">Entregado</button>` : '—'}</td>`;
+        <td>${actions(x)}</td>`;
       ot.appendChild(tr);
     });
+  }
+  function renderDrivers(){
     const dt = document.querySelector('#drivers tbody'); dt.innerHTML='';
-    (d.list||[]).forEach(r=>{
+    [...drivers.values()].sort((a,b)=> b.updated_at.localeCompare(a.updated_at)).forEach(r=>{
       const tr=document.createElement('tr');
       tr.innerHTML = `<td>${r.phone}</td><td>${r.lat ?? '—'}</td><td>${r.lon ?? '—'}</td>
                       <td>${r.status}</td><td>${r.active_orders}</td><td>${new Date(r.updated_at).toLocaleString()}</td>`;
       dt.appendChild(tr);
     });
   }
-  window.deliver = async function(id){
-    const r = await api('/api/orders/'+id+'/deliver','POST');
-    if(r.ok) loadAdmin(); else alert(r.error||'Error');
+
+  // Carga inicial (solo pedidos activos) + deltas por /api/feed (sin polling)
+  async function loadAdmin(){
+    orders.clear(); older = null;
+    let o = await api('/api/orders/all?limit=500&include=items&status='+ACTIVE); const seq = o.feed;
+    addRows(o);
+    while(o.next){ o = await api('/api/orders/all?limit=500&include=items&status='+ACTIVE+'&cursor='+o.next); addRows(o); }
+    const d = await api('/api/drivers');
+    drivers.clear(); (d.list||[]).forEach(r=> drivers.set(r.phone, r));
+    renderOrders(); renderDrivers();
+    document.getElementById('older').style.display='';
+    listen(Math.min(seq ?? 0, d.feed ?? 0));
   }
-  loadAdmin(); setInterval(loadAdmin, 5000);
+  // Historial bajo demanda, página por página
+  window.loadOlder = async function(){
+    const o = await api('/api/orders/all?limit=50&include=items'+(older ? '&cursor='+older : ''));
+    addRows(o); renderOrders(); older = o.next;
+    if(!o.next) document.getElementById('older').style.display='none';
+  }
+  function listen(cursor){
+    if(feed) feed.close();
+    feed = new EventSource('/api/feed?cursor='+cursor);
+    feed.addEventListener('order', e=>{
+      const x=JSON.parse(e.data), old=orders.get(x.id);
+      orders.set(x.id, Object.assign(old||{}, x)); renderOrders();
+      if(!old || !old.items) fetchItems(x.id);
+    });
+    feed.addEventListener('driver', e=>{ const r=JSON.parse(e.data); drivers.set(r.phone, r); renderDrivers(); });
+    feed.addEventListener('reset', ()=> loadAdmin());
+    feed.onerror = ()=>{ if(feed.readyState===EventSource.CLOSED) setTimeout(loadAdmin, 5000); };
+  }
+
+  // Resumen: lectura O(1) de contadores, barata aunque se refresque seguido
+  async function loadStats(){
+    const s = await api('/api/stats'); if(!s.ok) return;
+    const o = s.orders;
+    document.getElementById('stats').textContent =
+      `Hoy: ${s.today.orders} pedidos · S/ ${s.today.revenue.toFixed(2)} · ${s.today.delivered} entregados · ` +
+      `ETA prom. ${s.today.avg_eta_min ?? '—'} min | Nuevos ${o.new||0} · Asignados ${o.assigned||0} | ` +
+      `Repartidores: ${s.drivers.busy} ocupados, ${s.drivers.available} disponibles`;
+  }
+
+  window.move = async function(id, action){
+    if(action==='cancel' && !confirm('¿Cancelar el pedido '+id+'?')) return;
+    const r = await api('/api/orders/'+id+'/'+action,'POST');
+    if(!r.ok) alert(r.error||'Error');
+  }
+  loadAdmin(); loadStats(); setInterval(loadStats, 5000);
 });
 </script>
+"""
+
+register_page("restaurante.html", RESTAURANTE_HTML)
@@ -0,0 +1,94 @@
+import queue, threading
+from concurrent.futures import Future
+from . import db
+from .metrics import metrics
+
+# Escrituras de los endpoints calientes (alta de pedido, asignación, pings directos) con
+# SQLite: un solo hilo escritor por worker las ejecuta en lote dentro de una transacción
+# BEGIN IMMEDIATE (group commit: un fsync para todo lo que llegó mientras tanto), cada una
+# en su SAVEPOINT para que un error no tumbe a las demás. Entre workers el lock de SQLite
+# se espera con busy_timeout en vez de fallar con "database is locked".
+# Sin cola (Postgres o SQLITE_WRITE_QUEUE=0) la función corre en la sesión de la petición.
+
+
+class WriteQueue:
+    def __init__(self):
+        self.app = None
+        self.enabled = False
+        self.batch = 64
+        self.jobs = queue.Queue()
+        self.lock = threading.Lock()
+        self._started = False
+        # (threading.local, atributo) del hilo que llama que el escritor adopta mientras corre
+        # su fn: así las consultas se cuentan a la petición (metrics, bench.harness)
+        self.carry = [(metrics.local, "req")]
+
+    def run(self, fn):
+        # fn() escribe con db.session sin hacer commit y devuelve datos planos (no objetos
+        # ORM: con cola corre en otro hilo y otra sesión). Devuelve lo de fn ya confirmado.
+        if not self.enabled:
+            try:
+                out = fn()
+                db.session.commit()
+                return out
+            except Exception:
+                db.session.rollback()
+                raise
+        self._ensure()
+        fut = Future()
+        fut.ctx = [(loc, name, getattr(loc, name, None)) for loc, name in self.carry]
+        self.jobs.put((fn, fut))
+        return fut.result()
+
+    def _ensure(self):
+        if self._started: return
+        with self.lock:
+            if self._started: return
+            threading.Thread(target=self._loop, name="db-writer", daemon=True).start()
+            self._started = True
+
+    def _loop(self):
+        while True:
+            batch = [self.jobs.get()]
+            while len(batch) < self.batch:
+                try: batch.append(self.jobs.get_nowait())
+                except queue.Empty: break
+            with self.app.app_context():
+                self._commit(batch)
+
+    def _commit(self, batch):
+        done = []
+        try:
+            db.session.connection().exec_driver_sql("BEGIN IMMEDIATE")
+            for fn, fut in batch:
+                sp = db.session.begin_nested()
+                for loc, name, v in fut.ctx: setattr(loc, name, v)
+                try:
+                    out = fn()
+                    sp.commit()
+                    done.append((fut, out, None))
+                except Exception as e:
+                    sp.rollback()
+                    done.append((fut, None, e))
+                finally:
+                    for loc, name, _ in fut.ctx: setattr(loc, name, None)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            self.app.logger.warning(f"writer: lote de {len(batch)} falló: {e}")
+            done = [(fut, None, e) for _, fut in batch]
+        finally:
+            db.session.remove()
+        for fut, out, err in done:
+            if err is None: fut.set_result(out)
+            else: fut.set_exception(err)
+
+writes = WriteQueue()
+
+def init(app):
+    writes.app = app
+    writes.enabled = app.config["SQLITE_WRITE_QUEUE"] and app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite")
+    writes.batch = app.config["SQLITE_WRITE_BATCH"]
+
+def run(fn):
+    return writes.run(fn)
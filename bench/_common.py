@@ -0,0 +1,74 @@
+import random, time
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, insert, text
+from app import db, models
+from app.utils import MENU
+
+# Utilidades compartidas por los benchmarks (python -m bench.<script> desde la raíz).
+# Usar SOLO con una DB de pruebas: los scripts crean, siembran y tocan índices.
+
+LIMA = (-12.0464, -77.0428)
+
+def engine_for(url):
+    return create_engine(url)
+
+def pct(samples, p):
+    s = sorted(samples)
+    return s[min(len(s) - 1, int(round(p / 100.0 * (len(s) - 1))))] if s else 0.0
+
+def summary(samples_ms):
+    return {"n": len(samples_ms), "p50": pct(samples_ms, 50), "p95": pct(samples_ms, 95),
+            "p99": pct(samples_ms, 99), "mean": sum(samples_ms) / max(len(samples_ms), 1)}
+
+def timed(fn, n=50):
+    out = []
+    for _ in range(n):
+        t = time.perf_counter(); fn(); out.append((time.perf_counter() - t) * 1000)
+    return summary(out)
+
+def jitter(center, km):
+    d = km / 111.0
+    return center[0] + random.uniform(-d, d), center[1] + random.uniform(-d, d)
+
+def seed(engine, orders=100_000, clients=20_000, drivers=2_000, chunk=50_000, log=print):
+    # Volúmenes "realistas": casi todo el historial entregado, una cola chica de nuevos
+    random.seed(7)
+    db.metadata.create_all(engine, checkfirst=True)
+    with engine.begin() as c:
+        if c.execute(text("SELECT COUNT(*) FROM orders")).scalar():
+            log("DB ya sembrada; se reutiliza"); return
+    now = datetime.utcnow(); names = list(MENU)
+    T = lambda m: m.__table__
+    with engine.begin() as c:
+        c.execute(insert(T(models.Client)), [
+            {"id": i, "phone": f"+519{i:08d}", "order_count": 0, "lifetime_value": 0.0,
+             "created_at": now - timedelta(days=400)} for i in range(1, clients + 1)])
+        rows = []
+        for i in range(1, clients + 1):
+            lat, lon = jitter(LIMA, 12)
+            rows.append({"client_id": i, "label": "Casa", "address": f"Calle {i}", "lat": lat, "lon": lon,
+                         "is_default": True, "created_at": now - timedelta(days=random.randint(0, 400))})
+        c.execute(insert(T(models.Address)), rows)
+        c.execute(insert(T(models.AuthPin)), [{"client_id": i, "pin_hash": "0" * 64} for i in range(1, clients + 1)])
+        c.execute(insert(T(models.Driver)), [
+            dict(zip(("lat", "lon"), jitter(LIMA, 12)), phone=f"+518{i:08d}",
+                 status=random.choice(("available", "busy", "offline")), active_orders=0,
+                 updated_at=now - timedelta(seconds=random.randint(0, 3600))) for i in range(1, drivers + 1)])
+    oid = 0
+    while oid < orders:
+        n = min(chunk, orders - oid); orows, irows = [], []
+        for _ in range(n):
+            oid += 1
+            r = random.random()
+            status = "new" if r < 0.005 else "assigned" if r < 0.01 else "canceled" if r < 0.03 else "delivered"
+            lat, lon = jitter(LIMA, 12); item = random.choice(names); qty = random.randint(1, 3)
+            orows.append({"id": oid, "client_id": random.randint(1, clients), "address": f"Calle {oid}",
+                          "lat": lat, "lon": lon, "total": MENU[item] * qty, "status": status,
+                          "assigned_driver": None if status in ("new", "canceled") else f"+518{random.randint(1, drivers):08d}",
+                          "eta_min": random.randint(5, 40),
+                          "created_at": now - timedelta(seconds=int((orders - oid) * 31_536_000 / orders))})
+            irows.append({"order_id": oid, "name": item, "qty": qty, "price": MENU[item]})
+        with engine.begin() as c:
+            c.execute(insert(T(models.Order)), orows)
+            c.execute(insert(T(models.OrderItem)), irows)
+        log(f"  {oid}/{orders} pedidos")
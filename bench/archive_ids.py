@@ -0,0 +1,77 @@
+import argparse, os, sys, tempfile
+from datetime import datetime, timedelta
+from sqlalchemy import text, update
+from ._common import LIMA
+
+# Regresión del archivo: al mover a orders_AAAAMM los pedidos con los ids más altos, SQLite
+# sin AUTOINCREMENT volvía a entregar esos ids y /api/events?order_id=, /orders/mine y el
+# detalle mezclaban dos pedidos. Archiva los N pedidos (todos, así el id más alto queda
+# solo en el archivo), crea más y verifica que ningún id se repite. Con --legacy rehace
+# orders/order_items sin AUTOINCREMENT (como una DB anterior a la migración 11) y migra
+# después de archivar: la secuencia debe quedar sobre lo archivado. Sale con código 1 si
+# algo falla. DB SQLite temporal.
+#   python -m bench.archive_ids --orders 20 [--legacy]
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--orders", type=int, default=20)
+    ap.add_argument("--legacy", action="store_true")
+    args = ap.parse_args()
+    tmp = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{tmp}/ids.db"
+    os.environ["RATE_LIMIT_PATH"] = f"{tmp}/ids.rl"
+    from app import archive, create_app, db, migrations
+    from app.models import Order
+    app = create_app(); c = app.test_client()
+    phone = "+51999333444"
+    c.post("/api/auth/pin", json={"phone": phone, "pin": "1234"})
+    c.post("/api/auth/verify", json={"phone": phone, "pin": "1234"})
+    body = {"address": "bench", "lat": LIMA[0], "lon": LIMA[1], "items": [{"id": 1, "qty": 1}]}
+
+    def create(n):
+        return [c.post("/api/orders", json=body).json["order"]["id"] for _ in range(n)]
+
+    with app.app_context():
+        if args.legacy:
+            conn = db.session.connection()
+            for t in ("orders", "order_items"):
+                ddl = conn.execute(text("SELECT sql FROM sqlite_master WHERE name = :n"), {"n": t}).scalar()
+                conn.exec_driver_sql(f"ALTER TABLE {t} RENAME TO {t}_old")
+                conn.exec_driver_sql(ddl.replace(" AUTOINCREMENT", ""))
+                conn.exec_driver_sql(f"INSERT INTO {t} SELECT * FROM {t}_old")
+                conn.exec_driver_sql(f"DROP TABLE {t}_old")
+            conn.exec_driver_sql("DELETE FROM sqlite_sequence WHERE name IN ('orders', 'order_items')")
+            conn.exec_driver_sql("DELETE FROM schema_version WHERE version = 11")
+            db.session.commit()
+
+    first = create(args.orders)
+    with app.app_context():
+        db.session.execute(update(Order).where(Order.id.in_(first)).values(
+            status="delivered", created_at=datetime.utcnow() - timedelta(days=400)))
+        db.session.commit()
+        moved = archive.run(after_days=90)
+        if args.legacy: print("migración con lo archivado:", migrations.upgrade(log=lambda m: None))
+        db.session.remove()
+    later = create(args.orders)
+
+    bad = []
+    print(f"archivados {moved} (ids {min(first)}..{max(first)}), nuevos {min(later)}..{max(later)}")
+    if moved != args.orders: bad.append("archivo")
+    if set(first) & set(later): bad.append("ids reutilizados")
+    mine, cursor = [], None
+    while True:
+        r = c.get("/api/orders/mine?limit=100" + (f"&cursor={cursor}" if cursor else "")).json
+        mine += [row[0] for row in r["rows"]]
+        cursor = r["next"]
+        if not cursor: break
+    if len(mine) != len(set(mine)) or len(mine) != 2 * args.orders: bad.append("/orders/mine")
+    for oid in (max(first), min(first)):
+        kinds = [row[2] for row in c.get(f"/api/events?order_id={oid}").json["rows"]]
+        if kinds.count("created") != 1: bad.append(f"/api/events?order_id={oid}")
+    print(f"/orders/mine: {len(mine)} pedidos, {len(set(mine))} ids distintos")
+    if bad:
+        print("Falla:", ", ".join(bad)); sys.exit(1)
+    print("OK")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import argparse, os, random, time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool
+from ._common import LIMA, jitter, summary
+
+# Prueba de estrés del claim de pedidos: varios repartidores compiten por cada pedido desde
+# varios procesos (como los workers de gunicorn) y se verifica que cada pedido quede
+# asignado exactamente una vez, que active_orders cuadre con lo asignado y que ningún
+# repartidor pase de --max-active (con un cupo chico quedan pedidos sin asignar: es lo esperado).
+#   python -m bench.claims --url sqlite:////tmp/claims.db --orders 300 --contenders 5
+#   python -m bench.claims --max-active 2
+#   python -m bench.claims --url postgresql://localhost/bench --procs 4 --threads 16
+
+def _app(url, max_active):
+    os.environ["DATABASE_URL"] = url
+    os.environ["DISPATCH_MAX_ACTIVE"] = str(max_active)
+    os.environ.setdefault("DRIVER_LOC_MODE", "direct")
+    from app import create_app
+    return create_app()
+
+def _worker(args):
+    url, max_active, tasks, threads = args
+    app = _app(url, max_active)
+    def claim(task):
+        oid, phone = task
+        t = time.perf_counter()
+        r = app.test_client().post(f"/api/orders/{oid}/assign", json={"driver_phone": phone})
+        return oid, phone, r.status_code, (time.perf_counter() - t) * 1000
+    with ThreadPoolExecutor(threads) as ex:
+        return list(ex.map(claim, tasks))
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", default="sqlite:////tmp/claims.db")
+    ap.add_argument("--orders", type=int, default=300)
+    ap.add_argument("--drivers", type=int, default=50)
+    ap.add_argument("--contenders", type=int, default=5)
+    ap.add_argument("--procs", type=int, default=4)
+    ap.add_argument("--threads", type=int, default=8)
+    ap.add_argument("--max-active", type=int, default=1000, help="DISPATCH_MAX_ACTIVE")
+    args = ap.parse_args()
+    random.seed(5)
+    app = _app(args.url, args.max_active)
+    from app import db
+    from app.models import Client, Driver, Order
+    with app.app_context():
+        db.create_all()
+        cl = Client.query.first() or Client(phone="+51900000000")
+        db.session.add(cl); db.session.commit()
+        phones = [f"+5197{i:07d}" for i in range(args.drivers)]
+        for ph in phones:
+            lat, lon = jitter(LIMA, 10)
+            db.session.merge(Driver(phone=ph, lat=lat, lon=lon, status="available", active_orders=0))
+        orders = []
+        for _ in range(args.orders):
+            lat, lon = jitter(LIMA, 10)
+            orders.append(Order(client_id=cl.id, address="bench", lat=lat, lon=lon, total=10.0, status="new"))
+        db.session.add_all(orders); db.session.commit()
+        oids = [o.id for o in orders]
+        before = {d.phone: d.active_orders or 0 for d in Driver.query.filter(Driver.phone.in_(phones))}
+
+    tasks = [(oid, ph) for oid in oids for ph in random.sample(phones, args.contenders)]
+    random.shuffle(tasks)
+    parts = [(args.url, args.max_active, tasks[i::args.procs], args.threads) for i in range(args.procs)]
+    t = time.perf_counter()
+    with Pool(args.procs) as pool:
+        results = [r for part in pool.map(_worker, parts) for r in part]
+    wall = time.perf_counter() - t
+
+    wins = {}
+    for oid, ph, code, _ in results:
+        if code == 200: wins.setdefault(oid, []).append(ph)
+    errors = sum(1 for r in results if r[2] not in (200, 400))
+    with app.app_context():
+        got = dict(Order.query.filter(Order.id.in_(oids)).with_entities(Order.id, Order.assigned_driver))
+        after = {d.phone: d.active_orders or 0 for d in Driver.query.filter(Driver.phone.in_(phones))}
+    per_driver = {}
+    for oid, w in wins.items(): per_driver[w[0]] = per_driver.get(w[0], 0) + 1
+    full = args.max_active < len(oids) / len(phones) + 1          # puede quedar cola sin cupo
+    once = all(len(wins[oid]) == 1 and got[oid] == wins[oid][0] if oid in wins else full and got[oid] is None
+               for oid in oids)
+    counters = all(after[ph] - before[ph] == per_driver.get(ph, 0) for ph in phones)
+    capped = all(n <= args.max_active for n in after.values())
+    s = summary([r[3] for r in results])
+    print(f"{len(results)} claims sobre {len(oids)} pedidos ({args.contenders} por pedido, "
+          f"{args.procs} procesos x {args.threads} hilos) en {wall:.2f}s = {len(results)/wall:.0f} claims/s")
+    print(f"latencia p50={s['p50']:.1f}ms p95={s['p95']:.1f}ms p99={s['p99']:.1f}ms, errores={errors}")
+    print(f"exactamente una vez: {'OK' if once else 'FALLA'}; active_orders: {'OK' if counters else 'FALLA'}; "
+          f"cupo {args.max_active}: {'OK' if capped else 'FALLA'} ({len(wins)}/{len(oids)} asignados)")
+
+if __name__ == "__main__":
+    main()
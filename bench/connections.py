@@ -0,0 +1,132 @@
+import argparse, asyncio, os, resource, signal, subprocess, sys, tempfile, time, urllib.request
+from ._common import LIMA, jitter, summary
+
+# Conexiones largas: N teléfonos con /api/feed abierto (SSE) y, mientras tanto, polling de
+# GET /api/orders. Compara gunicorn gthread (wsgi.py, un hilo por conexión activa) con
+# uvicorn (asgi.py: el feed en el event loop, el resto en un pool). Por cada N: streams que
+# llegaron a recibir la cabecera, p50/p99 del polling, errores/timeouts y RSS del servidor.
+# Un solo worker por modo; DB SQLite temporal.
+#   python -m bench.connections --conns 100,500,1000,2000 --threads 16
+
+def _server(mode, port, threads, env):
+    if mode == "wsgi":
+        cmd = [sys.executable, "-m", "gunicorn", "-w", "1", "-k", "gthread", "--threads", str(threads),
+               "--worker-connections", "10000", "-t", "120", "-b", f"127.0.0.1:{port}", "wsgi:app"]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "asgi:app", "--port", str(port), "--backlog", "4096",
+               "--log-level", "warning"]
+    p = subprocess.Popen(cmd, env={**env, "ASGI_THREADS": str(threads)},
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/ping", timeout=1); return p
+        except OSError:
+            time.sleep(0.2)
+    _stop(p); raise SystemExit(f"{mode}: el servidor no arrancó")
+
+def _stop(p):
+    # Con streams abiertos el apagado ordenado espera; se corta el grupo entero
+    os.killpg(p.pid, signal.SIGKILL); p.wait()
+
+def _rss_mb(pid):
+    # RSS del proceso y sus hijos (el worker de gunicorn)
+    pids, total = {pid}, 0
+    for d in os.listdir("/proc"):
+        if d.isdigit():
+            try:
+                with open(f"/proc/{d}/stat") as f:
+                    if int(f.read().rsplit(")", 1)[1].split()[1]) == pid: pids.add(int(d))
+            except (OSError, IndexError, ValueError): pass
+    for p in pids:
+        try:
+            with open(f"/proc/{p}/status") as f:
+                total += next(int(l.split()[1]) for l in f if l.startswith("VmRSS"))
+        except (OSError, StopIteration): pass
+    return total / 1024
+
+async def _open_stream(port, timeout):
+    # -> (writer, True si llegó la cabecera a tiempo); la conexión queda abierta igual
+    try:
+        r, w = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return None, False
+    w.write(f"GET /api/feed HTTP/1.1\r\nHost: bench\r\nAccept: text/event-stream\r\n\r\n".encode())
+    try:
+        line = await asyncio.wait_for(r.readline(), timeout)
+        return w, line.startswith(b"HTTP/1.1 200")
+    except (OSError, asyncio.TimeoutError):
+        return w, False
+
+async def _get(port, path, timeout):
+    r, w = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), timeout)
+    try:
+        w.write(f"GET {path} HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n\r\n".encode())
+        data = await asyncio.wait_for(r.read(), timeout)
+        return data.startswith(b"HTTP/1.1 200")
+    finally:
+        w.close()
+
+async def _poll(port, workers, duration, timeout):
+    lat, errors = [], 0
+    end = time.perf_counter() + duration
+
+    async def one():
+        nonlocal errors
+        while time.perf_counter() < end:
+            t = time.perf_counter()
+            try:
+                ok = await _get(port, "/api/orders", timeout)
+            except (OSError, asyncio.TimeoutError):
+                ok = False
+            if ok: lat.append((time.perf_counter() - t) * 1000)
+            else: errors += 1
+    await asyncio.gather(*(one() for _ in range(workers)))
+    return lat, errors
+
+async def _run_mode(mode, port, pid, args):
+    streams = []
+    print(f"\n{mode}")
+    print(f"{'conexiones SSE':>15}{'abiertas':>10}{'req/s':>8}{'p50 ms':>9}{'p99 ms':>9}{'errores':>9}{'RSS MB':>9}")
+    for n in sorted(int(x) for x in args.conns.split(",")):
+        opened = await asyncio.gather(*(_open_stream(port, args.timeout) for _ in range(n - len(streams))))
+        streams += opened
+        alive = sum(1 for w, ok in streams if ok)
+        lat, errors = await _poll(port, args.pollers, args.duration, args.timeout)
+        s = summary(lat) if lat else {"p50": float("nan"), "p99": float("nan")}
+        print(f"{n:>15}{alive:>10}{len(lat) / args.duration:8.0f}{s['p50']:9.1f}{s['p99']:9.1f}{errors:>9}{_rss_mb(pid):9.0f}")
+    for w, _ in streams:
+        if w: w.close()
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--conns", default="100,500,1000,2000")
+    ap.add_argument("--modes", default="wsgi,asgi")
+    ap.add_argument("--threads", type=int, default=16, help="gthread --threads / ASGI_THREADS")
+    ap.add_argument("--pollers", type=int, default=20, help="clientes haciendo polling a la vez")
+    ap.add_argument("--duration", type=float, default=5.0)
+    ap.add_argument("--timeout", type=float, default=5.0)
+    ap.add_argument("--orders", type=int, default=50)
+    args = ap.parse_args()
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))       # el servidor lo hereda
+    for i, mode in enumerate(args.modes.split(",")):
+        tmp = tempfile.mkdtemp()
+        env = {**os.environ, "DATABASE_URL": f"sqlite:///{tmp}/conns.db", "RATE_LIMIT_PATH": f"{tmp}/conns.rl",
+               "FEED_STREAM_S": "3600", "METRICS_DIR": tmp}
+        os.environ.update(env)
+        from app import create_app
+        app = create_app(); c = app.test_client()                # migra y siembra pedidos nuevos
+        c.post("/api/auth/pin", json={"phone": "+51999000111", "pin": "1234"})
+        c.post("/api/auth/verify", json={"phone": "+51999000111", "pin": "1234"})
+        for _ in range(args.orders):
+            lat, lon = jitter(LIMA, 8)
+            c.post("/api/orders", json={"address": "bench", "lat": lat, "lon": lon, "items": [{"id": 1, "qty": 1}]})
+        port = 8700 + i
+        p = _server(mode, port, args.threads, env)
+        try:
+            asyncio.run(_run_mode(mode, port, p.pid, args))
+        finally:
+            _stop(p)
+
+if __name__ == "__main__":
+    main()
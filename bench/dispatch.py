@@ -0,0 +1,31 @@
+import argparse, random, time
+from app.dispatch import GridIndex, match_batch
+from ._common import LIMA, jitter, summary
+
+# Latencia de selección de candidatos y del emparejamiento por lotes (sin DB).
+#   python -m bench.dispatch --drivers 5000 --batch 200
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--drivers", type=int, default=5000)
+    ap.add_argument("--batch", type=int, default=200)
+    ap.add_argument("--queries", type=int, default=2000)
+    args = ap.parse_args()
+    random.seed(1)
+    idx = GridIndex(); now = time.time()
+    for i in range(args.drivers):
+        lat, lon = jitter(LIMA, 15)
+        idx.update(f"d{i}", lat, lon, "available", 0, now)
+    out = []
+    for _ in range(args.queries):
+        lat, lon = jitter(LIMA, 15)
+        t = time.perf_counter(); idx.nearest(lat, lon, k=5); out.append((time.perf_counter() - t) * 1000)
+    s = summary(out)
+    print(f"nearest k=5 con {args.drivers} repartidores: p50={s['p50']:.3f}ms p99={s['p99']:.3f}ms")
+    orders = [(i, *jitter(LIMA, 15)) for i in range(args.batch)]
+    t = time.perf_counter(); pairs = match_batch(orders, idx); ms = (time.perf_counter() - t) * 1000
+    print(f"lote de {args.batch} pedidos: {len(pairs)} asignados en {ms:.1f}ms, "
+          f"{sum(p[2] for p in pairs):.1f} km en total")
+
+if __name__ == "__main__":
+    main()
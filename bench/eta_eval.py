@@ -0,0 +1,58 @@
+import argparse, math, random
+from datetime import datetime, timedelta
+from sqlalchemy.orm import Session
+from app import eta
+from app.models import Order
+from ._common import LIMA, engine_for, jitter, pct
+
+# Evaluación fuera de línea del ETA aprendido contra el fijo de 25 km/h. Entrena con el
+# primer 80% del historial (por fecha de asignación) y mide sobre el resto.
+#   python -m bench.eta_eval --db postgresql://...      (entregas reales)
+#   python -m bench.eta_eval --synthetic 50000          (tráfico simulado)
+
+def synthetic(n):
+    # Hora punta más lenta, centro más lento, ruido lognormal por entrega
+    random.seed(3)
+    t0 = datetime.utcnow() - timedelta(days=90)
+    out = []
+    for i in range(n):
+        at = t0 + timedelta(seconds=i * 90 * 86400 / n)
+        lat, lon = jitter(LIMA, 12)
+        h = (at - timedelta(hours=5)).hour
+        v = 22.0 * (0.6 if h in (7, 8, 13, 18, 19, 20) else 1.15 if h < 6 else 1.0)
+        v *= 0.75 + 0.5 * min(math.hypot(lat - LIMA[0], lon - LIMA[1]) / 0.1, 1.0)
+        km = random.uniform(0.3, 8.0)
+        out.append((lat, lon, at, km, km / v * 60 * random.lognormvariate(0, 0.25) + random.uniform(2, 6)))
+    return out
+
+def report(name, err):
+    a = [abs(e) for e in err]
+    print(f"  {name:<10} MAE={sum(a)/len(a):5.2f} min  p90={pct(a, 90):5.2f}  sesgo={sum(err)/len(err):+5.2f}")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--db")
+    ap.add_argument("--synthetic", type=int, default=0)
+    ap.add_argument("--default-kmh", type=float, default=25.0)
+    args = ap.parse_args()
+    if args.db:
+        trips = list(eta.trips(Session(engine_for(args.db)).query(Order)))
+    else:
+        trips = synthetic(args.synthetic or 50_000)
+    trips = [t for t in trips if eta.plausible(t[3], t[4])]
+    if len(trips) < 50:
+        print("muy pocas entregas con dist_km/assigned_at/delivered_at"); return
+    cut = int(len(trips) * 0.8)
+    train, test = trips[:cut], trips[cut:]
+    model = eta.EtaModel(args.default_kmh).fit(train)
+    print(f"{len(train)} entregas de entrenamiento, {len(test)} de prueba, {len(model.speeds)} celdas")
+    base = [round(km / args.default_kmh * 60) - m for _, _, _, km, m in test]
+    learned = [model.estimate(km, lat, lon, at) - m for lat, lon, at, km, m in test]
+    report("fijo", base); report("aprendido", learned)
+    rush = [i for i, t in enumerate(test) if model.hour(t[2]) in (7, 8, 13, 18, 19, 20)]
+    if rush:
+        print("hora punta:")
+        report("fijo", [base[i] for i in rush]); report("aprendido", [learned[i] for i in rush])
+
+if __name__ == "__main__":
+    main()
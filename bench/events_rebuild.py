@@ -0,0 +1,61 @@
+import argparse, os, sys, tempfile
+from ._common import LIMA
+
+# Regresión de events.rebuild(): un pedido creado mientras corre (después de leer `head`)
+# ya sumó en clients.order_count/lifetime_value pero no está en lo recorrido; el delta lo
+# restaba y dejaba los acumulados por debajo. Crea N pedidos, corre rebuild() y a mitad de
+# camino (entre el recorrido y los acumulados) crea M más desde otro cliente HTTP. Con el
+# estado ya sano no debe corregir nada y los acumulados deben coincidir con los pedidos.
+# Sale con código 1 si algo falla. DB SQLite temporal.
+#   python -m bench.events_rebuild --orders 5 --during 3
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--orders", type=int, default=5)
+    ap.add_argument("--during", type=int, default=3)
+    args = ap.parse_args()
+    tmp = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{tmp}/rebuild.db"
+    os.environ["RATE_LIMIT_PATH"] = f"{tmp}/rebuild.rl"
+    from app import create_app, db, events
+    from app.models import Client, Order
+    app = create_app(); c = app.test_client()
+    phone = "+51999555666"
+    c.post("/api/auth/pin", json={"phone": phone, "pin": "1234"})
+    c.post("/api/auth/verify", json={"phone": phone, "pin": "1234"})
+    body = {"address": "bench", "lat": LIMA[0], "lon": LIMA[1], "items": [{"id": 1, "qty": 2}]}
+
+    def create(n):
+        for _ in range(n): c.post("/api/orders", json=body)
+
+    create(args.orders)
+    fix_orders = events._fix_orders
+    def interleaved(*a):
+        # Con pocos eventos es una sola llamada, justo antes de los acumulados de clients
+        n = fix_orders(*a)
+        create(args.during)
+        return n
+    events._fix_orders = interleaved
+    try:
+        with app.app_context():
+            fixed = events.rebuild()
+    finally:
+        events._fix_orders = fix_orders
+
+    with app.app_context():
+        cl = db.session.query(Client).filter_by(phone=phone).one()
+        orders = db.session.query(Order).filter_by(client_id=cl.id).all()
+        want = (len(orders), round(sum(o.total for o in orders), 2))
+        got = (cl.order_count, round(cl.lifetime_value or 0, 2))
+    print(f"corregidos {fixed}")
+    print(f"clients: {got[0]} pedidos / {got[1]:.2f}; orders: {want[0]} / {want[1]:.2f}")
+    bad = []
+    if want[0] != args.orders + args.during: bad.append("pedidos creados")
+    if fixed["clients"]: bad.append("rebuild corrigió clients sanos")
+    if got != want: bad.append("acumulados de clients")
+    if bad:
+        print("Falla:", ", ".join(bad)); sys.exit(1)
+    print("OK")
+
+if __name__ == "__main__":
+    main()
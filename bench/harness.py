@@ -0,0 +1,201 @@
+import argparse, json, os, random, re, subprocess, sys, threading, time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from sqlalchemy import event
+from ._common import LIMA, engine_for, jitter, seed, summary
+
+# Carga mixta contra la app de create_app (cliente de pruebas de Flask, sin red): altas de
+# pedidos, pings GPS, el refresco del panel cada 5 s y carreras por tomar el mismo pedido.
+# Mide latencia, throughput y consultas a la DB por endpoint y guarda un JSON comparable
+# entre commits.
+#   python -m bench.harness --ops 5000 --out base.json
+#   python -m bench.harness --ops 5000 --out nuevo.json --compare base.json
+#   python -m bench.harness --replay trafico.jsonl      (líneas {"method","path","json"?,"headers"?})
+
+MIX = {"create": 30, "ping": 40, "panel": 15, "race": 15}
+CLIENT_PHONE = "+519{:08d}"          # teléfonos de bench._common.seed
+DRIVER_PHONE = "+518{:08d}"
+
+def endpoint(method, path):
+    return f"{method} " + re.sub(r"/\d+(?=/|$)", "/<id>", path.split("?")[0])
+
+def git_rev():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+class Recorder:
+    # Latencia y consultas por endpoint; las consultas se cuentan en un contador por llamada
+    # colgado del hilo (los jobs de fondo corren en otros hilos y no se mezclan). Con la cola
+    # de escritura de SQLite el hilo db-writer adopta el contador de quien espera (writer.carry)
+    def __init__(self, engine):
+        from app import writer
+        self.local = threading.local()
+        self.samples = defaultdict(list)     # endpoint -> [(ms, consultas, status)]
+        self.lock = threading.Lock()
+        event.listen(engine, "before_cursor_execute", self._count)
+        writer.writes.carry.append((self.local, "box"))
+
+    def _count(self, *a):
+        box = getattr(self.local, "box", None)
+        if box is not None: box[0] += 1
+
+    def call(self, client, method, path, **kw):
+        box = self.local.box = [0]
+        t = time.perf_counter()
+        try:
+            r = client.open(path, method=method, **kw)
+        finally:
+            self.local.box = None
+        ms = (time.perf_counter() - t) * 1000
+        with self.lock:
+            self.samples[endpoint(method, path)].append((ms, box[0], r.status_code))
+        return r
+
+    def report(self, wall_s):
+        out = {}
+        for ep, rows in sorted(self.samples.items()):
+            s = summary([r[0] for r in rows])
+            q = [r[1] for r in rows if r[2] < 400] or [r[1] for r in rows]    # consultas de las exitosas
+            out[ep] = {**{k: round(v, 3) for k, v in s.items()}, "rps": round(len(rows) / wall_s, 1),
+                       "queries_mean": round(sum(q) / len(q), 2), "queries_max": max(q),
+                       "errors": sum(1 for r in rows if r[2] >= 500),
+                       "status": {str(c): sum(1 for r in rows if r[2] == c) for c in sorted({r[2] for r in rows})}}
+        return out
+
+
+class Workload:
+    def __init__(self, app, rec, args):
+        self.app, self.rec, self.args = app, rec, args
+        self.new = []                         # pedidos nuevos por los que compiten los repartidores
+        self.lock = threading.Lock()
+        self.menu = [it["id"] for it in app.test_client().get("/api/menu").json["items"]]
+
+    def login(self, i):
+        c = self.app.test_client()
+        phone, h = CLIENT_PHONE.format(i), {"X-Forwarded-For": f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}"}
+        c.post("/api/auth/pin", json={"phone": phone, "pin": "1234"}, headers=h)
+        c.post("/api/auth/verify", json={"phone": phone, "pin": "1234"}, headers=h)
+        return c
+
+    def create(self, c):
+        lat, lon = jitter(LIMA, 10)
+        items = [{"id": random.choice(self.menu), "qty": random.randint(1, 3)} for _ in range(random.randint(1, 3))]
+        r = self.rec.call(c, "POST", "/api/orders", json={"address": "Calle bench", "lat": lat, "lon": lon, "items": items})
+        if r.status_code == 200:
+            with self.lock: self.new.append(r.json["order"]["id"])
+
+    def ping(self, c):
+        lat, lon = jitter(LIMA, 12)
+        self.rec.call(c, "PUT", "/api/drivers", json={"phone": DRIVER_PHONE.format(random.randint(1, self.args.drivers)),
+                                                        "lat": lat, "lon": lon})
+
+    def panel(self, c):
+        r = self.rec.call(c, "GET", "/api/orders/all?limit=500&status=new,assigned,delivering")
+        while r.status_code == 200 and r.json.get("next"):
+            r = self.rec.call(c, "GET", "/api/orders/all?limit=500&status=new,assigned,delivering&cursor=" + r.json["next"])
+        self.rec.call(c, "GET", "/api/drivers")
+        self.rec.call(c, "GET", "/api/stats")
+
+    def race(self, c):
+        # Todos los hilos apuntan al pedido nuevo más reciente: compiten de verdad
+        with self.lock:
+            oid = self.new[-1] if self.new else None
+        if oid is None: return self.create(c)
+        phone = DRIVER_PHONE.format(random.randint(1, self.args.drivers))
+        r = self.rec.call(c, "POST", f"/api/orders/{oid}/assign", json={"driver_phone": phone})
+        if r.status_code == 200:
+            with self.lock:
+                if oid in self.new: self.new.remove(oid)
+            self.rec.call(c, "POST", f"/api/orders/{oid}/deliver")
+        elif r.status_code == 400:
+            with self.lock:
+                if oid in self.new: self.new.remove(oid)
+
+
+def run_mix(app, rec, args):
+    w = Workload(app, rec, args)
+    clients = [w.login(i) for i in range(1, args.sessions + 1)]
+    ops = random.choices(list(MIX), weights=list(MIX.values()), k=args.ops)
+    def worker(k):
+        c = clients[k % len(clients)]
+        for i in range(k, len(ops), args.threads):
+            getattr(w, ops[i])(c)
+    t = time.perf_counter()
+    with ThreadPoolExecutor(args.threads) as ex:
+        list(ex.map(worker, range(args.threads)))
+    return time.perf_counter() - t
+
+def run_replay(app, rec, args):
+    with open(args.replay) as f:
+        reqs = [json.loads(line) for line in f if line.strip()]
+    w = Workload(app, rec, args)
+    clients = [w.login(i) for i in range(1, args.threads + 1)]
+    def worker(k):
+        for r in reqs[k::args.threads]:
+            rec.call(clients[k], r.get("method", "GET"), r["path"], json=r.get("json"), headers=r.get("headers"))
+    t = time.perf_counter()
+    with ThreadPoolExecutor(args.threads) as ex:
+        list(ex.map(worker, range(args.threads)))
+    return time.perf_counter() - t
+
+def compare(cur, base, tol):
+    # Regresión: p95 peor en más de `tol` o más consultas promedio por llamada
+    bad = []
+    print(f"{'endpoint':<34}{'p95 base':>10}{'p95 ahora':>11}{'Δ':>8}{'q base':>8}{'q ahora':>9}")
+    for ep, now in cur["endpoints"].items():
+        old = base["endpoints"].get(ep)
+        if not old:
+            print(f"{ep:<34}{'—':>10}{now['p95']:>11.2f}"); continue
+        d = (now["p95"] - old["p95"]) / old["p95"] if old["p95"] else 0.0
+        flag = d > tol or now["queries_mean"] > old["queries_mean"] + 0.01
+        if flag: bad.append(ep)
+        print(f"{ep:<34}{old['p95']:>10.2f}{now['p95']:>11.2f}{d:>+8.0%}{old['queries_mean']:>8.2f}"
+              f"{now['queries_mean']:>9.2f}{'  <-- regresión' if flag else ''}")
+    return bad
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", default="sqlite:////tmp/bench_harness.db")
+    ap.add_argument("--orders", type=int, default=100_000)
+    ap.add_argument("--clients", type=int, default=20_000)
+    ap.add_argument("--drivers", type=int, default=2_000)
+    ap.add_argument("--ops", type=int, default=5000)
+    ap.add_argument("--threads", type=int, default=8)
+    ap.add_argument("--sessions", type=int, default=100)
+    ap.add_argument("--replay")
+    ap.add_argument("--out")
+    ap.add_argument("--compare")
+    ap.add_argument("--tolerance", type=float, default=0.15)
+    args = ap.parse_args()
+    random.seed(11)
+    seed(engine_for(args.url), orders=args.orders, clients=args.clients, drivers=args.drivers)
+    os.environ.update(DATABASE_URL=args.url, PIN_BURST_IP="1000000", PIN_BURST_PHONE="1000000",
+                      RATE_LIMIT_PATH=f"/tmp/bench_harness_{os.getpid()}.rl")
+    from app import create_app, db
+    app = create_app()
+    with app.app_context():
+        rec = Recorder(db.engine)
+    wall = run_replay(app, rec, args) if args.replay else run_mix(app, rec, args)
+    eps = rec.report(wall)
+    total = sum(len(v) for v in rec.samples.values())
+    result = {"meta": {"commit": git_rev(), "at": datetime.utcnow().isoformat(), "db": args.url.split(":")[0],
+                       "orders": args.orders, "clients": args.clients, "drivers": args.drivers,
+                       "ops": args.ops, "threads": args.threads, "replay": args.replay},
+              "total": {"requests": total, "wall_s": round(wall, 3), "rps": round(total / wall, 1)},
+              "endpoints": eps}
+    print(f"{total} peticiones en {wall:.1f}s = {total / wall:.0f} req/s ({args.threads} hilos)")
+    for ep, s in eps.items():
+        print(f"  {ep:<34} n={s['n']:<6} p50={s['p50']:7.2f} p95={s['p95']:7.2f} p99={s['p99']:7.2f} ms  "
+              f"q/llamada={s['queries_mean']:5.2f}  {s['status']}")
+    if args.out:
+        with open(args.out, "w") as f: json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f: base = json.load(f)
+        if compare(result, base, args.tolerance): sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import argparse, os, sys, tempfile, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import event, func
+from ._common import LIMA, summary
+
+# Reintentos con Idempotency-Key sobre POST /api/orders y /assign: la primera llamada hace
+# la transacción completa; los reintentos al mismo worker responden desde el LRU sin
+# consultas y los de otro worker (LRU vacío) con un SELECT. Verifica que queda un solo
+# pedido, que order_count del cliente cuadra y que N reintentos simultáneos con
+# la misma clave no duplican. Sale con código 1 si algo falla. DB SQLite temporal.
+#   python -m bench.idempotency --retries 200
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--retries", type=int, default=200)
+    ap.add_argument("--concurrent", type=int, default=16)
+    args = ap.parse_args()
+    tmp = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{tmp}/idem.db"
+    os.environ["RATE_LIMIT_PATH"] = f"{tmp}/idem.rl"
+    from app import create_app, db, idempotency
+    from app.models import Client, Order
+    app = create_app(); c = app.test_client()
+    phone = "+51999111222"
+    c.post("/api/auth/pin", json={"phone": phone, "pin": "1234"})
+    c.post("/api/auth/verify", json={"phone": phone, "pin": "1234"})
+    body = {"address": "Calle bench", "lat": LIMA[0], "lon": LIMA[1], "items": [{"id": 1, "qty": 2}]}
+    c.get("/api/stats"); time.sleep(0.5)                 # jobs de arranque fuera de la medición
+
+    queries = [0]
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", lambda *a: queries.__setitem__(0, queries[0] + 1))
+
+    def call(key, other_worker=False, path="/api/orders", json=body):
+        if other_worker: idempotency.store.cache.clear(); idempotency.store.used = 0
+        queries[0] = 0
+        t = time.perf_counter()
+        r = c.post(path, json=json, headers={"Idempotency-Key": key})
+        return r, queries[0], (time.perf_counter() - t) * 1000
+
+    bad = []
+    rows = {}
+    first, q, ms = call("k-1")
+    rows["primera llamada (transacción)"] = ([q], [ms])
+    for name, other in (("reintento, mismo worker (LRU)", False), ("reintento, otro worker (DB)", True)):
+        qs, mss = [], []
+        for _ in range(args.retries):
+            r, q, ms = call("k-1", other)
+            qs.append(q); mss.append(ms)
+            if r.json != first.json or r.headers.get("Idempotent-Replayed") != "true": bad.append(name)
+        rows[name] = (qs, mss)
+    qs, mss = [], []
+    for i in range(max(args.retries // 10, 1)):
+        r, q, ms = call(f"sin-reintento-{i}")
+        qs.append(q); mss.append(ms)
+    rows["pedido nuevo con clave (referencia)"] = (qs, mss)
+
+    print(f"{'POST /api/orders':<38}{'consultas':>10}{'p50 ms':>9}{'p95 ms':>9}")    # consultas: la mediana
+    for name, (qs, mss) in rows.items():
+        s = summary(mss)
+        print(f"{name:<38}{sorted(qs)[len(qs) // 2]:>10}{s['p50']:9.2f}{s['p95']:9.2f}")
+
+    oid = first.json["order"]["id"]
+    a1, q1, _ = call("a-1", path=f"/api/orders/{oid}/assign", json={"driver_phone": "+51970000001"})
+    a2, q2, _ = call("a-1", path=f"/api/orders/{oid}/assign", json={"driver_phone": "+51970000001"})
+    print(f"assign: {a1.status_code} ({q1} consultas), reintento {a2.status_code} ({q2} consultas)")
+    if a1.status_code != 200 or a2.json != a1.json: bad.append("assign")
+    r, _, _ = call("k-1", json={**body, "address": "otra"})
+    if r.status_code != 422: bad.append("otro cuerpo con la misma clave")
+
+    # Reintentos simultáneos: una sola ejecución; el resto 409 (en curso) o la respuesta guardada
+    with app.app_context():
+        before = db.session.query(func.count(Order.id)).scalar(); db.session.remove()
+    cookie = app.config["SESSION_COOKIE_NAME"]
+    clients = [app.test_client() for _ in range(args.concurrent)]
+    for k in clients: k.set_cookie(cookie, c.get_cookie(cookie).value)     # misma sesión
+    barrier = threading.Barrier(args.concurrent)
+
+    def race(k):
+        barrier.wait()
+        return k.post("/api/orders", json=body, headers={"Idempotency-Key": "race"}).status_code
+    with ThreadPoolExecutor(args.concurrent) as ex:
+        codes = list(ex.map(race, clients))
+    with app.app_context():
+        made = db.session.query(func.count(Order.id)).scalar() - before
+        cl = db.session.query(Client).filter_by(phone=phone).one()
+        total = db.session.query(func.count(Order.id)).filter(Order.client_id == cl.id).scalar()
+        print(f"{args.concurrent} simultáneos: {codes.count(200)}x200 {codes.count(409)}x409, pedidos creados: {made}")
+        print(f"order_count={cl.order_count} (pedidos del cliente: {total})")
+        if made != 1: bad.append("simultáneos")
+        if cl.order_count != total: bad.append("order_count")
+    if bad:
+        print("Falla:", ", ".join(sorted(set(bad)))); sys.exit(1)
+
+if __name__ == "__main__":
+    main()
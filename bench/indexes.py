@@ -0,0 +1,68 @@
+import argparse, json, random
+from sqlalchemy import text
+from app import db, migrations
+from ._common import engine_for, seed, timed
+
+# Planes y latencias de las consultas calientes antes/después de la migración de índices.
+#   python -m bench.indexes --orders 1000000 [--url postgresql://localhost/bench]
+
+QUERIES = {
+    "orders_new":      ("SELECT id, address, total, lat, lon, created_at FROM orders "
+                        "WHERE status = 'new' ORDER BY created_at DESC", {}),
+    "orders_all_page": ("SELECT id, status, address, total, assigned_driver, eta_min, created_at FROM orders "
+                        "ORDER BY created_at DESC, id DESC LIMIT 51", {}),
+    "orders_active":   ("SELECT id, status, address, total, assigned_driver, eta_min, created_at FROM orders "
+                        "WHERE status IN ('new', 'assigned', 'delivering') ORDER BY created_at DESC, id DESC LIMIT 501", {}),
+    "orders_driver":   ("SELECT id, status, created_at FROM orders WHERE assigned_driver = :drv "
+                        "ORDER BY created_at DESC LIMIT 51", {"drv": lambda a: f"+518{random.randint(1, a.drivers):08d}"}),
+    "addresses":       ("SELECT * FROM addresses WHERE client_id = :cid ORDER BY created_at DESC",
+                        {"cid": lambda a: random.randint(1, a.clients)}),
+    "auth_pin":        ("SELECT pin_hash FROM auth_pins WHERE client_id = :cid LIMIT 1",
+                        {"cid": lambda a: random.randint(1, a.clients)}),
+    "order_items":     ("SELECT * FROM order_items WHERE order_id = :oid",
+                        {"oid": lambda a: random.randint(1, a.orders)}),
+    "drivers":         ("SELECT * FROM drivers ORDER BY updated_at DESC", {}),
+}
+
+def drop_indexes(engine):
+    with engine.begin() as c:
+        for t in db.metadata.sorted_tables:
+            for idx in t.indexes:
+                c.exec_driver_sql(f"DROP INDEX IF EXISTS {idx.name}")
+        c.exec_driver_sql("DROP TABLE IF EXISTS schema_version")
+
+def measure(engine, args, label):
+    pg = engine.dialect.name == "postgresql"
+    out = {}
+    with engine.connect() as c:
+        c.exec_driver_sql("ANALYZE")
+        for name, (sql, params) in QUERIES.items():
+            bind = lambda: {k: f(args) for k, f in params.items()}
+            plan = c.execute(text(("EXPLAIN " if pg else "EXPLAIN QUERY PLAN ") + sql), bind()).fetchall()
+            plan = [r[0] if pg else r[-1] for r in plan]
+            stats = timed(lambda: c.execute(text(sql), bind()).fetchall(), n=args.runs)
+            out[name] = {"plan": plan, **stats}
+            print(f"[{label}] {name:16s} p50={stats['p50']:8.2f}ms p95={stats['p95']:8.2f}ms  {' | '.join(plan)[:110]}")
+    return out
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", default="sqlite:////tmp/bench_indexes.db")
+    ap.add_argument("--orders", type=int, default=1_000_000)
+    ap.add_argument("--clients", type=int, default=100_000)
+    ap.add_argument("--drivers", type=int, default=3_000)
+    ap.add_argument("--runs", type=int, default=20)
+    ap.add_argument("--out")
+    args = ap.parse_args()
+    engine = engine_for(args.url)
+    seed(engine, orders=args.orders, clients=args.clients, drivers=args.drivers)
+    drop_indexes(engine)
+    before = measure(engine, args, "antes")
+    migrations.upgrade(engine)
+    after = measure(engine, args, "después")
+    if args.out:
+        json.dump({"url": engine.url.render_as_string(hide_password=True), "orders": args.orders,
+                   "before": before, "after": after}, open(args.out, "w"), indent=2)
+
+if __name__ == "__main__":
+    main()
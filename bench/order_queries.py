@@ -0,0 +1,77 @@
+import argparse, os, random, sys, tempfile, threading
+from sqlalchemy import event, insert
+from ._common import LIMA, jitter
+
+# Consultas por listado con ?include=items,client a medida que crece la página: deben
+# ser las mismas con 10 que con 400 pedidos. Compara con recorrer Order.items en lazy
+# (una consulta por pedido). Sale con código 1 si alguna cuenta crece. DB SQLite temporal.
+#   python -m bench.order_queries --sizes 10,100,400
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="10,100,400")
+    args = ap.parse_args()
+    sizes = sorted(int(x) for x in args.sizes.split(","))
+    tmp = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{tmp}/orders.db"
+    os.environ["RATE_LIMIT_PATH"] = f"{tmp}/orders.rl"
+    from app import create_app, db
+    from app.models import Client, Order, OrderItem
+    app = create_app(); c = app.test_client()
+    random.seed(5)
+
+    queries = [0]
+    with app.app_context():
+        main_t = threading.get_ident()       # los jobs de fondo no cuentan
+        event.listen(db.engine, "before_cursor_execute",
+                     lambda *a: threading.get_ident() == main_t and queries.__setitem__(0, queries[0] + 1))
+
+    c.get("/api/stats")                     # primera petición fuera de la medición (caches)
+    c.get("/api/orders/all")                # y la lista de meses archivados
+
+    def count(fn):
+        queries[0] = 0; fn(); return queries[0]
+
+    def lazy(n):
+        with app.app_context():
+            for o in Order.query.order_by(Order.id.desc()).limit(n): len(o.items)
+            db.session.remove()
+
+    near = f"{LIMA[0]},{LIMA[1]}"
+    checks = {
+        "GET /api/orders?include=items,client": lambda n: c.get("/api/orders?include=items,client"),
+        "GET /api/orders?near=&include=items,client": lambda n: c.get(f"/api/orders?near={near}&radius_km=50&include=items,client"),
+        "GET /api/orders/all?include=items,client": lambda n: c.get(f"/api/orders/all?limit={n}&include=items,client"),
+        "lazy Order.items (antes)": lazy,
+    }
+    table, made = {name: [] for name in checks}, 0
+    for n in sizes:
+        with app.app_context():
+            t = lambda m: m.__table__
+            cids = [db.session.execute(insert(t(Client)).values(phone=f"+517{i:08d}")).inserted_primary_key[0]
+                    for i in range(made, n)]
+            for cid in cids:
+                lat, lon = jitter(LIMA, 8)
+                oid = db.session.execute(insert(t(Order)).values(client_id=cid, address="Calle bench", lat=lat,
+                                                                  lon=lon, total=40.0, status="new")).inserted_primary_key[0]
+                db.session.execute(insert(t(OrderItem)), [{"order_id": oid, "name": "Chaufa", "qty": 1, "price": 20.0},
+                                                          {"order_id": oid, "name": "Inka", "qty": 2, "price": 10.0}])
+            db.session.commit()
+        made = n
+        for name, fn in checks.items():
+            table[name].append(count(lambda: fn(n)))
+        r = c.get(f"/api/orders/all?limit={n}&include=items,client").json
+        assert len(r["rows"]) == n and all(len(row[-2]) == 2 and row[-1] for row in r["rows"]), "faltan ítems/cliente"
+
+    print(f"{'consultas por llamada':<46}" + "".join(f"{f'N={n}':>8}" for n in sizes))
+    bad = []
+    for name, counts in table.items():
+        print(f"{name:<46}" + "".join(f"{q:>8}" for q in counts))
+        if not name.startswith("lazy") and len(set(counts)) > 1: bad.append(name)
+    q = count(lambda: c.get("/api/orders/1"))
+    print(f"{'GET /api/orders/<id>':<46}{q:>8}")
+    if bad:
+        print("Crecen con N:", ", ".join(bad)); sys.exit(1)
+
+if __name__ == "__main__":
+    main()
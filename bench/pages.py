@@ -0,0 +1,43 @@
+import argparse, os, time
+from flask import render_template_string, session
+from app import create_app
+from app.base import BASE_SHELL
+from app.web.cliente import CLIENTE_HTML
+
+# Peticiones/seg de /cliente: render anidado con render_template_string (antes) contra la
+# plantilla precompilada con herencia (después), y la visita repetida con If-None-Match.
+#   python -m bench.pages --n 2000
+
+OLD_SHELL = BASE_SHELL.replace("{% block content %}{% endblock %}", "{{ content|safe }}")
+
+def rps(client, path, n, headers=None):
+    client.get(path, headers=headers)
+    t = time.perf_counter()
+    for _ in range(n):
+        r = client.get(path, headers=headers)
+    return n / (time.perf_counter() - t), r.status_code
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=2000)
+    args = ap.parse_args()
+    os.environ.setdefault("DATABASE_URL", "sqlite:////tmp/bench_pages.db")
+    app = create_app()
+
+    @app.route("/cliente-antes")
+    def cliente_antes():
+        ctx = dict(title="Cliente", tab="c", session=session, phone=session.get("phone", ""))
+        inner = render_template_string(CLIENTE_HTML, **ctx)
+        return render_template_string(OLD_SHELL, content=inner, **ctx)
+
+    c = app.test_client()
+    before, _ = rps(c, "/cliente-antes", args.n)
+    after, _ = rps(c, "/cliente", args.n)
+    etag = c.get("/cliente").headers["ETag"]
+    cached, code = rps(c, "/cliente", args.n, headers={"If-None-Match": etag})
+    print(f"/cliente antes (render_template_string x2): {before:8.0f} req/s")
+    print(f"/cliente después (precompilada):            {after:8.0f} req/s")
+    print(f"/cliente revisita con ETag ({code}):          {cached:8.0f} req/s")
+
+if __name__ == "__main__":
+    main()
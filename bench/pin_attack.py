@@ -0,0 +1,49 @@
+import argparse, os, random, tempfile, time
+from sqlalchemy import event
+
+# Fuerza bruta contra /api/auth/verify: cuántas consultas a la DB cuesta cada intento y
+# cuántos se cortan por rate limit. DB SQLite temporal.
+#   python -m bench.pin_attack --attempts 2000
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--attempts", type=int, default=2000)
+    ap.add_argument("--users", type=int, default=200)
+    args = ap.parse_args()
+    tmp = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{tmp}/pins.db"
+    os.environ["RATE_LIMIT_PATH"] = f"{tmp}/pins.rl"
+    from app import create_app, db
+    app = create_app(); c = app.test_client()
+    random.seed(9)
+    users = [(f"9{i:08d}", f"{random.randrange(10000):04d}") for i in range(args.users)]
+    for i, (ph, pin) in enumerate(users):
+        c.post("/api/auth/pin", json={"phone": ph, "pin": pin}, headers={"X-Forwarded-For": f"10.9.{i // 250}.{i % 250}"})
+
+    queries = [0]
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", lambda *a: queries.__setitem__(0, queries[0] + 1))
+
+    def run(name, attempts):
+        queries[0] = 0; codes = {}
+        t = time.perf_counter()
+        for ip, phone, pin in attempts:
+            r = c.post("/api/auth/verify", json={"phone": phone, "pin": pin}, headers={"X-Forwarded-For": ip})
+            codes[r.status_code] = codes.get(r.status_code, 0) + 1
+        s = time.perf_counter() - t
+        print(f"{name:<42} {len(attempts)} intentos, {len(attempts)/s:,.0f}/s, "
+              f"{queries[0]/len(attempts):.3f} consultas/intento, respuestas {dict(sorted(codes.items()))}")
+
+    n = args.attempts
+    victim = users[0][0]
+    run("1 IP contra 1 teléfono", [("203.0.113.1", victim, f"{i:04d}") for i in range(n)])
+    run("IPs rotativas contra 1 teléfono", [(f"198.51.{i // 250}.{i % 250}", users[1][0], f"{i:04d}") for i in range(n)])
+    run("1 IP, teléfonos inexistentes", [("203.0.113.2", f"97{i:07d}", "0000") for i in range(n)])
+    unknown = [f"96{i:07d}" for i in range(50)]
+    run("IPs rotativas, 50 teléfonos inexistentes", [(f"192.0.{i // 250}.{i % 250}", unknown[i % 50], "0000") for i in range(n)])
+    ok = [(f"100.64.{i // 250}.{i % 250}", ph, pin) for i, (ph, pin) in enumerate(users[2:])]
+    run("logins legítimos (PIN correcto)", ok)
+    run("los mismos otra vez (credencial en cache)", [(f"100.65.{i // 250}.{i % 250}", ph, pin) for i, (_, ph, pin) in enumerate(ok)])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import argparse, json, os, tempfile, time
+from ._common import engine_for, seed, summary
+
+# Serialización de /api/orders/all y /api/drivers con 10k/100k filas: la versión anterior
+# (objetos ORM + isoformat() + json de la stdlib) contra columnas como tuplas con la stdlib
+# (JSON_FAST=0) y con orjson, y lo que pesa la respuesta con gzip/brotli. En /orders/all se
+# mide la primera página (limit=500) y recorrer todo el historial con el cursor.
+#   python -m bench.serialize --sizes 10000,100000 --repeat 5
+
+def _old_drivers():
+    from app.models import Driver
+    rows = Driver.query.order_by(Driver.updated_at.desc()).all()
+    return json.dumps({"ok": True, "list": [{
+        "phone": r.phone, "lat": r.lat, "lon": r.lon, "status": r.status,
+        "active_orders": r.active_orders, "updated_at": r.updated_at.isoformat()} for r in rows]})
+
+def _old_orders(limit):
+    from app.models import Order
+    rows = Order.query.order_by(Order.created_at.desc(), Order.id.desc()).limit(limit).all()
+    return json.dumps({"ok": True, "rows": [
+        [o.id, o.status, o.address, o.total, o.assigned_driver, o.eta_min, o.created_at.isoformat()]
+        for o in rows]})
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="10000,100000")
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+    from app import serial
+    print(f"orjson: {'sí' if serial.orjson else 'no'}  brotli: {'sí' if serial.brotli else 'no'}")
+    for n in (int(x) for x in args.sizes.split(",")):
+        tmp = tempfile.mkdtemp()
+        url = f"sqlite:///{tmp}/ser.db"
+        seed(engine_for(url), orders=n, clients=2000, drivers=n, log=lambda *a: None)
+        os.environ.update(DATABASE_URL=url, RATE_LIMIT_PATH=f"{tmp}/ser.rl", ARCHIVE_AFTER_DAYS="100000")
+        from app import create_app, db
+        app = create_app(); c = app.test_client()
+
+        def walk():
+            cur, pages = None, 0
+            while True:
+                r = c.get("/api/orders/all?limit=500" + (f"&cursor={cur}" if cur else "")).json
+                cur = r["next"]; pages += 1
+                if not cur: return pages
+
+        def old(fn):
+            def run():
+                with app.app_context():
+                    fn(); db.session.remove()
+            return run
+
+        def measure(fn, reps):
+            out = []
+            for _ in range(reps):
+                t = time.perf_counter(); fn(); out.append((time.perf_counter() - t) * 1000)
+            return summary(out)["p50"]
+
+        cases = {
+            "GET /api/drivers": ("/api/drivers", old(_old_drivers)),
+            "GET /api/orders/all?limit=500": ("/api/orders/all?limit=500", old(lambda: _old_orders(500))),
+        }
+        print(f"\nN={n}")
+        print(f"{'':<32}{'antes':>9}{'stdlib':>9}{'orjson':>9}  ms p50   {'bytes':>10}{'gzip':>9}{'br':>9}")
+        for name, (path, before) in cases.items():
+            ms = [measure(before, args.repeat)]
+            for fast in (False, True):
+                app.json.fast = fast
+                ms.append(measure(lambda: c.get(path), args.repeat))
+            sizes = [len(c.get(path, headers={"Accept-Encoding": enc}).data) if enc else len(c.get(path).data)
+                     for enc in ("", "gzip", "br")]
+            br = f"{sizes[2]:>9}" if serial.brotli else f"{'-':>9}"
+            print(f"{name:<32}" + "".join(f"{m:9.1f}" for m in ms) + f"{'':9}{sizes[0]:>10}{sizes[1]:>9}" + br)
+        walks = []
+        for fast in (False, True):
+            app.json.fast = fast
+            t = time.perf_counter(); pages = walk(); walks.append((time.perf_counter() - t) * 1000)
+        print(f"{f'recorrer /orders/all ({pages} págs.)':<32}{'':>9}" + "".join(f"{m:9.0f}" for m in walks))
+
+if __name__ == "__main__":
+    main()
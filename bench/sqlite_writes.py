@@ -0,0 +1,82 @@
+import argparse, os, random, tempfile, time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import get_context
+from ._common import LIMA, jitter, summary
+
+# Escrituras concurrentes sobre un solo archivo SQLite desde varios procesos (como los
+# workers de gunicorn): altas de pedido, pings en modo directo y asignaciones. Compara
+# SQLITE_MODE=plain (lo de antes: journal por defecto, commit por petición) con "tuned"
+# (WAL + pragmas + cola de escritura con group commit). Cuenta los 500 ("database is locked").
+#   python -m bench.sqlite_writes --procs 4 --threads 16 --ops 400
+
+MIX = {"create": 40, "ping": 40, "assign": 20}
+
+def _app(url, mode):
+    os.environ.update(DATABASE_URL=url, SQLITE_MODE=mode, DRIVER_LOC_MODE="direct",
+                      RATE_LIMIT_PATH=url.replace("sqlite:///", "") + ".rl")
+    from app import create_app
+    return create_app()
+
+def _worker(args):
+    url, mode, k, ops, threads, drivers = args
+    app = _app(url, mode)
+    random.seed(k)
+    h = {"X-Forwarded-For": f"10.1.{k}.1"}
+    clients = []
+    for i in range(threads):
+        c = app.test_client()
+        c.post("/api/auth/verify", json={"phone": f"9{k:02d}{i:06d}", "pin": "1234"}, headers=h)
+        clients.append(c)
+    mine = []
+
+    def op(i):
+        c = clients[i % threads]; kind = random.choices(list(MIX), weights=list(MIX.values()))[0]
+        t = time.perf_counter()
+        if kind == "create":
+            lat, lon = jitter(LIMA, 10)
+            r = c.post("/api/orders", json={"address": "bench", "lat": lat, "lon": lon, "items": [{"id": 1, "qty": 1}]})
+            if r.status_code == 200: mine.append(r.json["order"]["id"])
+        elif kind == "ping":
+            lat, lon = jitter(LIMA, 10)
+            r = c.put("/api/drivers", json={"phone": f"+5197{random.randrange(drivers):07d}", "lat": lat, "lon": lon})
+        else:
+            if not mine: return kind, 0, 0.0
+            r = c.post(f"/api/orders/{mine.pop()}/assign", json={"driver_phone": f"+5197{random.randrange(drivers):07d}"})
+        return kind, r.status_code, (time.perf_counter() - t) * 1000
+
+    with ThreadPoolExecutor(threads) as ex:
+        return list(ex.map(op, range(ops)))
+
+def run(mode, args):
+    tmp = tempfile.mkdtemp()
+    url = f"sqlite:///{tmp}/writes.db"
+    app = _app(url, mode)                         # migra y siembra PINs
+    c = app.test_client()
+    for k in range(args.procs):
+        for i in range(args.threads):
+            c.post("/api/auth/pin", json={"phone": f"9{k:02d}{i:06d}", "pin": "1234"},
+                   headers={"X-Forwarded-For": f"10.2.{k}.{i}"})
+    tasks = [(url, mode, k, args.ops, args.threads, args.drivers) for k in range(args.procs)]
+    t = time.perf_counter()
+    with get_context("spawn").Pool(args.procs) as pool:
+        res = [r for part in pool.map(_worker, tasks) for r in part if r[1]]
+    wall = time.perf_counter() - t
+    ok = [r for r in res if r[1] < 500]
+    s = summary([r[2] for r in ok]) if ok else {"p50": 0, "p95": 0, "p99": 0}
+    by = {k: sum(1 for r in res if r[0] == k and r[1] >= 500) for k in MIX}
+    print(f"{mode:<6} {len(ok)/wall:8.0f} escrituras ok/s  p50={s['p50']:6.1f} p95={s['p95']:7.1f} ms  "
+          f"errores 500: {len(res) - len(ok)} {by}")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--procs", type=int, default=4)
+    ap.add_argument("--threads", type=int, default=16)
+    ap.add_argument("--ops", type=int, default=400, help="por proceso")
+    ap.add_argument("--drivers", type=int, default=200)
+    ap.add_argument("--modes", default="plain,tuned")
+    args = ap.parse_args()
+    for mode in args.modes.split(","):
+        run(mode, args)
+
+if __name__ == "__main__":
+    main()